@@ -41,11 +41,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'attendance.sql_profiler.SqlProfilerMiddleware',
+    'attendance.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'attendance.middleware.UserContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +57,7 @@ ROOT_URLCONF = 'EDUsys.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'attendance.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,6 +85,92 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# Holds the data of the class reports. Their versions are kept in the database, so every server process
+# sees a change at once. Use 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION
+# directory to share the reports themselves between several server processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a generated class report is kept in the cache
+REPORT_CACHE_TIMEOUT = 60 * 60
+
+
+# SMS gateway used to inform parents of absences, see attendance/sms_sender.py for the other settings.
+# Point it at http://127.0.0.1:8025/sendsms and run `python manage.py sms_stub_gateway` to test offline.
+
+SMS_GATEWAY_URL = "http://sms.lyvee.com/sendsms"
+
+SMS_GATEWAY_CONCURRENCY = 4
+
+SMS_GATEWAY_RATE_LIMIT = 10
+
+
+# Reports prepared in the background by `python manage.py report_worker`, see attendance/report_jobs.py.
+# Their files are kept in this directory for REPORT_JOB_KEEP_DAYS days.
+
+REPORT_JOB_ROOT = os.path.join(BASE_DIR, 'report_jobs')
+
+REPORT_JOB_KEEP_DAYS = 7
+
+
+# SQL profiler, see attendance/sql_profiler.py. Logs the queries of every request to sql_profiler.log
+# and shows the most recent ones to staff users at /edu/debug/sql/. Adds overhead to every query.
+
+SQL_PROFILER = False
+
+# runs of the same query in one request reported as an N+1 query
+SQL_PROFILER_THRESHOLD = 5
+
+# Request metrics, see attendance/metrics.py. Served in the Prometheus format at /edu/metrics/ to the
+# addresses in METRICS_ALLOWED_IPS, and written to METRICS_DUMP_FILE every METRICS_DUMP_INTERVAL seconds
+# when it is set. Every server process keeps its own metrics, include %(pid)s in the file name when
+# running several of them.
+
+METRICS_ENABLED = True
+
+# checked against REMOTE_ADDR, which is the address of the reverse proxy when the server runs behind one,
+# so that every request looks local. Set METRICS_TOKEN there, and scrape with the header
+# Authorization: Bearer <token>.
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+METRICS_TOKEN = None
+
+METRICS_DUMP_FILE = None
+
+METRICS_DUMP_INTERVAL = 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {
+            'format': '%(asctime)s %(levelname)s %(message)s',
+        },
+    },
+    'handlers': {
+        'sql_profiler_file': {
+            'class': 'logging.FileHandler',
+            'filename': os.path.join(BASE_DIR, 'sql_profiler.log'),
+            'formatter': 'timestamped',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'attendance.sql_profiler': {
+            'handlers': ['sql_profiler_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -1,9 +1,9 @@
 from django.contrib import admin
 
 # Register your models here.
-from attendance.models import Class, Attendance, Marks, Parent, Subject, Test, Student, Teacher, Principal
+from attendance.models import Class, Attendance, Marks, Parent, Subject, Test, Student, Teacher, Principal, SmsOutbox
 
 
-@admin.register(Class, Teacher, Student, Principal, Subject, Test)
+@admin.register(Class, Teacher, Student, Principal, Subject, Test, SmsOutbox)
 class ClassAdmin(admin.ModelAdmin):
     pass
@@ -0,0 +1,200 @@
+"""
+Statistics of the marks and attendance of classes, computed with NumPy.
+
+The students, tests, marks and attendance totals of any number of classes are loaded with four queries
+into arrays, and every statistic is computed over all of them at once by grouping the arrays by test,
+student, subject or class: a whole school costs about as much as one class. NumPy is optional; without
+it get_school_analytics returns None and the reports are shown without their statistics.
+"""
+from django.conf import settings
+
+from attendance.helper import get_attendance_range_counts
+from attendance.models import Marks, Student, Test
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# students present on fewer days in the period, or scoring less in a subject, are listed as at risk
+AT_RISK_ATTENDANCE = getattr(settings, 'AT_RISK_ATTENDANCE', 75)
+PASS_PERCENTAGE = getattr(settings, 'PASS_PERCENTAGE', 35)
+
+# larger than any percentage, to order students by class and then by percentage with one key
+_CLASS_SPAN = 1000.0
+
+
+def _value(number):
+    """
+    Returns a statistic as a float rounded for display, or None where it is undefined
+    """
+    return None if numpy.isnan(number) else round(float(number), 2)
+
+
+def _divide(numerator, denominator):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(denominator > 0, numerator / numpy.where(denominator > 0, denominator, 1), numpy.nan)
+
+
+def _lookup(ids, values):
+    """
+    Returns the index in ids of every value, and whether the value is in ids at all
+    """
+    if not len(ids):
+        return numpy.zeros(len(values), dtype=numpy.int64), numpy.zeros(len(values), dtype=bool)
+    order = numpy.argsort(ids)
+    index = order[numpy.minimum(numpy.searchsorted(ids[order], values), len(ids) - 1)]
+    return index, ids[index] == values
+
+
+def _test_statistics(mark_test, values, test_count):
+    """
+    Returns the count, mean, median and standard deviation of the marks of every test
+    """
+    count = numpy.bincount(mark_test, minlength=test_count)
+    mean = _divide(numpy.bincount(mark_test, weights=values, minlength=test_count), count)
+    mean_square = _divide(numpy.bincount(mark_test, weights=values * values, minlength=test_count), count)
+    deviation = numpy.sqrt(numpy.maximum(mean_square - mean * mean, 0))
+    # the marks sorted by test and value, the median of a test lying in the middle of its run
+    ordered = values[numpy.lexsort((values, mark_test))]
+    starts = numpy.cumsum(count) - count
+    if len(ordered):
+        low = ordered[numpy.minimum(starts + (count - 1) // 2, len(ordered) - 1)]
+        high = ordered[numpy.minimum(starts + count // 2, len(ordered) - 1)]
+        median = numpy.where(count > 0, (low + high) / 2, numpy.nan)
+    else:
+        median = numpy.full(test_count, numpy.nan)
+    return count, mean, median, deviation
+
+
+def _class_ranks(student_class, score):
+    """
+    Returns the percentile rank of every student's score among the scores of their class, counting half
+    of the equal scores, and their rank in the class. Both are NaN for students without marks.
+    """
+    key = student_class * _CLASS_SPAN + score
+    scored = ~numpy.isnan(score)
+    ordered = numpy.sort(key[scored])
+    class_start = numpy.searchsorted(ordered, student_class * _CLASS_SPAN, 'left')
+    class_end = numpy.searchsorted(ordered, (student_class + 1) * _CLASS_SPAN, 'left')
+    below = numpy.searchsorted(ordered, key, 'left')
+    not_above = numpy.searchsorted(ordered, key, 'right')
+    size = class_end - class_start
+    percentile = _divide(100.0 * ((below - class_start) + 0.5 * (not_above - below)), size)
+    rank = (class_end - not_above + 1).astype(float)
+    percentile[~scored] = numpy.nan
+    rank[~scored] = numpy.nan
+    return percentile, rank
+
+
+def get_school_analytics(class_ids=None, from_date=None, to_date=None):
+    """
+    Returns {class id: analytics} for the classes of class_ids, or for every class, with the attendance
+    between the dates, or None when NumPy is not installed. The analytics of a class are a dictionary
+    * tests : list of dictionaries of a test ordered by subject and date, with keys
+      id, subject_id, subject, name, date, total_marks, count, mean, median and std of its marks
+    * students : list of dictionaries of a student ordered by roll number, with keys id, roll_no, name,
+      score (percentage of all their marks), percentile, rank and attendance (percentage present)
+    * toppers : list of dictionaries of a subject, with keys subject, students (names of the students with
+      the best percentage) and percentage
+    * at_risk : the dictionaries of the students present less than AT_RISK_ATTENDANCE percent of the days
+      or scoring less than PASS_PERCENTAGE percent in a subject, with the names of those subjects as failing
+    Placeholder marks, the 0 of a student who joined the class after the test, are left out of every
+    statistic, so a student without entered marks has no score, percentile or rank and fails no subject.
+    """
+    if numpy is None:
+        return None
+    student_list = Student.objects.all()
+    test_list = Test.objects.all()
+    mark_list = Marks.objects.filter(placeholder=False)
+    if class_ids is not None:
+        student_list = student_list.filter(which_class__in=class_ids)
+        test_list = test_list.filter(subject__which_class__in=class_ids)
+        mark_list = mark_list.filter(test__subject__which_class__in=class_ids)
+
+    students = list(student_list.order_by('which_class', 'roll_no', 'id').values_list(
+        'id', 'which_class', 'roll_no', 'name'))
+    tests = list(test_list.order_by('subject__which_class', 'subject__name', 'subject_id', 'date', 'id').values_list(
+        'id', 'subject__which_class', 'subject_id', 'subject__name', 'name', 'date', 'total_marks'))
+    class_of = sorted(set(row[1] for row in students) | set(row[1] for row in tests))
+    subject_of = sorted(set(row[2] for row in tests))
+
+    student_ids = numpy.array([row[0] for row in students], dtype=numpy.int64)
+    student_class = numpy.searchsorted(class_of, [row[1] for row in students]).astype(numpy.int64)
+    test_ids = numpy.array([row[0] for row in tests], dtype=numpy.int64)
+    test_class = numpy.searchsorted(class_of, [row[1] for row in tests]).astype(numpy.int64)
+    test_subject = numpy.searchsorted(subject_of, [row[2] for row in tests]).astype(numpy.int64)
+    test_total = numpy.array([row[6] for row in tests], dtype=float)
+
+    marks = numpy.array(list(mark_list.values_list('student', 'test', 'marks').iterator()), dtype=float)
+    marks = marks.reshape(-1, 3)
+    mark_student, kept = _lookup(student_ids, marks[:, 0].astype(numpy.int64))
+    mark_test = _lookup(test_ids, marks[:, 1].astype(numpy.int64))[0]
+    if len(students) and len(tests):
+        # marks of students who left the class of the test do not count
+        kept &= student_class[mark_student] == test_class[mark_test]
+    mark_student, mark_test, values = mark_student[kept], mark_test[kept], marks[kept, 2]
+    mark_total = test_total[mark_test]
+
+    count, mean, median, deviation = _test_statistics(mark_test, values, len(tests))
+
+    score = 100 * _divide(numpy.bincount(mark_student, weights=values, minlength=len(students)),
+                          numpy.bincount(mark_student, weights=mark_total, minlength=len(students)))
+    percentile, rank = _class_ranks(student_class, score)
+
+    # the percentage of every student in every subject they have marks in
+    pairs, pair_index = numpy.unique(mark_student * len(subject_of) + test_subject[mark_test], return_inverse=True)
+    pair_student, pair_subject = pairs // max(len(subject_of), 1), pairs % max(len(subject_of), 1)
+    pair_score = 100 * _divide(numpy.bincount(pair_index, weights=values), numpy.bincount(pair_index,
+                                                                                         weights=mark_total))
+    best = numpy.full(len(subject_of), -numpy.inf)
+    numpy.maximum.at(best, pair_subject, pair_score)
+    topper = pair_score == best[pair_subject]
+    failing = pair_score < PASS_PERCENTAGE
+
+    counts = get_attendance_range_counts(student_list, from_date, to_date)
+    attendance = 100 * _divide(numpy.array([counts.get(row[0], (0, 0))[0] for row in students], dtype=float),
+                               numpy.array([counts.get(row[0], (0, 0))[1] for row in students], dtype=float))
+
+    analytics = dict((class_id, {'tests': [], 'students': [], 'toppers': [], 'at_risk': []})
+                     for class_id in class_of)
+    for index, (test_id, class_id, subject_id, subject, name, date, total_marks) in enumerate(tests):
+        analytics[class_id]['tests'].append({
+            'id': test_id, 'subject_id': subject_id, 'subject': subject, 'name': name, 'date': date,
+            'total_marks': total_marks, 'count': int(count[index]), 'mean': _value(mean[index]),
+            'median': _value(median[index]), 'std': _value(deviation[index]),
+        })
+    subject_names = dict((row[2], row[3]) for row in tests)
+    failing_subjects = [[] for student in students]
+    for student, subject in zip(pair_student[failing], pair_subject[failing]):
+        failing_subjects[student].append(subject_names[subject_of[subject]])
+    toppers = {}
+    for student, subject in zip(pair_student[topper], pair_subject[topper]):
+        toppers.setdefault(subject, []).append(student)
+    for index, (student_id, class_id, roll_no, name) in enumerate(students):
+        row = {
+            'id': student_id, 'roll_no': roll_no, 'name': name, 'score': _value(score[index]),
+            'percentile': _value(percentile[index]), 'rank': None if numpy.isnan(rank[index]) else int(rank[index]),
+            'attendance': _value(attendance[index]), 'failing': failing_subjects[index],
+        }
+        analytics[class_id]['students'].append(row)
+        if failing_subjects[index] or attendance[index] < AT_RISK_ATTENDANCE:
+            analytics[class_id]['at_risk'].append(row)
+    for subject in sorted(toppers, key=lambda subject: subject_names[subject_of[subject]]):
+        class_id = class_of[student_class[toppers[subject][0]]]
+        analytics[class_id]['toppers'].append({
+            'subject': subject_names[subject_of[subject]],
+            'students': [students[student][3] for student in toppers[subject]],
+            'percentage': _value(best[subject]),
+        })
+    return analytics
+
+
+def get_class_analytics(class_id, from_date=None, to_date=None):
+    """
+    Returns the analytics of get_school_analytics of one class, or None when NumPy is not installed
+    """
+    analytics = get_school_analytics([class_id], from_date, to_date)
+    if analytics is None:
+        return None
+    return analytics.get(class_id, {'tests': [], 'students': [], 'toppers': [], 'at_risk': []})
@@ -0,0 +1,273 @@
+"""
+Read-only JSON API of students, attendance summaries, tests and marks, for the mobile app and data pulls.
+
+Requests are authenticated by the session like the pages, and see what the pages would show the user:
+a principal the whole school, a teacher their class and a student themselves. Lists are paginated by
+keyset on the primary key: every page ends with a cursor holding the last id, and the next page starts
+after it with an index range scan, so a deep page costs as much as the first one. Clients choose the
+fields they need with fields=a,b,c and filter with the parameters listed for every endpoint.
+"""
+import base64
+import binascii
+import json
+from functools import wraps
+
+from django.http import JsonResponse
+from django.utils.http import urlencode
+
+from attendance.helper import get_attendance_range_counts, get_attendance_summary, get_report_range
+from attendance.models import Marks, Student, Test
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ApiError(Exception):
+    """
+    Raised with the message and HTTP status of a request the API refuses
+    """
+
+    def __init__(self, message, status=400):
+        super(ApiError, self).__init__(message)
+        self.status = status
+
+
+def _get_int(request, name):
+    value = request.GET.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError('%s must be a number' % name)
+
+
+def _get_fields(request, fields):
+    """
+    Returns the names of fields the client asked for, all of them by default
+    """
+    if not request.GET.get('fields'):
+        return list(fields)
+    names = [name.strip() for name in request.GET['fields'].split(',') if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise ApiError('Unknown fields %s, choose from %s' % (', '.join(unknown), ', '.join(fields)))
+    return names
+
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps([last_id]).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        last_id, = json.loads(base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('ascii')).decode(
+            'ascii'))
+        return int(last_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ApiError('Invalid cursor')
+
+
+def paginate(request, queryset):
+    """
+    Returns the page of queryset the request asks for, ordered by id, and the cursor of the next page
+    or None on the last page
+    """
+    limit = _get_int(request, 'limit')
+    if limit is None:
+        limit = DEFAULT_LIMIT
+    if not 0 < limit <= MAX_LIMIT:
+        raise ApiError('limit must be between 1 and %d' % MAX_LIMIT)
+    if request.GET.get('cursor'):
+        queryset = queryset.filter(pk__gt=_decode_cursor(request.GET['cursor']))
+    # one row more than the page tells whether there is a next page
+    rows = list(queryset.order_by('pk')[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _encode_cursor(rows[-1]['id'])
+
+
+def _page_response(request, results, cursor):
+    next_url = None
+    if cursor is not None:
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        next_url = request.path + '?' + urlencode(sorted(params.items()))
+    return JsonResponse({
+        'results': results,
+        'next': next_url,
+    })
+
+
+def _role(request):
+    """
+    Returns the role deciding what the user can read, the principal seeing the most
+    """
+    roles = request.user_context['roles']
+    for role in ('Principal', 'Teacher', 'Student'):
+        if role in roles:
+            return role
+    raise ApiError('Not allowed', 403)
+
+
+def api_view(function):
+    """
+    Turns the ApiError raised by an API view into a JSON error response, and refuses anything but GET
+    """
+    @wraps(function)
+    def view(request):
+        try:
+            if request.method != 'GET':
+                raise ApiError('Only GET is allowed', 405)
+            if not request.user.is_authenticated:
+                raise ApiError('Log in first', 401)
+            return function(request)
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=error.status)
+
+    return view
+
+
+########################################################
+#                   Scoping                            #
+########################################################
+
+
+def _students(request):
+    role = _role(request)
+    if role == 'Principal':
+        students = Student.objects.all()
+        class_id = _get_int(request, 'class')
+        if class_id is not None:
+            students = students.filter(which_class_id=class_id)
+        return students
+    if role == 'Teacher':
+        return Student.objects.filter(which_class_id=request.user_context['class_id'])
+    return Student.objects.filter(pk=request.user_context['student_id'])
+
+
+def _tests(request):
+    role = _role(request)
+    tests = Test.objects.all()
+    if role == 'Principal':
+        class_id = _get_int(request, 'class')
+        if class_id is not None:
+            tests = tests.filter(subject__which_class_id=class_id)
+    else:
+        tests = tests.filter(subject__which_class_id=request.user_context['class_id'])
+    for name, lookup in (('subject', 'subject_id'), ('exam', 'exam_id')):
+        value = _get_int(request, name)
+        if value is not None:
+            tests = tests.filter(**{lookup: value})
+    return tests
+
+
+def _marks(request):
+    role = _role(request)
+    mark_list = Marks.objects.all()
+    if role == 'Principal':
+        class_id = _get_int(request, 'class')
+        if class_id is not None:
+            mark_list = mark_list.filter(student__which_class_id=class_id)
+    elif role == 'Teacher':
+        mark_list = mark_list.filter(student__which_class_id=request.user_context['class_id'])
+    else:
+        mark_list = mark_list.filter(student_id=request.user_context['student_id'])
+    for name, lookup in (('test', 'test_id'), ('student', 'student_id'), ('subject', 'test__subject_id'),
+                         ('exam', 'test__exam_id')):
+        value = _get_int(request, name)
+        if value is not None:
+            mark_list = mark_list.filter(**{lookup: value})
+    return mark_list
+
+
+########################################################
+#                   Endpoints                          #
+########################################################
+
+STUDENT_FIELDS = {
+    'id': 'id',
+    'roll_no': 'roll_no',
+    'name': 'name',
+    'class_id': 'which_class_id',
+    'phone': 'phone',
+    'username': 'user__username',
+}
+
+ATTENDANCE_FIELDS = ('id', 'roll_no', 'name', 'present', 'absent', 'total', 'percentage_present')
+
+TEST_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'date': 'date',
+    'total_marks': 'total_marks',
+    'subject_id': 'subject_id',
+    'subject': 'subject__name',
+    'exam_id': 'exam_id',
+    'class_id': 'subject__which_class_id',
+}
+
+MARK_FIELDS = {
+    'id': 'id',
+    'marks': 'marks',
+    'student_id': 'student_id',
+    'test_id': 'test_id',
+    'test': 'test__name',
+    'exam_id': 'test__exam_id',
+    'subject_id': 'test__subject_id',
+}
+
+
+def _list_response(request, queryset, field_map):
+    """
+    Returns the page of queryset the request asks for with the fields it asks for, field_map mapping
+    the names of the fields in the API to those of the queryset
+    """
+    fields = _get_fields(request, field_map)
+    rows, cursor = paginate(request, queryset.values(*set(['id'] + [field_map[name] for name in fields])))
+    return _page_response(request, [dict((name, row[field_map[name]]) for name in fields) for row in rows], cursor)
+
+
+@api_view
+def students(request):
+    """
+    Students, filtered by class for a principal
+    """
+    return _list_response(request, _students(request), STUDENT_FIELDS)
+
+
+@api_view
+def attendance(request):
+    """
+    Attendance totals of students, filtered by class for a principal, over the range
+    of the report forms given by range, from and to
+    """
+    fields = _get_fields(request, ATTENDANCE_FIELDS)
+    try:
+        from_date, to_date, range_label = get_report_range(request.GET)
+    except ValueError as error:
+        raise ApiError(str(error))
+    rows, cursor = paginate(request, _students(request).values('id', 'roll_no', 'name'))
+    counts = get_attendance_range_counts([row['id'] for row in rows], from_date, to_date)
+    for row in rows:
+        summary = get_attendance_summary(None, *counts.get(row['id'], (0, 0)))
+        del summary['student']
+        row.update(summary)
+    return _page_response(request, [dict((name, row[name]) for name in fields) for row in rows], cursor)
+
+
+@api_view
+def tests(request):
+    """
+    Tests, filtered by subject and exam, and by class for a principal
+    """
+    return _list_response(request, _tests(request), TEST_FIELDS)
+
+
+@api_view
+def marks(request):
+    """
+    Marks, filtered by test, student, subject and exam, and by class for a principal
+    """
+    return _list_response(request, _marks(request), MARK_FIELDS)
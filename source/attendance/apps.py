@@ -5,3 +5,9 @@ from django.apps import AppConfig
 
 class AttendanceConfig(AppConfig):
     name = 'attendance'
+
+    def ready(self):
+        # connects the signals invalidating cached reports, user contexts and student dashboards
+        import attendance.report_cache
+        import attendance.middleware
+        import attendance.dashboard
@@ -0,0 +1,124 @@
+"""
+Micro benchmarks of the report helpers and views, run by the benchmark_reports command
+against the data in the database, usually a school made by the generate_school command.
+
+Every case is run a number of times and reports its wall time, number of queries and peak
+memory allocated by Python, as a dictionary that is easily dumped to JSON and compared between runs.
+"""
+import datetime
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from attendance.helper import (get_attendance_complete, get_attendance_class, get_attendance_students,
+                               get_attendance_report_from_to, get_subject_marks_report, get_today)
+from attendance.models import Class, Student, Subject, Teacher, Test, Principal
+
+
+def measure(function, repeat=5, clear_cache=True):
+    """
+    Calls function repeat times, returns the wall time and query count of the fastest and of the median
+    call, and the peak memory of the first call in bytes (None without tracemalloc)
+    """
+    timings = []
+    queries = []
+    peak_memory = None
+    for run in range(repeat):
+        if clear_cache:
+            cache.clear()
+        gc.collect()
+        if run == 0 and tracemalloc is not None:
+            tracemalloc.start()
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            function()
+            timings.append(time.time() - start)
+        if run == 0 and tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        queries.append(len(context))
+    timings.sort()
+    return {
+        'min_seconds': timings[0],
+        'median_seconds': timings[len(timings) // 2],
+        'queries': queries[-1],
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def get_cases(class_obj):
+    """
+    Returns a list of (name, function) benchmarking the helpers and views on the data of class_obj
+    """
+    student_list = Student.objects.filter(which_class=class_obj).order_by('roll_no')
+    student = student_list.first()
+    subject = Subject.objects.filter(which_class=class_obj).order_by('id').first()
+    test = Test.objects.filter(subject=subject).order_by('date').first()
+    teacher = Teacher.objects.get(which_class=class_obj)
+    principal = Principal.objects.first()
+    today = get_today()
+    from_date = today - datetime.timedelta(days=30)
+
+    def client_for(user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    teacher_client = client_for(teacher.user)
+    student_client = client_for(student.user)
+    principal_client = client_for(principal.user) if principal is not None else None
+
+    def request(client, method, url, data=None):
+        def view():
+            response = getattr(client, method)(url, data or {})
+            assert response.status_code == 200, '%s %s returned %d' % (method, url, response.status_code)
+        return view
+
+    cases = [
+        ('helper.get_attendance_complete', lambda: get_attendance_complete(student)),
+        ('helper.get_attendance_report_from_to', lambda: get_attendance_report_from_to(student, from_date, today)),
+        ('helper.get_attendance_class', lambda: get_attendance_class(class_obj.id)),
+        ('helper.get_attendance_students.date_range',
+         lambda: get_attendance_students(student_list, from_date, today)),
+        ('helper.get_subject_marks_report',
+         lambda: get_subject_marks_report(student_list, Subject.objects.filter(which_class=class_obj))),
+        ('view.teacher_report_class',
+         request(teacher_client, 'post', reverse('teacher_report_class'), {'subject': subject.id})),
+        ('view.teacher_report_view_single',
+         request(teacher_client, 'post', reverse('teacher_report_single'), {'student': student.id})),
+        ('view.teacher_test_edit',
+         request(teacher_client, 'post', reverse('teacher_test_select'), {'test': test.exam_id, 'edit': 'on'})),
+        ('view.student_index', request(student_client, 'get', reverse('student_index'))),
+    ]
+    if principal_client is not None:
+        cases.append(('view.principal_index',
+                      request(principal_client, 'post', reverse('principal_index'), {'class': class_obj.id})))
+    return cases
+
+
+def run_benchmarks(class_obj=None, repeat=5, clear_cache=True, names=None):
+    """
+    Runs the benchmark cases whose name starts with one of names (all of them by default) on class_obj,
+    the class with most students by default. Returns a dictionary of the results by case name.
+    """
+    if class_obj is None:
+        class_obj = Class.objects.annotate(students=Count('student')).order_by('-students', 'id').first()
+    results = {}
+    # the test client sends its requests to the host 'testserver'
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for name, function in get_cases(class_obj):
+            if names and not any(name.startswith(prefix) for prefix in names):
+                continue
+            results[name] = measure(function, repeat, clear_cache)
+    return results
@@ -0,0 +1,154 @@
+"""
+Attendance analytics over whole terms, read from the packed AttendanceBitmap rows.
+
+The term of a student is held in two integers whose bits are the days of the term, recorded and present,
+so counting days is a popcount and the days falling on a week day are picked by and-ing with a mask.
+Summarizing thousands of students costs a few big integer operations for each of them instead of a model
+instance per student and day. Streaks count the days attendance was taken, so holidays and week ends
+do not break them.
+"""
+import calendar
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+
+from attendance.helper import get_attendance_summary, get_term, get_today
+from attendance.models import Attendance, AttendanceBitmap
+
+# rows inserted by one statement, below the limit of SQLite
+BATCH_SIZE = 500
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+########################################################
+#                   Packing                            #
+########################################################
+
+
+def pack_attendance(rows):
+    """
+    Returns {(student id, term start): (recorded, present)} packed from rows of (student id, date, is present)
+    """
+    term_starts = {}
+    bitmaps = defaultdict(lambda: [0, 0])
+    for student_id, date, is_present in rows:
+        if date not in term_starts:
+            term_starts[date] = get_term(date)[0]
+        day = 1 << (date - term_starts[date]).days
+        bits = bitmaps[(student_id, term_starts[date])]
+        bits[0] |= day
+        if is_present:
+            bits[1] |= day
+    return dict((key, tuple(bits)) for key, bits in bitmaps.items())
+
+
+def rebuild_bitmaps():
+    """
+    Rebuilds the bitmaps of every student from the daily attendance rows, returning how many there are
+    """
+    bitmaps = [AttendanceBitmap(student_id=student_id, term_start=term_start,
+                                recorded=AttendanceBitmap.get_bytes(recorded),
+                                present=AttendanceBitmap.get_bytes(present))
+               for (student_id, term_start), (recorded, present) in pack_attendance(
+                   Attendance.objects.values_list('student', 'date', 'is_present').iterator()).items()]
+    with transaction.atomic():
+        AttendanceBitmap.objects.all().delete()
+        AttendanceBitmap.objects.bulk_create(bitmaps, batch_size=BATCH_SIZE)
+    return len(bitmaps)
+
+
+########################################################
+#                   Readers                            #
+########################################################
+
+
+def load_bitmaps(term_start, student_list=None):
+    """
+    Returns {student id: (recorded, present)} of the term starting on term_start,
+    for the students in student_list or the whole school
+    """
+    bitmaps = AttendanceBitmap.objects.filter(term_start=term_start)
+    if student_list is not None:
+        bitmaps = bitmaps.filter(student__in=student_list)
+    return dict((student_id, (AttendanceBitmap.get_bits(recorded), AttendanceBitmap.get_bits(present)))
+                for student_id, recorded, present in bitmaps.values_list('student', 'recorded',
+                                                                         'present').iterator())
+
+
+def get_weekday_masks(term_start, term_end):
+    """
+    Returns the bits of the days of the term falling on each week day, Monday first
+    """
+    masks = [0] * 7
+    for day in range((term_end - term_start).days + 1):
+        masks[(term_start + datetime.timedelta(days=day)).weekday()] |= 1 << day
+    return masks
+
+
+def get_longest_streak(present, absent):
+    """
+    Returns the most days the student was present on in a row, not counting days attendance was not taken
+    """
+    longest = 0
+    while absent:
+        first_absence = absent & -absent
+        longest = max(longest, popcount(present & (first_absence - 1)))
+        present &= ~(first_absence - 1)
+        absent ^= first_absence
+    return max(longest, popcount(present))
+
+
+def summarize_student(recorded, present, masks):
+    """
+    Returns the attendance dictionary of get_attendance_summary, without the student, for a term with
+    * current_streak : days present since the last absence
+    * longest_streak : most days present in a row
+    * absent_by_weekday : days absent on each week day, Monday first
+    masks being the week day masks of the term
+    """
+    absent = recorded & ~present
+    summary = get_attendance_summary(None, popcount(present), popcount(recorded))
+    del summary['student']
+    summary['current_streak'] = popcount(present >> absent.bit_length())
+    summary['longest_streak'] = get_longest_streak(present, absent)
+    summary['absent_by_weekday'] = [popcount(absent & mask) for mask in masks]
+    return summary
+
+
+def summarize_term(date=None, student_list=None, previous=False):
+    """
+    Returns the attendance of the students in student_list, or of the whole school, over the term date
+    is in or the one before it, as a dictionary
+    * term_start, term_end : the first and last day of the term
+    * students : {student id: summary of summarize_student}
+    * present, absent, total, percentage_present : the days of all the students together
+    * days : number of days attendance was taken on
+    * weekdays : list of (week day name, days attendance was taken on, days absent of all the students)
+    """
+    if date is None:
+        date = get_today()
+    term_start, term_end = get_term(date, previous)
+    masks = get_weekday_masks(term_start, term_end)
+    bitmaps = load_bitmaps(term_start, student_list)
+    students = dict((student_id, summarize_student(recorded, present, masks))
+                    for student_id, (recorded, present) in bitmaps.items())
+    school_days = 0
+    for recorded, present in bitmaps.values():
+        school_days |= recorded
+    summary = get_attendance_summary(None, sum(student['present'] for student in students.values()),
+                                     sum(student['total'] for student in students.values()))
+    del summary['student']
+    summary.update({
+        'term_start': term_start,
+        'term_end': term_end,
+        'students': students,
+        'days': popcount(school_days),
+        'weekdays': [(calendar.day_name[weekday], popcount(school_days & mask),
+                      sum(student['absent_by_weekday'][weekday] for student in students.values()))
+                     for weekday, mask in enumerate(masks) if school_days & mask],
+    })
+    return summary
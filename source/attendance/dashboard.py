@@ -0,0 +1,124 @@
+"""
+Snapshots of the student dashboard shown by student_index.
+
+A student's attendance totals and marks grid are built once and stored serialized in their
+StudentDashboard row, so that a student opening their page reads that one row. Writing attendance or
+marks of a student invalidates only their snapshot, and changes to tests or subjects those of their
+class; the snapshot is rebuilt by the next read. The rebuilt snapshot is only stored if the version
+read before building it is still current, hence a write racing with a rebuild is never lost. The students
+of deleted rows are invalidated together once the transaction commits, so that the cascade deleting an
+exam or a student costs one update rather than one for every row.
+"""
+import json
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete
+
+from attendance.helper import get_attendance_complete
+from attendance.models import Attendance, Exam, Marks, Student, StudentDashboard, Subject, Test
+
+
+def build_dashboard(student):
+    """
+    Returns the dashboard of the student as a dictionary
+    * student : the name of the student
+    * attendance : the attendance dictionary, without the student
+    * subjects : names of the subjects of the class, in order of name
+    * tests : list of (exam name, marks) in order of date, marks being the marks of the student in
+      each subject, None where the subject had no test in the exam
+    """
+    attendance = get_attendance_complete(student)
+    del attendance['student']
+    subjects = list(Subject.objects.filter(which_class_id=student.which_class_id).order_by('name', 'id').values_list(
+        'id', 'name'))
+    column = dict((subject_id, index) for index, (subject_id, name) in enumerate(subjects))
+    tests = []
+    rows = {}
+    for exam_id, exam_name, subject_id, marks in Marks.objects.filter(
+            student=student, test__exam__which_class_id=student.which_class_id).order_by(
+            'test__exam__date', 'test__exam_id').values_list('test__exam_id', 'test__exam__name', 'test__subject_id',
+                                                             'marks'):
+        if exam_id not in rows:
+            rows[exam_id] = [None] * len(subjects)
+            tests.append((exam_name, rows[exam_id]))
+        rows[exam_id][column[subject_id]] = str(marks)
+    return {
+        'student': str(student),
+        'attendance': attendance,
+        'subjects': [name for subject_id, name in subjects],
+        'tests': tests,
+    }
+
+
+def get_dashboard(student_id):
+    """
+    Returns the dashboard of the student, from their snapshot unless it is stale
+    """
+    snapshot = StudentDashboard.objects.filter(student_id=student_id).values_list('version', 'data').first()
+    if snapshot is not None and snapshot[1]:
+        return json.loads(snapshot[1])
+    if snapshot is None:
+        try:
+            with transaction.atomic():
+                StudentDashboard.objects.create(student_id=student_id)
+        except IntegrityError:
+            # created by a concurrent request
+            pass
+        version = StudentDashboard.objects.filter(student_id=student_id).values_list('version', flat=True).get()
+    else:
+        version = snapshot[0]
+    dashboard = build_dashboard(Student.objects.get(pk=student_id))
+    StudentDashboard.objects.filter(student_id=student_id, version=version).update(data=json.dumps(dashboard))
+    return dashboard
+
+
+########################################################
+#                   Invalidation                       #
+########################################################
+
+
+def invalidate_student(sender, instance, **kwargs):
+    StudentDashboard.invalidate([instance.student_id if sender is not Student else instance.pk])
+
+
+# ids of the students whose attendance or marks rows were deleted since the last flush
+_deleted = threading.local()
+
+# snapshots invalidated by one statement, below the limit of SQLite
+BATCH_SIZE = 500
+
+
+def _flush_deleted():
+    student_ids = list(getattr(_deleted, 'student_ids', None) or ())
+    _deleted.student_ids = None
+    for start in range(0, len(student_ids), BATCH_SIZE):
+        StudentDashboard.invalidate(student_ids[start:start + BATCH_SIZE])
+
+
+def invalidate_deleted(sender, instance, **kwargs):
+    """
+    Collects the student of a deleted row, to be invalidated once the transaction commits. A flush is
+    registered for every row, since the one of a rolled back transaction is dropped.
+    """
+    if getattr(_deleted, 'student_ids', None) is None:
+        _deleted.student_ids = set()
+    _deleted.student_ids.add(instance.student_id)
+    transaction.on_commit(_flush_deleted)
+
+
+def invalidate_class(sender, instance, **kwargs):
+    if sender is Test:
+        StudentDashboard.invalidate_class(
+            Subject.objects.filter(pk=instance.subject_id).values_list('which_class', flat=True).first())
+    else:
+        StudentDashboard.invalidate_class(instance.which_class_id)
+
+
+for model in (Attendance, Marks, Student):
+    post_save.connect(invalidate_student, sender=model, dispatch_uid='dashboard_save_%s' % model.__name__)
+for model in (Attendance, Marks):
+    post_delete.connect(invalidate_deleted, sender=model, dispatch_uid='dashboard_delete_%s' % model.__name__)
+for model in (Exam, Test, Subject):
+    post_save.connect(invalidate_class, sender=model, dispatch_uid='dashboard_save_%s' % model.__name__)
+    post_delete.connect(invalidate_class, sender=model, dispatch_uid='dashboard_delete_%s' % model.__name__)
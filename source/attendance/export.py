@@ -0,0 +1,241 @@
+"""
+Streaming CSV and Excel exports of the class reports, subject mark sheets and school attendance.
+
+Rows are read with QuerySet.iterator() over values_list() queries, which uses a server side cursor where
+the database supports one, and written to the response as they are produced, so the memory used stays
+the same whatever the size of the school. Marks are read ordered like the students and merged with them
+row by row instead of being collected first.
+
+Excel files are written as a minimal XLSX workbook streamed through zipfile, which needs Python 3.6.
+"""
+import csv
+import re
+import zipfile
+from decimal import Decimal
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+
+from attendance.helper import annotate_attendance, get_attendance_summary
+from attendance.models import Marks, Student, Test
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+ATTENDANCE_HEADER = ['Present days', 'Absent days', 'Total working days', 'Present percentage']
+
+
+########################################################
+#                   Rows                               #
+########################################################
+
+
+def _attendance_columns(present, total):
+    summary = get_attendance_summary(None, present, total)
+    return [summary['present'], summary['absent'], summary['total'], Decimal(summary['percentage_present'])]
+
+
+def _merge_marks(student_rows, mark_rows, test_ids):
+    """
+    Yields (student row, marks of the student in the tests of test_ids, None for a missing mark)
+    from student rows starting with the student id and mark rows (student id, test id, marks)
+    that are both ordered by roll number and id
+    """
+    column = dict((test_id, index) for index, test_id in enumerate(test_ids))
+    marks_by_student = groupby(mark_rows, key=lambda row: row[0])
+    pending = next(marks_by_student, None)
+    for student_row in student_rows:
+        marks = [None] * len(test_ids)
+        if pending is not None and pending[0] == student_row[0]:
+            for student_id, test_id, mark in pending[1]:
+                marks[column[test_id]] = mark
+            pending = next(marks_by_student, None)
+        yield student_row, marks
+
+
+def _student_mark_rows(student_list, test_list):
+    test_ids = [test.id for test in test_list]
+    student_rows = annotate_attendance(student_list.order_by('roll_no', 'id')).values_list(
+        'id', 'roll_no', 'name', 'attendance_present', 'attendance_total')
+    mark_rows = Marks.objects.filter(student__in=student_list, test__in=test_ids).order_by(
+        'student__roll_no', 'student_id').values_list('student_id', 'test_id', 'marks')
+    return _merge_marks(student_rows.iterator(), mark_rows.iterator(), test_ids)
+
+
+def class_report_rows(class_id):
+    """
+    Yields the header and a row per student of the class with their attendance and all their marks
+    """
+    test_list = list(Test.objects.filter(subject__which_class_id=class_id).select_related('subject').order_by(
+        'subject__name', 'subject_id', 'date', 'id'))
+    yield ['Roll no', 'Student name'] + ATTENDANCE_HEADER + [
+        '%s: %s (out of %s)' % (test.subject.name, test.name, test.total_marks) for test in test_list]
+    student_list = Student.objects.filter(which_class_id=class_id)
+    for (student_id, roll_no, name, present, total), marks in _student_mark_rows(student_list, test_list):
+        yield [roll_no, name] + _attendance_columns(present, total) + marks
+
+
+def subject_marks_rows(subject):
+    """
+    Yields the header and a row per student of the class of subject with their marks in its tests
+    """
+    test_list = list(Test.objects.filter(subject=subject).order_by('date', 'id'))
+    yield ['Roll no', 'Student name'] + ['%s (out of %s)' % (test.name, test.total_marks) for test in test_list]
+    student_list = Student.objects.filter(which_class_id=subject.which_class_id)
+    for (student_id, roll_no, name, present, total), marks in _student_mark_rows(student_list, test_list):
+        yield [roll_no, name] + marks
+
+
+def school_attendance_rows(from_date=None, to_date=None):
+    """
+    Yields the header and a row per student of the school with their attendance between the dates
+    """
+    yield ['Class', 'Roll no', 'Student name'] + ATTENDANCE_HEADER
+    student_rows = annotate_attendance(Student.objects.all(), from_date, to_date).order_by(
+        'which_class__grade', 'which_class__division', 'roll_no', 'id').values_list(
+        'which_class__grade', 'which_class__division', 'roll_no', 'name', 'attendance_present', 'attendance_total')
+    for grade, division, roll_no, name, present, total in student_rows.iterator():
+        yield ['%s:%s' % (grade, division), roll_no, name] + _attendance_columns(present, total)
+
+
+########################################################
+#                   Formats                            #
+########################################################
+
+
+class _Echo(object):
+    """
+    File returning what is written to it, for csv.writer to format one row at a time
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _ZipStream(object):
+    """
+    Unseekable file collecting what zipfile writes to it until it is taken out by pop()
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.buffered = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        self.buffered += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.buffered = 0
+        return data
+
+
+XLSX_FILES = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+     'Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+     'Target="worksheets/sheet1.xml"/>'
+     '</Relationships>'),
+)
+
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+# characters XML does not allow, and those Excel does not allow in a sheet name
+_XML_INVALID = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SHEET_NAME_INVALID = re.compile(r'[\[\]:*?/\\]')
+
+# bytes of compressed output collected before they are sent
+XLSX_CHUNK_SIZE = 64 * 1024
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return '<c><v>%s</v></c>' % value
+    text = escape(_XML_INVALID.sub('', str(value)))
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % text
+
+
+def stream_xlsx(rows, sheet_name='Report'):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_FILES:
+            workbook.writestr(name, content)
+        sheet_name = escape(_SHEET_NAME_INVALID.sub(' ', sheet_name)[:31], {'"': '&quot;'})
+        workbook.writestr('xl/workbook.xml', XLSX_WORKBOOK % sheet_name)
+        with workbook.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(XLSX_SHEET_START.encode('utf-8'))
+            for row in rows:
+                sheet.write(('<row>%s</row>' % ''.join(_xlsx_cell(value) for value in row)).encode('utf-8'))
+                if stream.buffered >= XLSX_CHUNK_SIZE:
+                    yield stream.pop()
+            sheet.write(XLSX_SHEET_END.encode('utf-8'))
+    yield stream.pop()
+
+
+def export_response(rows, filename, file_format='csv'):
+    """
+    Returns a response streaming rows as a file download in file_format, one of FORMATS
+    """
+    if file_format == 'xlsx':
+        content = stream_xlsx(rows, filename)
+    else:
+        file_format = 'csv'
+        content = stream_csv(rows)
+    response = StreamingHttpResponse(content, content_type=FORMATS[file_format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (re.sub(r'[^\w.-]+', '_', filename),
+                                                                       file_format)
+    return response
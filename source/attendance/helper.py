@@ -6,9 +6,26 @@ Any enquiries regarding code, email at sidhin.thomas@gmail.com
 Copyright 2016 Shift2Cloud Technologies
 """
 
+import datetime
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction, IntegrityError
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.query import QuerySet
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from attendance.models import Attendance, Test, Marks
+from attendance.models import Attendance, AttendanceBitmap, AttendanceRollup, Class, Exam, SmsOutbox, \
+    StudentDashboard, Teacher, Test, Marks, Student, Subject
+from attendance.middleware import bump_user_context
+from attendance.report_cache import bump_class_version
 
 """
 These functions are to check is a giving User is of which type
@@ -31,6 +48,69 @@ def is_principal(user):
     return user.groups.filter(name='Principal').exists()
 
 
+def get_today():
+    """
+    Returns the current date in the time zone of the school, which is the date attendance is recorded under
+    """
+    return timezone.localtime(timezone.now()).date()
+
+
+########################################################
+#                   Report Ranges                      #
+########################################################
+
+# first (month, day) of every term of the school year, a term lasting until the next one starts
+SCHOOL_TERM_STARTS = getattr(settings, 'SCHOOL_TERM_STARTS', ((6, 1), (10, 1), (1, 1)))
+
+# the periods a report can be limited to, as offered by the report forms
+REPORT_RANGES = (
+    ('all', 'All time'),
+    ('7', 'Last 7 days'),
+    ('30', 'Last 30 days'),
+    ('90', 'Last 90 days'),
+    ('term', 'This term'),
+    ('last_term', 'Previous term'),
+    ('custom', 'From date to date'),
+)
+
+
+def get_term(date, previous=False):
+    """
+    Returns the first and last day of the term date is in, or of the term before it
+    """
+    starts = sorted(datetime.date(year, month, day) for year in (date.year - 2, date.year - 1, date.year)
+                    for month, day in SCHOOL_TERM_STARTS)
+    starts.append(datetime.date(date.year + 1, *min(SCHOOL_TERM_STARTS)))
+    index = max(index for index, start in enumerate(starts) if start <= date) - (1 if previous else 0)
+    return starts[index], starts[index + 1] - datetime.timedelta(days=1)
+
+
+def get_report_range(data, today=None):
+    """
+    Returns the (from date, to date, description) of the period chosen on a report form, data being its
+    POST or GET dictionary with the keys range, from and to. Both dates are None for all time.
+    Raises ValueError for an unknown range or invalid dates.
+    """
+    choice = data.get('range') or 'all'
+    if today is None:
+        today = get_today()
+    if choice == 'all':
+        return None, None, 'All time'
+    if choice.isdigit() and choice in dict(REPORT_RANGES):
+        from_date = today - datetime.timedelta(days=int(choice) - 1)
+        return from_date, today, 'Last %s days' % choice
+    if choice in ('term', 'last_term'):
+        from_date, to_date = get_term(today, choice == 'last_term')
+        return from_date, to_date, '%s (%s to %s)' % (dict(REPORT_RANGES)[choice], from_date, to_date)
+    if choice == 'custom':
+        from_date = parse_date(data.get('from') or '')
+        to_date = parse_date(data.get('to') or '')
+        if from_date is None or to_date is None or from_date > to_date:
+            raise ValueError('Invalid range of dates')
+        return from_date, to_date, '%s to %s' % (from_date, to_date)
+    raise ValueError('Unknown report range %s' % choice)
+
+
 """
 View helper function to generate a context for the template in case error message is to be printed
 """
@@ -56,6 +136,12 @@ def get_error_context(request):
             message = 'Password successfully changed'
         elif error == 'selecterror':
             message = 'Please select from the list'
+        elif error == 'testexist':
+            message = 'An exam with this name already exists'
+        elif error == 'dateerror':
+            message = 'Enter a valid range of dates'
+        elif error == 'jobqueued':
+            message = 'The report is being prepared, download it below once it is done'
         context = {'error_message': message}
     except KeyError:
         context = {}
@@ -67,44 +153,29 @@ def get_error_context(request):
 ########################################################
 
 """
-These decorators help to make sure that only a particular user group is allowed access
+These decorators help to make sure that only a particular user group is allowed access.
+group_login_required allows the users belonging to any of the groups it is given. The groups of the user are read
+from request.user_context, set by UserContextMiddleware.
 """
 
 
-def admin_login_required(function):
-    def wrapper(request):
-        if not is_admin(request.user):
-            return render(request, 'attendance/unauthorised.html')
-        return function(request)
-
-    return wrapper
-
-
-def teacher_login_required(function):
-    def wrapper(request):
-        if not is_teacher(request.user):
-            return render(request, 'attendance/unauthorised.html')
-        return function(request)
-
-    return wrapper
+def group_login_required(*groups):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(request, *args, **kwargs):
+            if not any(group in request.user_context['roles'] for group in groups):
+                return render(request, 'attendance/unauthorised.html')
+            return function(request, *args, **kwargs)
 
+        return wrapper
 
-def principal_login_required(function):
-    def wrapper(request):
-        if not is_principal(request.user):
-            return render(request, 'attendance/unauthorised.html')
-        return function(request)
+    return decorator
 
-    return wrapper
 
-
-def student_login_required(function):
-    def wrapper(request):
-        if not is_student(request.user):
-            return render(request, 'attendance/unauthorised.html')
-        return function(request)
-
-    return wrapper
+admin_login_required = group_login_required('Admin')
+teacher_login_required = group_login_required('Teacher')
+principal_login_required = group_login_required('Principal')
+student_login_required = group_login_required('Student')
 
 
 ####################################################
@@ -133,52 +204,458 @@ def mark_report_subject(student, subject):
     return mark_details
 
 
-def get_attendance_report_from_to(student, from_date, to_date):
+def get_marks_matrix(student_list, test_list):
     """
-    returns a dictionary containing the details of the student's attendance in given time range
+    Returns a dense student x test grid of Marks, rows in the order of student_list and columns in the
+    order of test_list. All marks are fetched with a single query; a cell without a mark is None.
+    The test and student of every mark are the objects passed in, so templates can follow them freely.
     """
-    attendance_list = Attendance.objects.filter(student=student, date__gte=from_date, date__lte=to_date)
-    present = 0
-    absent = 0
-    total = attendance_list.count()
-    for att in attendance_list:
-        if att.is_present:
-            present += 1
-        else:
-            absent += 1
+    student_list = list(student_list)
+    test_list = list(test_list)
+    row_of = dict((student.pk, row) for row, student in enumerate(student_list))
+    column_of = dict((test.pk, column) for column, test in enumerate(test_list))
+    matrix = [[None] * len(test_list) for _ in student_list]
+    if not student_list or not test_list:
+        return matrix
+    for mark in Marks.objects.filter(test__in=list(column_of)):
+        row = row_of.get(mark.student_id)
+        if row is None:
+            continue
+        column = column_of[mark.test_id]
+        mark.student = student_list[row]
+        mark.test = test_list[column]
+        matrix[row][column] = mark
+    return matrix
+
+
+def get_subject_marks_report(student_list, subject_list):
+    """
+    Returns a list of (subject, test_list, mark_list) for every subject, where mark_list holds a
+    (student, marks) pair per student and marks is the row of that student in the subject's tests.
+    Tests are ordered by date. Two queries are used in total regardless of the number of subjects.
+    """
+    student_list = list(student_list)
+    subject_list = list(subject_list)
+    test_list = list(Test.objects.filter(subject__in=subject_list).order_by('date', 'id'))
+    matrix = get_marks_matrix(student_list, test_list)
+    report = []
+    for subject in subject_list:
+        columns = [column for column, test in enumerate(test_list) if test.subject_id == subject.pk]
+        for column in columns:
+            test_list[column].subject = subject
+        mark_list = [(student, [row[column] for column in columns]) for student, row in zip(student_list, matrix)]
+        report.append((subject, [test_list[column] for column in columns], mark_list))
+    return report
+
+
+def get_exam_marks(student, class_id):
+    """
+    Returns a list of (exam, marks) for the exams of the class the student has marks in, in order of date,
+    marks being the Marks of the student in the tests of the exam ordered by subject name.
+    A single query is used.
+    """
+    mark_list = Marks.objects.filter(student=student, test__exam__which_class_id=class_id).select_related(
+        'test__exam').order_by('test__exam__date', 'test__exam_id', 'test__subject__name', 'test__subject_id')
+    return [(exam, list(marks)) for exam, marks in groupby(mark_list, key=lambda mark: mark.test.exam)]
+
+
+def get_attendance_summary(student, present, total):
+    """
+    returns the attendance dictionary used by the report templates from the present and total day counts
+    """
+    present = present or 0
+    total = total or 0
     try:
         percentage_present = (float(present) / total) * 100
     except ZeroDivisionError:
-        percentage_present = 0
+        percentage_present = 0.0
     return {
+        'student': student,
         'present': present,
-        'absent': absent,
+        'absent': total - present,
         'total': total,
         'percentage_present': '{0:.2f}'.format(percentage_present)
     }
 
 
+def get_attendance_counts(attendance_list):
+    """
+    returns (present, total) for the given Attendance queryset, counted by the database in a single query
+    """
+    counts = attendance_list.aggregate(
+        present=Sum(Case(When(is_present=True, then=1), default=0, output_field=IntegerField())),
+        total=Count('id'),
+    )
+    return counts['present'] or 0, counts['total']
+
+
+def split_date_range(from_date, to_date):
+    """
+    Splits the days from from_date to to_date, either of them None for no limit, into the whole months
+    within them, as (first month, last month) with None for no limit or None when there is no whole month,
+    and the list of (from date, to date) of the days left over at either end
+    """
+    first_month = from_date
+    if from_date is not None and from_date.day != 1:
+        first_month = (from_date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    last_month = None
+    after_last_month = None
+    if to_date is not None:
+        after_last_month = (to_date + datetime.timedelta(days=1)).replace(day=1)
+        if after_last_month.month == to_date.month:
+            # to_date does not end its month
+            after_last_month = to_date.replace(day=1)
+        last_month = (after_last_month - datetime.timedelta(days=1)).replace(day=1)
+    if first_month is not None and last_month is not None and first_month > last_month:
+        return None, [(from_date, to_date)]
+    days = []
+    if from_date is not None and from_date < first_month:
+        days.append((from_date, first_month - datetime.timedelta(days=1)))
+    if to_date is not None and after_last_month <= to_date:
+        days.append((after_last_month, to_date))
+    return (first_month, last_month), days
+
+
+def get_attendance_range_counts(student_list, from_date=None, to_date=None, by_class=False):
+    """
+    Returns {student id: (present days, total days)} of the students in student_list, None for the whole
+    school, between the dates, or {class id: (present days, total days)} of their classes when by_class.
+    Whole months are read from the monthly rollup and only the days at the ends of the range from the
+    daily rows, each by a range scan of a (student, date) index, so a long range costs about as much as a
+    short one. Students without attendance are left out.
+    """
+    group = 'student__which_class' if by_class else 'student'
+    counts = defaultdict(lambda: [0, 0])
+    months, days = split_date_range(from_date, to_date)
+    if months is not None:
+        rollups = AttendanceRollup.objects.all()
+        if student_list is not None:
+            rollups = rollups.filter(student__in=student_list)
+        if months[0] is not None:
+            rollups = rollups.filter(month__gte=months[0])
+        if months[1] is not None:
+            rollups = rollups.filter(month__lte=months[1])
+        for key, present, absent in rollups.values(group).annotate(
+                present_days=Sum('present'), absent_days=Sum('absent')).values_list(
+                group, 'present_days', 'absent_days').order_by():
+            counts[key][0] += present
+            counts[key][1] += present + absent
+    for from_day, to_day in days:
+        attendance = Attendance.objects.filter(date__gte=from_day, date__lte=to_day)
+        if student_list is not None:
+            attendance = attendance.filter(student__in=student_list)
+        for key, present, total in attendance.values(group).annotate(
+                present_days=Sum(Case(When(is_present=True, then=1), default=0, output_field=IntegerField())),
+                total_days=Count('id')).values_list(group, 'present_days', 'total_days').order_by():
+            counts[key][0] += present
+            counts[key][1] += total
+    return dict((key, tuple(count)) for key, count in counts.items())
+
+
+def get_attendance_report_from_to(student, from_date, to_date):
+    """
+    returns a dictionary containing the details of the student's attendance in given time range
+    """
+    present, total = get_attendance_range_counts([student], from_date, to_date).get(student.id, (0, 0))
+    return get_attendance_summary(student, present, total)
+
+
 def get_attendance_complete(student):
     """
-        returns a dictionary containing the details of the student's attendance so far
-        """
-    attendance_list = Attendance.objects.filter(student=student)
-    present = 0
-    absent = 0
-    total = attendance_list.count()
-    for att in attendance_list:
-        if att.is_present:
-            present += 1
+    returns a dictionary containing the details of the student's attendance so far,
+    read from the monthly rollup of the student
+    """
+    counts = AttendanceRollup.objects.filter(student=student).aggregate(present=Sum('present'),
+                                                                         absent=Sum('absent'))
+    present = counts['present'] or 0
+    return get_attendance_summary(student, present, present + (counts['absent'] or 0))
+
+
+def get_attendance_students(student_list, from_date=None, to_date=None):
+    """
+    Returns the attendance dictionaries of every student in student_list, in the same order.
+    student_list may be a Student queryset or any iterable of students.
+    Without a date range the counts of all of them come from one grouped query over the monthly rollup.
+    With one they take a query over the rollup for the whole months and one over the daily rows for the days
+    at each end of the range, see get_attendance_range_counts.
+    Students without any attendance are reported with zero counts.
+    """
+    if from_date is None and to_date is None and isinstance(student_list, QuerySet):
+        return [get_attendance_summary(student, student.attendance_present, student.attendance_total)
+                for student in annotate_attendance(student_list)]
+    student_list = list(student_list)
+    if from_date is None and to_date is None:
+        # the annotated students come back in pk order, so their counts are put back in the order of the list
+        counts = dict((student_id, (present, total)) for student_id, present, total in annotate_attendance(
+            student_list).values_list('id', 'attendance_present', 'attendance_total'))
+    else:
+        counts = get_attendance_range_counts(student_list, from_date, to_date)
+    return [get_attendance_summary(student, *counts.get(student.id, (0, 0))) for student in student_list]
+
+
+def annotate_attendance(student_list, from_date=None, to_date=None):
+    """
+    Returns a Student queryset of student_list annotated with attendance_present and attendance_total,
+    in one query that can be streamed. get_attendance_students uses it without a date range.
+    """
+    if not isinstance(student_list, QuerySet):
+        student_list = Student.objects.filter(pk__in=[student.pk for student in student_list])
+    if from_date is None and to_date is None:
+        return student_list.annotate(
+            attendance_present=Sum('attendancerollup__present'),
+            attendance_total=Sum(F('attendancerollup__present') + F('attendancerollup__absent')),
+        )
+    conditions = {}
+    if from_date is not None:
+        conditions['attendance__date__gte'] = from_date
+    if to_date is not None:
+        conditions['attendance__date__lte'] = to_date
+    return student_list.annotate(
+        attendance_present=Sum(Case(When(attendance__is_present=True, then=1, **conditions),
+                                    default=0, output_field=IntegerField())),
+        attendance_total=Sum(Case(When(attendance__isnull=False, then=1, **conditions),
+                                  default=0, output_field=IntegerField())),
+    )
+
+
+def get_attendance_class(class_id, from_date=None, to_date=None):
+    """
+    Returns the attendance dictionaries of all students of the class ordered by roll number
+    """
+    return get_attendance_students(Student.objects.filter(which_class__id=class_id).order_by('roll_no'),
+                                   from_date, to_date)
+
+
+def get_school_overview(date=None):
+    """
+    Returns a list with a dictionary for every class of the school, in order of grade and division
+    * class : the class
+    * teachers : names of its teachers
+    * students : number of its students
+    * attendance : attendance dictionary of all its students over the term date is in, without the student
+    * today : attendance dictionary of all its students on date, None when attendance was not taken
+    * subjects : list of (subject name, average percentage of the marks or None) in order of name
+    Every part is read by grouped queries over the whole school, so their number does not grow with it.
+    """
+    if date is None:
+        date = get_today()
+    overview = OrderedDict((class_obj.id, {'class': class_obj, 'teachers': [], 'students': 0, 'today': None,
+                                           'subjects': []})
+                           for class_obj in Class.objects.order_by('grade', 'division', 'id'))
+    for class_id, name in Teacher.objects.filter(which_class__isnull=False).order_by('name').values_list(
+            'which_class', 'name'):
+        overview[class_id]['teachers'].append(name)
+    for class_id, students in Student.objects.values('which_class').annotate(students=Count('id')).values_list(
+            'which_class', 'students').order_by():
+        overview[class_id]['students'] = students
+    term_counts = get_attendance_range_counts(None, get_term(date)[0], date, by_class=True)
+    for class_id, present, total in Attendance.objects.filter(date=date).values('student__which_class').annotate(
+            present_days=Sum(Case(When(is_present=True, then=1), default=0, output_field=IntegerField())),
+            total_days=Count('id')).values_list('student__which_class', 'present_days', 'total_days').order_by():
+        overview[class_id]['today'] = get_attendance_summary(None, present, total)
+    averages = dict((subject_id, 100 * float(marks) / total) for subject_id, marks, total in Marks.objects.values(
+        'test__subject').annotate(marks_sum=Sum('marks'), total_sum=Sum('test__total_marks')).values_list(
+        'test__subject', 'marks_sum', 'total_sum').order_by() if total)
+    for subject_id, class_id, name in Subject.objects.order_by('name', 'id').values_list('id', 'which_class', 'name'):
+        overview[class_id]['subjects'].append((name, averages.get(subject_id)))
+    for class_id, item in overview.items():
+        item['attendance'] = get_attendance_summary(None, *term_counts.get(class_id, (0, 0)))
+    return list(overview.values())
+
+
+####################################################
+#           Attendance Writers                     #
+####################################################
+
+
+def _write_attendance(student_list, date, present_ids):
+    existing = dict((student_id, (pk, is_present)) for pk, student_id, is_present in
+                    Attendance.objects.filter(student__in=student_list, date=date).values_list('id', 'student',
+                                                                                               'is_present'))
+    new_attendance = []
+    now_present = []
+    now_absent = []
+    changes = {}
+    absentees = []
+    for student in student_list:
+        is_present = student.pk in present_ids
+        if student.pk not in existing:
+            new_attendance.append(Attendance(student=student, date=date, is_present=is_present))
+            changes[student.pk] = (1, 0) if is_present else (0, 1)
+        elif existing[student.pk][1] != is_present:
+            (now_present if is_present else now_absent).append(existing[student.pk][0])
+            changes[student.pk] = (1, -1) if is_present else (-1, 1)
         else:
-            absent += 1
+            continue
+        if not is_present:
+            absentees.append(student)
+    Attendance.objects.bulk_create(new_attendance)
+    if now_present:
+        Attendance.objects.filter(pk__in=now_present).update(is_present=True)
+    if now_absent:
+        Attendance.objects.filter(pk__in=now_absent).update(is_present=False)
+    AttendanceRollup.add_many(date, changes)
+    AttendanceBitmap.set_many(get_term(date)[0], date,
+                              dict((student_id, change[0] == 1) for student_id, change in changes.items()))
+    SmsOutbox.queue(absentees, date)
+    SmsOutbox.cancel([student_id for student_id, change in changes.items() if change == (1, -1)], date)
+    StudentDashboard.invalidate(changes)
+    bump_class_version(*[student.which_class_id for student in student_list])
+
+
+def save_attendance(student_list, date, present_ids):
+    """
+    Records the attendance of every student in student_list for date, the students whose id is in present_ids
+    being present. Rows missing for the day are bulk created and rows already there are updated only when
+    is_present changed, all in one transaction, so submitting the same attendance twice does not duplicate it.
+    The absences are queued in the SMS outbox in the same transaction.
+    """
+    student_list = list(student_list)
+    present_ids = set(present_ids)
     try:
-        percentage_present = (float(present) / total) * 100
-    except ZeroDivisionError:
-        percentage_present = 0.0
-    return {
-        'student': student,
-        'present': present,
-        'absent': absent,
-        'total': total,
-        'percentage_present': '{0:.2f}'.format(percentage_present,)
-    }
+        with transaction.atomic():
+            _write_attendance(student_list, date, present_ids)
+    except IntegrityError:
+        # a concurrent submission inserted the rows first, writing again only updates them
+        with transaction.atomic():
+            _write_attendance(student_list, date, present_ids)
+
+
+####################################################
+#           Marks Writers                          #
+####################################################
+
+
+def parse_marks(value, total_marks):
+    """
+    Returns the marks entered in a form field as a Decimal, raising ValueError unless they lie
+    between 0 and total_marks
+    """
+    try:
+        marks = Decimal(value).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError):
+        raise ValueError('Marks must be a number: %r' % (value,))
+    if not 0 <= marks <= total_marks:
+        raise ValueError('Marks must be between 0 and %s: %s' % (total_marks, marks))
+    return marks
+
+
+def add_test(class_id, name, date, total_marks, subject_list, student_list, marks):
+    """
+    Creates an exam of the class with a test of every subject in subject_list along with the marks of
+    every student, in one transaction, and returns the exam.
+    marks maps (subject id, student id) to the marks obtained, and has to be validated beforehand.
+    """
+    subject_list = list(subject_list)
+    student_list = list(student_list)
+    with transaction.atomic():
+        exam = Exam.objects.create(which_class_id=class_id, name=name, date=date)
+        Test.objects.bulk_create([Test(subject=subject, exam=exam, name=name, date=date, total_marks=total_marks)
+                                  for subject in subject_list])
+        # bulk_create does not set primary keys on every database, so the new tests are read back
+        test_list = Test.objects.filter(exam=exam)
+        Marks.objects.bulk_create([Marks(test=test, student=student, marks=marks[(test.subject_id, student.id)])
+                                   for test in test_list for student in student_list], batch_size=500)
+        StudentDashboard.invalidate_class(class_id)
+    bump_class_version(class_id)
+    return exam
+
+
+def bulk_update(model, rows, batch_size=100):
+    """
+    Sets fields of several rows of model given as a dictionary of primary key to a dictionary of field
+    names to values, using one UPDATE statement per batch_size rows for all the fields changed in the batch
+    """
+    pks = list(rows)
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start:start + batch_size]
+        fields = set(name for pk in batch for name in rows[pk])
+        model.objects.filter(pk__in=batch).update(**dict(
+            (name, Case(*[When(pk=pk, then=Value(rows[pk][name])) for pk in batch if name in rows[pk]],
+                        default=F(name), output_field=model._meta.get_field(name)))
+            for name in fields))
+
+
+def update_marks(marks, batch_size=100):
+    """
+    Sets the marks of several Marks rows given as a dictionary of mark id to marks, placeholders becoming
+    entered marks, using one UPDATE statement per batch_size rows
+    """
+    bulk_update(Marks, dict((pk, {'marks': value, 'placeholder': False}) for pk, value in marks.items()), batch_size)
+
+
+def edit_test(test_list, total_marks, old_marks, new_marks):
+    """
+    Saves the edited total marks of the tests of an exam and the edited marks, in one transaction.
+    old_marks and new_marks map mark ids to the marks before and after the edit; only the marks
+    that changed are written.
+    """
+    test_list = list(test_list)
+    changed = dict((pk, value) for pk, value in new_marks.items() if old_marks.get(pk) != value)
+    with transaction.atomic():
+        Test.objects.filter(pk__in=[test.pk for test in test_list]).exclude(total_marks=total_marks).update(
+            total_marks=total_marks)
+        update_marks(changed)
+        StudentDashboard.invalidate(set(Marks.objects.filter(pk__in=list(changed)).values_list('student',
+                                                                                               flat=True)))
+    bump_class_version(*Subject.objects.filter(test__in=test_list).values_list('which_class', flat=True))
+
+
+####################################################
+#           Student Writers                        #
+####################################################
+
+# the details of a student edited by teacher_student_edit, which_class being given by its id
+STUDENT_EDIT_FIELDS = ('roll_no', 'phone', 'name', 'which_class')
+
+
+def _add_missing_marks(moved):
+    """
+    Creates marks of 0 for the students of moved, a dictionary of student id to the id of their new class,
+    in the tests of their new class they have no marks in
+    """
+    class_ids = set(moved.values())
+    test_ids = defaultdict(list)
+    for test_id, class_id in Test.objects.filter(subject__which_class__in=class_ids).values_list(
+            'id', 'subject__which_class'):
+        test_ids[class_id].append(test_id)
+    existing = set(Marks.objects.filter(student__in=list(moved), test__subject__which_class__in=class_ids)
+                   .values_list('student', 'test'))
+    Marks.objects.bulk_create([Marks(student_id=student_id, test_id=test_id, marks=0, placeholder=True)
+                               for student_id, class_id in moved.items() for test_id in test_ids[class_id]
+                               if (student_id, test_id) not in existing], batch_size=500)
+
+
+def update_students(student_list, edits, deleted_ids=()):
+    """
+    Saves the details of the students in student_list edited on a form, in one transaction.
+    edits maps student ids to dictionaries of the STUDENT_EDIT_FIELDS and password, an empty password
+    keeping the current one. Only the details that changed are written, with one bulk update, and the
+    students of deleted_ids are deleted along with their users. Students moving to another class get
+    marks of 0 in the tests of the new class.
+    """
+    student_list = list(student_list)
+    deleted_ids = set(deleted_ids)
+    changes = {}
+    passwords = {}
+    for student in student_list:
+        if student.pk in deleted_ids or student.pk not in edits:
+            continue
+        edit = edits[student.pk]
+        changed = dict((name, edit[name]) for name in STUDENT_EDIT_FIELDS
+                       if edit[name] != getattr(student, Student._meta.get_field(name).attname))
+        if changed:
+            changes[student.pk] = changed
+        if edit.get('password'):
+            passwords[student.user_id] = {'password': make_password(edit['password'])}
+    moved = dict((pk, changed['which_class']) for pk, changed in changes.items() if 'which_class' in changed)
+    with transaction.atomic():
+        if deleted_ids:
+            User.objects.filter(student__in=deleted_ids).delete()
+        bulk_update(Student, changes)
+        bulk_update(User, passwords)
+        if moved:
+            _add_missing_marks(moved)
+        StudentDashboard.invalidate(changes)
+    bump_user_context(*[student.user_id for student in student_list if student.pk in moved])
+    bump_class_version(*set(student.which_class_id for student in student_list) | set(moved.values()))
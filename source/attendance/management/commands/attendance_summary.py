@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from attendance.bitmaps import summarize_term
+from attendance.models import Class, Student
+
+
+class Command(BaseCommand):
+    help = 'Prints the attendance of the school or of a class over a term, read from the term attendance bitmaps'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--class', dest='class_id', type=int, help='id of the class, the whole school by default')
+        parser.add_argument('--date', help='a day of the term, YYYY-MM-DD, today by default')
+        parser.add_argument('--previous', action='store_true', help='the term before the one of the date')
+        parser.add_argument('--below', type=float, default=75,
+                            help='list the students present on less than this percentage of the days')
+
+    def handle(self, *args, **options):
+        date = None
+        if options['date'] is not None:
+            date = parse_date(options['date'])
+            if date is None:
+                raise CommandError('Invalid date %s' % options['date'])
+        student_list = None
+        if options['class_id'] is not None:
+            if not Class.objects.filter(pk=options['class_id']).exists():
+                raise CommandError('No class with id %d' % options['class_id'])
+            student_list = Student.objects.filter(which_class=options['class_id'])
+        summary = summarize_term(date, student_list, options['previous'])
+
+        self.stdout.write('Term from %s to %s: %d students, %d days, %s%% present' % (
+            summary['term_start'], summary['term_end'], len(summary['students']), summary['days'],
+            summary['percentage_present']))
+        self.stdout.write(self.style.MIGRATE_HEADING('Absences by week day'))
+        for weekday, days, absent in summary['weekdays']:
+            self.stdout.write('    %-9s %4d days, %6d absences, %.1f a day' % (weekday, days, absent,
+                                                                               float(absent) / days))
+        below = dict((student_id, student) for student_id, student in summary['students'].items()
+                     if float(student['percentage_present']) < options['below'])
+        self.stdout.write(self.style.MIGRATE_HEADING('Students present less than %g%% of the days' %
+                                                     options['below']))
+        for student in Student.objects.filter(pk__in=list(below)).select_related('which_class').order_by(
+                'which_class__grade', 'which_class__division', 'roll_no'):
+            self.stdout.write('    %s roll %d %s: %s%%, %d days in a row at most, %d since the last absence' % (
+                student.which_class, student.roll_no, student.name, below[student.pk]['percentage_present'],
+                below[student.pk]['longest_streak'], below[student.pk]['current_streak']))
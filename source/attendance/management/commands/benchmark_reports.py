@@ -0,0 +1,66 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from attendance.benchmark import run_benchmarks
+from attendance.models import Attendance, Class, Marks, Student
+
+METRICS = ('median_seconds', 'queries', 'peak_memory_bytes')
+
+
+class Command(BaseCommand):
+    help = 'Times the report helpers and views on the data in the database, see the generate_school command'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--class', dest='class_id', type=int,
+                            help='id of the class to report on, the class with most students by default')
+        parser.add_argument('--repeat', type=int, default=5, help='runs of every benchmark')
+        parser.add_argument('--warm', action='store_true', help='keep the report cache between runs')
+        parser.add_argument('--only', action='append', help='run only the benchmarks starting with this name')
+        parser.add_argument('--output', help='JSON file to write the results to')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare the results with')
+
+    def handle(self, *args, **options):
+        class_obj = None
+        if options['class_id'] is not None:
+            class_obj = Class.objects.filter(pk=options['class_id']).first()
+            if class_obj is None:
+                raise CommandError('No class with id %d' % options['class_id'])
+        results = run_benchmarks(class_obj, options['repeat'], not options['warm'], options['only'])
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'warm_cache': options['warm'],
+            'size': {
+                'students': Student.objects.count(),
+                'attendance': Attendance.objects.count(),
+                'marks': Marks.objects.count(),
+            },
+            'results': results,
+        }
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as compare_file:
+                previous = json.load(compare_file)['results']
+
+        self.stdout.write('%-45s %12s %8s %14s' % ('benchmark', 'median ms', 'queries', 'peak KiB'))
+        for name in sorted(results):
+            result = results[name]
+            peak = result['peak_memory_bytes']
+            self.stdout.write('%-45s %12.2f %8d %14s' % (name, result['median_seconds'] * 1000, result['queries'],
+                                                         '-' if peak is None else '%.1f' % (peak / 1024.0)))
+            if name in previous:
+                changes = []
+                for metric in METRICS:
+                    before, after = previous[name].get(metric), result[metric]
+                    if before and after is not None:
+                        changes.append('%s %+.1f%%' % (metric, (float(after) - before) / before * 100))
+                self.stdout.write('%-45s %s' % ('', ', '.join(changes)))
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2, sort_keys=True)
+            self.stdout.write('Results written to %s' % options['output'])
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+
+from attendance.dashboard import build_dashboard
+from attendance.helper import get_attendance_complete, get_attendance_report_from_to, get_attendance_students, \
+    get_exam_marks, get_marks_matrix, get_report_range, get_school_overview, get_subject_marks_report, get_today
+from attendance.models import Attendance, Class, Student, Test
+from attendance.report_jobs import get_class_report
+from attendance.sql_profiler import CursorHook
+
+
+class StatementCursorWrapper(CursorWrapper):
+    """
+    Cursor adding every statement it runs, with its parameters, to a list
+    """
+
+    def __init__(self, cursor, db, statements):
+        super(StatementCursorWrapper, self).__init__(cursor, db)
+        self.statements = statements
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        return super(StatementCursorWrapper, self).execute(sql, params)
+
+
+class Command(BaseCommand):
+    help = 'Prints the database query plan of every query the reports run, to check that they use the indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--class', dest='class_id', type=int,
+                            help='id of the class to build the queries for, the first class by default')
+
+    def handle(self, *args, **options):
+        if options['class_id'] is None:
+            class_obj = Class.objects.order_by('id').first()
+        else:
+            class_obj = Class.objects.filter(pk=options['class_id']).first()
+        if class_obj is None:
+            raise CommandError('No class to explain the reports of')
+        student = Student.objects.filter(which_class=class_obj).order_by('roll_no').first()
+        test = Test.objects.filter(subject__which_class=class_obj).select_related('subject').order_by('date').first()
+        if student is None or test is None:
+            raise CommandError('Class %s needs at least one student and one test' % class_obj)
+        student_list = list(Student.objects.filter(which_class=class_obj).order_by('roll_no'))
+        test_list = list(Test.objects.filter(exam=test.exam_id).select_related('subject').order_by('subject__name'))
+        from_date, to_date = get_report_range({'range': '30'})[:2]
+        term_from, term_to = get_report_range({'range': 'term'})[:2]
+
+        # the functions the views call, each run with the queries it makes recorded
+        reports = [
+            ('Roll number taken in the class, adding a student',
+             lambda: Student.objects.filter(which_class_id=class_obj.id, roll_no=student.roll_no).exists()),
+            ('Students of the class by roll number',
+             lambda: list(Student.objects.filter(which_class_id=class_obj.id).order_by('roll_no'))),
+            ('Attendance of the class today',
+             lambda: list(Attendance.objects.filter(student__which_class_id=class_obj.id, date=get_today()).order_by(
+                 'student__roll_no'))),
+            ('Attendance of the class, all time', lambda: get_attendance_students(student_list)),
+            ('Attendance of the class in the last 30 days',
+             lambda: get_attendance_students(student_list, from_date, to_date)),
+            ('Attendance of the class this term', lambda: get_attendance_students(student_list, term_from, term_to)),
+            ('Attendance of a student, all time', lambda: get_attendance_complete(student)),
+            ('Attendance of a student in the last 30 days',
+             lambda: get_attendance_report_from_to(student, from_date, to_date)),
+            ('Marks of a student by exam', lambda: get_exam_marks(student, class_obj.id)),
+            ('Marks of the class in a subject', lambda: get_subject_marks_report(student_list, [test.subject])),
+            ('Marks of the class in an exam, editing it', lambda: get_marks_matrix(student_list, test_list)),
+            ('Dashboard of a student', lambda: build_dashboard(student)),
+            ("Principal's report of the class in the last 30 days",
+             lambda: get_class_report(class_obj.id, from_date, to_date)),
+            ('Overview of the school', get_school_overview),
+        ]
+        explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        for title, report in reports:
+            statements = []
+            with CursorHook(lambda cursor, db: StatementCursorWrapper(cursor, db, statements)):
+                report()
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            with connection.cursor() as cursor:
+                for sql, params in statements:
+                    cursor.execute(explain + sql, params)
+                    self.stdout.write(sql % tuple(params or ()))
+                    for row in cursor.fetchall():
+                        self.stdout.write('    ' + ' | '.join(str(column) for column in row))
+            self.stdout.write('')
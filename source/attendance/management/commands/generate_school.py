@@ -0,0 +1,116 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from attendance.helper import get_today
+from attendance.models import Class, Teacher, Student, Subject, Exam, Test, Marks, Attendance, Principal
+
+DIVISIONS = 'ABCDEFGH'
+
+
+class Command(BaseCommand):
+    help = 'Generates a reproducible synthetic school, to measure EduSys against'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classes', type=int, default=4)
+        parser.add_argument('--students', type=int, default=40, help='students per class')
+        parser.add_argument('--subjects', type=int, default=6, help='subjects per class')
+        parser.add_argument('--tests', type=int, default=4, help='exams, each having a test per subject')
+        parser.add_argument('--days', type=int, default=60, help='school days of attendance up to today')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the random marks and attendance')
+        parser.add_argument('--prefix', default='bench', help='prefix of the generated usernames')
+        parser.add_argument('--password', default='password', help='password of every generated user')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix + '_').exists():
+            raise CommandError('Users named %s_* exist already, choose another --prefix' % prefix)
+        rand = random.Random(options['seed'])
+        password = make_password(options['password'])
+        groups = dict((name, Group.objects.get_or_create(name=name)[0])
+                      for name in ('Teacher', 'Student', 'Principal', 'Admin'))
+
+        with transaction.atomic():
+            class_list = []
+            for number in range(options['classes']):
+                class_list.append(Class.objects.create(grade=number // len(DIVISIONS) + 1,
+                                                       division=DIVISIONS[number % len(DIVISIONS)]))
+            usernames = [(prefix + '_principal', 'Principal')]
+            for class_obj in class_list:
+                usernames.append(('%s_teacher_%d' % (prefix, class_obj.id), 'Teacher'))
+                usernames.extend(('%s_student_%d_%d' % (prefix, class_obj.id, roll), 'Student')
+                                 for roll in range(1, options['students'] + 1))
+            User.objects.bulk_create([User(username=username, password=password) for username, group in usernames],
+                                     batch_size=500)
+            users = dict(User.objects.filter(username__startswith=prefix + '_').values_list('username', 'id'))
+            User.groups.through.objects.bulk_create([
+                User.groups.through(user_id=users[username], group_id=groups[group].id)
+                for username, group in usernames
+            ], batch_size=500)
+            Principal.objects.create(user_id=users[prefix + '_principal'])
+
+            teachers = []
+            students = []
+            subjects = []
+            for class_obj in class_list:
+                teachers.append(Teacher(user_id=users['%s_teacher_%d' % (prefix, class_obj.id)],
+                                        which_class=class_obj, name='Teacher %s' % class_obj))
+                for roll in range(1, options['students'] + 1):
+                    students.append(Student(user_id=users['%s_student_%d_%d' % (prefix, class_obj.id, roll)],
+                                            which_class=class_obj, roll_no=roll,
+                                            phone=rand.randint(7000000000, 9999999999),
+                                            name='Student %d of %s' % (roll, class_obj)))
+                subjects.extend(Subject(which_class=class_obj, name='Subject %d' % number)
+                                for number in range(1, options['subjects'] + 1))
+            Teacher.objects.bulk_create(teachers)
+            Student.objects.bulk_create(students, batch_size=500)
+            Subject.objects.bulk_create(subjects, batch_size=500)
+
+            class_ids = [class_obj.id for class_obj in class_list]
+            subjects = list(Subject.objects.filter(which_class__in=class_ids).order_by('id'))
+            today = get_today()
+            Exam.objects.bulk_create([
+                Exam(which_class=class_obj, name='Exam %d' % number,
+                     date=today - datetime.timedelta(days=(options['tests'] - number) * 30))
+                for class_obj in class_list for number in range(1, options['tests'] + 1)
+            ], batch_size=500)
+            exam_list = list(Exam.objects.filter(which_class__in=class_ids).order_by('id'))
+            Test.objects.bulk_create([
+                Test(subject=subject, exam=exam, name=exam.name, total_marks=100, date=exam.date)
+                for exam in exam_list for subject in subjects if subject.which_class_id == exam.which_class_id
+            ], batch_size=500)
+
+            students_of = {}
+            for student_id, class_id in Student.objects.filter(which_class__in=class_ids).order_by(
+                    'id').values_list('id', 'which_class'):
+                students_of.setdefault(class_id, []).append(student_id)
+            tests = Test.objects.filter(subject__in=subjects).order_by('id').values_list('id', 'subject__which_class')
+            Marks.objects.bulk_create([
+                Marks(test_id=test_id, student_id=student_id, marks=rand.randint(20, 100))
+                for test_id, class_id in tests for student_id in students_of[class_id]
+            ], batch_size=500)
+
+            days = []
+            day = today
+            while len(days) < options['days']:
+                if day.weekday() != 6:
+                    days.append(day)
+                day -= datetime.timedelta(days=1)
+            student_ids = [student_id for class_id in class_ids for student_id in students_of[class_id]]
+            for day in days:
+                Attendance.objects.bulk_create([
+                    Attendance(student_id=student_id, date=day, is_present=rand.random() < 0.9)
+                    for student_id in student_ids
+                ], batch_size=500)
+
+        call_command('rebuild_attendance_rollup', stdout=self.stdout)
+        self.stdout.write('Generated %d classes of %d students with %d subjects, %d exams and %d days of attendance'
+                          % (options['classes'], options['students'], options['subjects'], options['tests'],
+                             options['days']))
+        self.stdout.write('Users are named %s_principal, %s_teacher_<class id> and %s_student_<class id>_<roll no>'
+                          % (prefix, prefix, prefix))
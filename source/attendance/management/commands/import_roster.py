@@ -0,0 +1,36 @@
+from multiprocessing import cpu_count
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.models import Class
+from attendance.roster import COLUMNS, RosterError, import_roster, parse_roster
+
+
+class Command(BaseCommand):
+    help = 'Adds the students of a CSV roster with the columns %s to a class' % ', '.join(COLUMNS)
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help='CSV file of the students')
+        parser.add_argument('--class', dest='class_id', type=int, help='id of the class')
+        parser.add_argument('--processes', type=int, default=cpu_count(),
+                            help='processes hashing the passwords, one per CPU by default')
+        parser.add_argument('--dry-run', action='store_true', help='only validate the roster')
+
+    def handle(self, *args, **options):
+        if options['class_id'] is None:
+            raise CommandError('Give the class to add the students to with --class')
+        if not Class.objects.filter(pk=options['class_id']).exists():
+            raise CommandError('No class with id %d' % options['class_id'])
+        with open(options['roster'], 'rb') as roster_file:
+            content = roster_file.read()
+        try:
+            rows = parse_roster(content, options['class_id'])
+        except RosterError as error:
+            for line, message in error.errors:
+                self.stderr.write('line %d: %s' % (line, message))
+            raise CommandError('The roster has %d errors, no student was added' % len(error.errors))
+        if options['dry_run']:
+            self.stdout.write('The roster of %d students is valid' % len(rows))
+            return
+        created = import_roster(rows, options['class_id'], options['processes'])
+        self.stdout.write('Added %d students' % created)
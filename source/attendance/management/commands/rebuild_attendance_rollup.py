@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, When
+from django.db.models.functions import TruncMonth
+
+from attendance.bitmaps import rebuild_bitmaps
+from attendance.models import Attendance, AttendanceRollup, StudentDashboard
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the monthly attendance rollup and the term bitmaps of every student from the daily ' \
+           'attendance rows'
+
+    def handle(self, *args, **options):
+        counts = Attendance.objects.annotate(
+            month=TruncMonth('date')
+        ).values('student', 'month').annotate(
+            present=Sum(Case(When(is_present=True, then=1), default=0, output_field=IntegerField())),
+            total=Count('id'),
+        ).order_by()
+        rollups = [AttendanceRollup(student_id=row['student'], month=row['month'],
+                                    present=row['present'], absent=row['total'] - row['present'])
+                   for row in counts]
+        with transaction.atomic():
+            AttendanceRollup.objects.all().delete()
+            AttendanceRollup.objects.bulk_create(rollups, batch_size=500)
+            StudentDashboard.objects.update(version=F('version') + 1, data='')
+        self.stdout.write('Rebuilt %d monthly attendance rollups' % len(rollups))
+        self.stdout.write('Rebuilt %d term attendance bitmaps' % rebuild_bitmaps())
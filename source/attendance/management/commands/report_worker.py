@@ -0,0 +1,70 @@
+import time
+from multiprocessing import cpu_count
+
+from django.core.management.base import BaseCommand
+
+from attendance.models import ReportJob
+from attendance.report_jobs import claim_jobs, delete_expired_jobs, finish_job, reset_interrupted_jobs, run_job, \
+    start_pool
+
+
+class Command(BaseCommand):
+    help = 'Generates the reports queued as report jobs in a pool of processes, waiting for new ones until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=cpu_count(),
+                            help='reports generated at the same time, the number of CPUs by default')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='seconds to wait before looking at the queue again')
+        parser.add_argument('--timeout', type=float, default=600.0,
+                            help='seconds after which a report is given up as failed')
+        parser.add_argument('--once', action='store_true', help='exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        interrupted = reset_interrupted_jobs(options['timeout'])
+        if interrupted:
+            self.stdout.write('Resuming %d reports left by a previous worker' % interrupted)
+        deleted = delete_expired_jobs()
+        if deleted:
+            self.stdout.write('Deleted %d expired reports' % deleted)
+        pool = start_pool(options['processes'])
+        # job id: (result of the pool, time it was started)
+        running = {}
+        try:
+            while True:
+                for job_id, (result, started) in list(running.items()):
+                    if result.ready():
+                        del running[job_id]
+                        self.stdout.write('Report %d %s' % (job_id, result.get()))
+                timed_out = [job_id for job_id, (result, started) in running.items()
+                             if time.time() - started > options['timeout']]
+                if timed_out:
+                    # a stuck process can only be stopped with the whole pool, the other reports are run again
+                    pool.terminate()
+                    pool.join()
+                    for job_id in timed_out:
+                        finish_job(job_id, ReportJob.FAILED, error='Timed out')
+                        self.stdout.write('Report %d timed out' % job_id)
+                    ReportJob.objects.filter(pk__in=list(running), status=ReportJob.RUNNING).exclude(
+                        pk__in=timed_out).update(status=ReportJob.PENDING, started=None)
+                    running = {}
+                    pool = start_pool(options['processes'])
+                claimed = claim_jobs(options['processes'] - len(running))
+                for job_id in claimed:
+                    running[job_id] = (pool.apply_async(run_job, (job_id,)), time.time())
+                if claimed:
+                    continue
+                if running:
+                    # woken early by the oldest report finishing
+                    min(running.values(), key=lambda job: job[1])[0].wait(options['interval'])
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.terminate()
+            pool.join()
+            ReportJob.objects.filter(pk__in=list(running), status=ReportJob.RUNNING).update(
+                status=ReportJob.PENDING, started=None)
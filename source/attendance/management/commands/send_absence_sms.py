@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from attendance.sms_sender import SmsDispatcher, BASE_URL, send_sms
+
+
+class Command(BaseCommand):
+    help = 'Sends an SMS to the parents of every student absent on a day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='day of the absences as YYYY-MM-DD, today by default')
+        parser.add_argument('--url', default=BASE_URL, help='URL of the SMS gateway')
+
+    def handle(self, *args, **options):
+        date = None
+        if options['date'] is not None:
+            date = parse_date(options['date'])
+            if date is None:
+                raise CommandError('Invalid date: %s' % options['date'])
+        dispatcher = SmsDispatcher(base_url=options['url'])
+        start = time.time()
+        try:
+            sent, failed = send_sms(date, dispatcher)
+        finally:
+            dispatcher.close()
+        elapsed = time.time() - start
+        self.stdout.write('Sent %d messages, %d failed, in %.2f seconds' % (sent, failed, elapsed))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from attendance.models import SmsOutbox
+from attendance.sms_sender import SmsDispatcher, BASE_URL, OUTBOX_CLAIM_TIMEOUT, reset_interrupted_outbox, \
+    send_outbox_batch
+
+
+class Command(BaseCommand):
+    help = 'Sends the absence messages queued in the SMS outbox, waiting for new ones until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='absences taken from the outbox at once')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='seconds to wait before looking at an empty outbox again')
+        parser.add_argument('--once', action='store_true', help='exit once the outbox is empty')
+        parser.add_argument('--retry-failed', action='store_true', help='send the failed absences again')
+        parser.add_argument('--url', default=BASE_URL, help='URL of the SMS gateway')
+        parser.add_argument('--claim-timeout', type=float, default=OUTBOX_CLAIM_TIMEOUT,
+                            help='seconds after which absences being sent are taken to be left by a stopped worker')
+
+    def handle(self, *args, **options):
+        interrupted = reset_interrupted_outbox(options['claim_timeout'])
+        if interrupted:
+            self.stdout.write('Resuming %d absences left by a previous worker' % interrupted)
+        if options['retry_failed']:
+            retried = SmsOutbox.objects.filter(status=SmsOutbox.FAILED).update(status=SmsOutbox.PENDING)
+            self.stdout.write('Retrying %d failed absences' % retried)
+        dispatcher = SmsDispatcher(base_url=options['url'])
+        try:
+            while True:
+                sent, failed = send_outbox_batch(dispatcher, options['batch_size'])
+                if sent or failed:
+                    self.stdout.write('Sent %d absences, %d failed' % (sent, failed))
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from django.core.management.base import BaseCommand
+
+
+class StubGatewayServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency, failure_rate, output=None):
+        HTTPServer.__init__(self, address, StubGatewayHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        # where the received messages are written, None to keep quiet
+        self.output = output
+        self.received = 0
+        self.lock = threading.Lock()
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    """
+    Accepts a message like the SMS gateway does, after the configured latency,
+    answering 503 to the configured share of requests
+    """
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self.respond(503, 'Service unavailable')
+            return
+        with self.server.lock:
+            self.server.received += 1
+            received = self.server.received
+        if self.server.output is not None:
+            query = parse_qs(urlparse(self.path).query)
+            self.server.output.write('#%d to %s: %s' % (received, query.get('to', [''])[0],
+                                                        query.get('msg', [''])[0]))
+        self.respond(200, 'Message accepted')
+
+    def respond(self, status, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Runs a local stand-in for the SMS gateway, to send absence messages without a real gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--latency', type=float, default=0.05, help='seconds taken to answer a request')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='share of requests answered with an error, between 0 and 1')
+        parser.add_argument('--quiet', action='store_true', help='do not print the received messages')
+
+    def handle(self, *args, **options):
+        server = StubGatewayServer(('127.0.0.1', options['port']), options['latency'], options['failure_rate'],
+                                   None if options['quiet'] else self.stdout)
+        self.stdout.write('SMS gateway stub listening on http://127.0.0.1:%d/sendsms' % options['port'])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('Received %d messages' % server.received)
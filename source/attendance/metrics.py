@@ -0,0 +1,251 @@
+"""
+Request metrics of every view, in the Prometheus text exposition format.
+
+MetricsMiddleware records for every request the latency, the number of queries, the time spent in the
+database and the time spent rendering templates, labelled with the URL name of the view. They are kept in
+the memory of the server process and served at /edu/metrics/ to the addresses in METRICS_ALLOWED_IPS, bearing
+METRICS_TOKEN when it is set, and written to METRICS_DUMP_FILE every METRICS_DUMP_INTERVAL seconds when it is
+set. Recording a request costs a few clock readings and one short lock, so it can stay enabled in production.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.utils import CursorWrapper
+from django.template.backends.django import DjangoTemplates
+
+from attendance.sql_profiler import CursorHook
+
+ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = tuple(getattr(settings, 'METRICS_BUCKETS', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+
+ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+
+# bearer token scrapers must send when set, needed behind a reverse proxy where every request comes from its address
+TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+
+# file the metrics are written to periodically, None to not write them. %(pid)s is replaced by the process id.
+DUMP_FILE = getattr(settings, 'METRICS_DUMP_FILE', None)
+DUMP_INTERVAL = getattr(settings, 'METRICS_DUMP_INTERVAL', 60)
+
+PREFIX = 'edusys_'
+
+# name of the views whose URL did not resolve
+UNMATCHED = 'unmatched'
+
+_lock = threading.Lock()
+_views = {}
+_local = threading.local()
+
+
+class ViewMetrics(object):
+    """
+    Totals of the requests to one view
+    """
+    __slots__ = ('buckets', 'count', 'seconds', 'queries', 'db_seconds', 'template_seconds', 'statuses')
+
+    def __init__(self):
+        # requests per latency bucket, not cumulative, the last one being +Inf
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statuses = {}
+
+    def observe(self, seconds, status, queries, db_seconds, template_seconds):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.seconds += seconds
+        self.queries += queries
+        self.db_seconds += db_seconds
+        self.template_seconds += template_seconds
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def record_request(view, seconds, status, queries=0, db_seconds=0.0, template_seconds=0.0):
+    """
+    Adds a request to the metrics of view
+    """
+    with _lock:
+        metrics = _views.get(view)
+        if metrics is None:
+            metrics = _views[view] = ViewMetrics()
+        metrics.observe(seconds, status, queries, db_seconds, template_seconds)
+
+
+def reset_metrics():
+    with _lock:
+        _views.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def get_metrics_text():
+    """
+    Returns the metrics of all views in the Prometheus text exposition format
+    """
+    with _lock:
+        views = sorted((view, metrics.buckets[:], metrics.count, metrics.seconds, metrics.queries,
+                        metrics.db_seconds, metrics.template_seconds, sorted(metrics.statuses.items()))
+                       for view, metrics in _views.items())
+    lines = [
+        '# HELP %srequest_duration_seconds Time taken to answer requests, per view.' % PREFIX,
+        '# TYPE %srequest_duration_seconds histogram' % PREFIX,
+    ]
+    for view, buckets, count, seconds, queries, db_seconds, template_seconds, statuses in views:
+        label = _escape(view)
+        total = 0
+        for bound, requests in zip(BUCKETS + ('+Inf',), buckets):
+            total += requests
+            lines.append('%srequest_duration_seconds_bucket{view="%s",le="%s"} %d' % (
+                PREFIX, label, bound if bound == '+Inf' else _format_bound(bound), total))
+        lines.append('%srequest_duration_seconds_sum{view="%s"} %r' % (PREFIX, label, seconds))
+        lines.append('%srequest_duration_seconds_count{view="%s"} %d' % (PREFIX, label, count))
+    counters = (
+        ('requests_total', 'Requests answered, per view and status code.', None),
+        ('request_queries_total', 'SQL queries run by requests, per view.', 4),
+        ('request_db_seconds_total', 'Time spent running SQL queries, per view.', 5),
+        ('request_template_seconds_total', 'Time spent rendering templates, queries they run included, per view.', 6),
+    )
+    for name, description, index in counters:
+        lines.append('# HELP %s%s %s' % (PREFIX, name, description))
+        lines.append('# TYPE %s%s counter' % (PREFIX, name))
+        for row in views:
+            label = _escape(row[0])
+            if index is None:
+                for status, requests in row[7]:
+                    lines.append('%s%s{view="%s",status="%s"} %d' % (PREFIX, name, label, status, requests))
+            else:
+                lines.append('%s%s{view="%s"} %r' % (PREFIX, name, label, row[index]))
+    return '\n'.join(lines) + '\n'
+
+
+def dump_metrics(filename):
+    """
+    Writes the metrics to filename, replacing it at once so that readers never see a partial file
+    """
+    temporary = '%s.%d.tmp' % (filename, os.getpid())
+    with open(temporary, 'w') as metrics_file:
+        metrics_file.write(get_metrics_text())
+    os.rename(temporary, filename)
+
+
+def _dump_periodically(filename, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            dump_metrics(filename)
+        except (IOError, OSError):
+            pass
+
+
+########################################################
+#                   Recording                          #
+########################################################
+
+
+def _current():
+    """
+    Returns the [queries, db seconds, template seconds] of the request the thread is answering, or None
+    """
+    return getattr(_local, 'request', None)
+
+
+class TimingCursorWrapper(CursorWrapper):
+    """
+    Cursor adding the statements it runs and their duration to the current request
+    """
+
+    def _time(self, method, sql, params):
+        start = time.time()
+        try:
+            return method(sql, params)
+        finally:
+            current = _current()
+            if current is not None:
+                current[0] += 1
+                current[1] += time.time() - start
+
+    def execute(self, sql, params=None):
+        return self._time(super(TimingCursorWrapper, self).execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._time(super(TimingCursorWrapper, self).executemany, sql, param_list)
+
+
+class TimedTemplate(object):
+    """
+    Template of the Django backend adding the time it takes to render to the current request
+    """
+
+    def __init__(self, backend_template):
+        self.backend_template = backend_template
+
+    def __getattr__(self, name):
+        return getattr(self.backend_template, name)
+
+    def render(self, context=None, request=None):
+        start = time.time()
+        try:
+            return self.backend_template.render(context, request)
+        finally:
+            current = _current()
+            if current is not None:
+                current[2] += time.time() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing the rendering of its templates for the metrics
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super(TimedDjangoTemplates, self).get_template(template_name))
+
+
+class MetricsMiddleware(object):
+    """
+    Records the metrics of every request, see the module documentation. Removed from the middleware
+    when METRICS_ENABLED is False in settings.
+    """
+    dump_thread = None
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if DUMP_FILE and MetricsMiddleware.dump_thread is None:
+            thread = threading.Thread(target=_dump_periodically, name='metrics-dump',
+                                      args=(DUMP_FILE % {'pid': os.getpid()}, DUMP_INTERVAL))
+            thread.daemon = True
+            thread.start()
+            MetricsMiddleware.dump_thread = thread
+
+    def __call__(self, request):
+        current = _local.request = [0, 0.0, 0.0]
+        start = time.time()
+        try:
+            with CursorHook(TimingCursorWrapper):
+                response = self.get_response(request)
+        finally:
+            _local.request = None
+        match = getattr(request, 'resolver_match', None)
+        record_request((match.url_name or match.view_name) if match is not None else UNMATCHED,
+                       time.time() - start, response.status_code, *current)
+        return response
@@ -0,0 +1,115 @@
+"""
+Resolves who the logged in user is - their groups, their Teacher or Student row and their class -
+once, and keeps it in the session so that the decorators and views do not query it on every request.
+The stored context carries the version of the user's data, kept in the database by report_cache, and
+is resolved again once a change to the user's groups, Teacher or Student bumped it. Since the version
+is not kept in a per-process cache, a role revoked in one server process is refused by all of them on
+the next request.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.utils.functional import SimpleLazyObject
+
+from attendance.models import Teacher, Student
+from attendance.report_cache import get_version, bump_version
+
+SESSION_KEY = '_attendance_user_context'
+
+# the order in which a user belonging to several groups is sent to an index page
+ROLES = ('Student', 'Teacher', 'Admin', 'Principal')
+
+
+def _version_name(user_id):
+    return 'user:%s' % user_id
+
+
+def bump_user_context(*user_ids):
+    """
+    Makes the stored contexts of the users stale, for changes made without saving their Teacher or Student
+    """
+    bump_version(*[_version_name(user_id) for user_id in user_ids])
+
+
+def resolve_user_context(user):
+    """
+    Returns a dictionary describing the user
+    * roles : names of the groups of the user
+    * role : the group deciding the index page of the user, None if the user has none
+    * teacher_id, student_id : ids of the Teacher and Student of the user, or None
+    * class_id : id of the class the teacher teaches or the student studies in, or None
+    """
+    roles = list(user.groups.values_list('name', flat=True))
+    user_context = {
+        'user_id': user.pk,
+        'roles': roles,
+        'role': next((role for role in ROLES if role in roles), None),
+        'teacher_id': None,
+        'student_id': None,
+        'class_id': None,
+    }
+    if 'Teacher' in roles:
+        teacher = Teacher.objects.filter(user=user).values_list('id', 'which_class').first()
+        if teacher is not None:
+            user_context['teacher_id'], user_context['class_id'] = teacher
+    elif 'Student' in roles:
+        student = Student.objects.filter(user=user).values_list('id', 'which_class').first()
+        if student is not None:
+            user_context['student_id'], user_context['class_id'] = student
+    return user_context
+
+
+def get_user_context(request):
+    """
+    Returns the user context of the logged in user, as kept in the session unless it went stale.
+    An anonymous user gets a context without roles.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return {'user_id': None, 'roles': [], 'role': None, 'teacher_id': None, 'student_id': None, 'class_id': None}
+    version = get_version(_version_name(user.pk))
+    stored = request.session.get(SESSION_KEY)
+    if stored is not None and stored['user_id'] == user.pk and stored['version'] == version:
+        return stored['context']
+    user_context = resolve_user_context(user)
+    request.session[SESSION_KEY] = {'user_id': user.pk, 'version': version, 'context': user_context}
+    return user_context
+
+
+class UserContextMiddleware(object):
+    """
+    Sets request.user_context, see resolve_user_context. Has to come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user_context = SimpleLazyObject(lambda: get_user_context(request))
+        return self.get_response(request)
+
+
+########################################################
+#                   Invalidation                       #
+########################################################
+
+
+def invalidate_group_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_version(_version_name(instance.pk))
+    elif pk_set:
+        bump_version(*[_version_name(user_id) for user_id in pk_set])
+    else:
+        # a group was cleared of all its users, their ids are not known any more
+        bump_version(*[_version_name(user_id) for user_id in User.objects.values_list('id', flat=True)])
+
+
+def invalidate_user(sender, instance, **kwargs):
+    bump_version(_version_name(instance.user_id))
+
+
+m2m_changed.connect(invalidate_group_change, sender=User.groups.through, dispatch_uid='user_context_groups')
+for model in (Teacher, Student):
+    post_save.connect(invalidate_user, sender=model, dispatch_uid='user_context_save_%s' % model.__name__)
+    post_delete.connect(invalidate_user, sender=model, dispatch_uid='user_context_delete_%s' % model.__name__)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Max, Sum, When
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def remove_duplicate_attendance(apps, schema_editor):
+    """
+    Keeps only the latest of the rows a double submitted attendance form created for a student and day
+    """
+    Attendance = apps.get_model('attendance', 'Attendance')
+    duplicates = Attendance.objects.values('student', 'date').annotate(keep=Max('id'), rows=Count('id')).filter(
+        rows__gt=1).order_by()
+    for duplicate in duplicates:
+        Attendance.objects.filter(student=duplicate['student'], date=duplicate['date']).exclude(
+            pk=duplicate['keep']).delete()
+
+
+def fill_attendance_rollup(apps, schema_editor):
+    Attendance = apps.get_model('attendance', 'Attendance')
+    AttendanceRollup = apps.get_model('attendance', 'AttendanceRollup')
+    counts = Attendance.objects.annotate(month=TruncMonth('date')).values('student', 'month').annotate(
+        present=Sum(Case(When(is_present=True, then=1), default=0, output_field=IntegerField())),
+        total=Count('id'),
+    ).order_by()
+    AttendanceRollup.objects.bulk_create([
+        AttendanceRollup(student_id=row['student'], month=row['month'].date(), present=row['present'],
+                         absent=row['total'] - row['present'])
+        for row in counts
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('present', models.IntegerField(default=0)),
+                ('absent', models.IntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Student')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendancerollup',
+            unique_together=set([('student', 'month')]),
+        ),
+        migrations.RunPython(remove_duplicate_attendance, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together=set([('student', 'date')]),
+        ),
+        migrations.RunPython(fill_attendance_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Max, Sum, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+# students whose rollup is counted again by one query, below the limit of SQLite
+BATCH_SIZE = 500
+
+
+def rebuild_rollup(apps, student_ids):
+    """
+    Counts the monthly rollup of the students again from their remaining attendance rows
+    """
+    Attendance = apps.get_model('attendance', 'Attendance')
+    AttendanceRollup = apps.get_model('attendance', 'AttendanceRollup')
+    student_ids = sorted(student_ids)
+    for start in range(0, len(student_ids), BATCH_SIZE):
+        batch = student_ids[start:start + BATCH_SIZE]
+        AttendanceRollup.objects.filter(student__in=batch).delete()
+        counts = Attendance.objects.filter(student__in=batch).annotate(month=TruncMonth('school_date')).values(
+            'student', 'month').annotate(
+            present=Sum(Case(When(is_present=True, then=1), default=0, output_field=IntegerField())),
+            total=Count('id'),
+        ).order_by()
+        AttendanceRollup.objects.bulk_create([
+            AttendanceRollup(student_id=row['student'], month=row['month'], present=row['present'],
+                             absent=row['total'] - row['present'])
+            for row in counts
+        ], batch_size=BATCH_SIZE)
+
+
+def copy_school_date(apps, schema_editor):
+    """
+    Stores the local school date of every attendance datetime, one UPDATE per distinct datetime
+    """
+    Attendance = apps.get_model('attendance', 'Attendance')
+    for date in Attendance.objects.values_list('date', flat=True).distinct().order_by():
+        if timezone.is_aware(date):
+            school_date = timezone.localtime(date).date()
+        else:
+            school_date = date.date()
+        Attendance.objects.filter(date=date).update(school_date=school_date)
+    # two datetimes of a student falling on the same school day leave only the latest row
+    duplicates = Attendance.objects.values('student', 'school_date').annotate(keep=Max('id'), rows=Count('id')).filter(
+        rows__gt=1).order_by()
+    affected = set()
+    for duplicate in duplicates:
+        Attendance.objects.filter(student=duplicate['student'], school_date=duplicate['school_date']).exclude(
+            pk=duplicate['keep']).delete()
+        affected.add(duplicate['student'])
+    # the rollup filled by 0002 still counts the deleted rows
+    rebuild_rollup(apps, affected)
+
+
+def copy_datetime(apps, schema_editor):
+    Attendance = apps.get_model('attendance', 'Attendance')
+    for school_date in Attendance.objects.values_list('school_date', flat=True).distinct().order_by():
+        Attendance.objects.filter(school_date=school_date).update(date=school_date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_attendance_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='school_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(copy_school_date, copy_datetime),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together=set([]),
+        ),
+        migrations.RemoveField(
+            model_name='attendance',
+            name='date',
+        ),
+        migrations.RenameField(
+            model_name='attendance',
+            old_name='school_date',
+            new_name='date',
+        ),
+        migrations.AlterField(
+            model_name='attendance',
+            name='date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together=set([('student', 'date')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:17
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_marks(apps, schema_editor):
+    """
+    Keeps only the latest mark where a student got several for the same test
+    """
+    Marks = apps.get_model('attendance', 'Marks')
+    duplicates = Marks.objects.values('test', 'student').annotate(keep=Max('id'), rows=Count('id')).filter(
+        rows__gt=1).order_by()
+    for duplicate in duplicates:
+        Marks.objects.filter(test=duplicate['test'], student=duplicate['student']).exclude(
+            pk=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0003_attendance_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_marks, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='marks',
+            unique_together=set([('test', 'student')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='student',
+            index_together=set([('which_class', 'roll_no')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='test',
+            index_together=set([('subject', 'name'), ('subject', 'date')]),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 18:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Min
+import django.db.models.deletion
+
+
+def create_exams(apps, schema_editor):
+    """
+    Creates an exam for every name the tests of a class share, dated by the first of its tests
+    """
+    Exam = apps.get_model('attendance', 'Exam')
+    Test = apps.get_model('attendance', 'Test')
+    groups = Test.objects.values('subject__which_class', 'name').annotate(first_date=Min('date')).order_by()
+    for group in groups:
+        exam = Exam.objects.create(which_class_id=group['subject__which_class'], name=group['name'],
+                                   date=group['first_date'])
+        Test.objects.filter(subject__which_class=exam.which_class_id, name=exam.name).update(exam=exam)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0006_student_dashboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exam',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('which_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Class')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='exam',
+            unique_together=set([('which_class', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='exam',
+            index_together=set([('which_class', 'date')]),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='exam',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='attendance.Exam'),
+        ),
+        migrations.RunPython(create_exams, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='test',
+            index_together=set([('subject', 'date')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 18:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_exam'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='test',
+            name='exam',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Exam'),
+        ),
+    ]
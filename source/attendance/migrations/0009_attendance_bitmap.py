@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:38
+from __future__ import unicode_literals
+
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# rows inserted by one statement, below the limit of SQLite
+BATCH_SIZE = 500
+
+
+def get_term_start(date, term_starts):
+    """
+    Returns the first day of the term date is in, as attendance.helper.get_term did when this migration was written
+    """
+    return max(datetime.date(year, month, day) for year in (date.year - 1, date.year) for month, day in term_starts
+               if datetime.date(year, month, day) <= date)
+
+
+def pack_attendance(rows, term_starts):
+    """
+    Returns {(student id, term start): (recorded, present)} packed from rows of (student id, date, is present),
+    a copy of attendance.bitmaps.pack_attendance as it was when this migration was written
+    """
+    starts = {}
+    bitmaps = defaultdict(lambda: [0, 0])
+    for student_id, date, is_present in rows:
+        if date not in starts:
+            starts[date] = get_term_start(date, term_starts)
+        day = 1 << (date - starts[date]).days
+        bits = bitmaps[(student_id, starts[date])]
+        bits[0] |= day
+        if is_present:
+            bits[1] |= day
+    return bitmaps
+
+
+def fill_attendance_bitmaps(apps, schema_editor):
+    Attendance = apps.get_model('attendance', 'Attendance')
+    AttendanceBitmap = apps.get_model('attendance', 'AttendanceBitmap')
+    term_starts = getattr(settings, 'SCHOOL_TERM_STARTS', ((6, 1), (10, 1), (1, 1)))
+    bitmaps = pack_attendance(Attendance.objects.values_list('student', 'date', 'is_present').iterator(), term_starts)
+    AttendanceBitmap.objects.bulk_create([
+        AttendanceBitmap(student_id=student_id, term_start=term_start,
+                         recorded=recorded.to_bytes((recorded.bit_length() + 7) // 8, 'little'),
+                         present=present.to_bytes((present.bit_length() + 7) // 8, 'little'))
+        for (student_id, term_start), (recorded, present) in bitmaps.items()
+    ], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_test_exam_required'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term_start', models.DateField()),
+                ('recorded', models.BinaryField(default=b'')),
+                ('present', models.BinaryField(default=b'')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Student')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendancebitmap',
+            unique_together=set([('student', 'term_start')]),
+        ),
+        migrations.RunPython(fill_attendance_bitmaps, migrations.RunPython.noop),
+    ]
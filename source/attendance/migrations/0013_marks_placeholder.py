@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 18:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def flag_placeholder_marks(apps, schema_editor):
+    """
+    Flags the marks of 0 in tests held before the student was added, which can only have been given
+    as placeholders by the add student form or the roster import
+    """
+    Marks = apps.get_model('attendance', 'Marks')
+    Marks.objects.filter(marks=0, test__date__lt=F('student__user__date_joined')).update(placeholder=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0012_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marks',
+            name='placeholder',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(flag_placeholder_marks, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
 from __future__ import unicode_literals
 
+from collections import defaultdict
+
 from django.contrib.auth.models import User, Group
 from django.db import models
+from django.db.models import F
 
 
 # Create your models here.
@@ -68,6 +71,9 @@ class Student(models.Model):
     roll_no = models.IntegerField(unique=False)
     name = models.CharField(max_length=100)
 
+    class Meta:
+        index_together = ('which_class', 'roll_no')
+
     def set_user(self, user):
         self.user = user
         self.user.groups.add(Group.objects.get(name='Student'))
@@ -88,27 +94,289 @@ class Parent(models.Model):
 
 
 class Attendance(models.Model):
-    date = models.DateTimeField()
+    # the school day, in the time zone of the school
+    date = models.DateField(db_index=True)
     student = models.ForeignKey(Student)
     is_present = models.BooleanField(default=True)
 
+    class Meta:
+        unique_together = ('student', 'date')
+
+
+class AttendanceRollup(models.Model):
+    """
+    Present and absent day counts of a student in one month, kept in step with Attendance
+    so that reports read one row per month instead of one per day.
+    month is the first day of the month.
+    """
+    student = models.ForeignKey(Student)
+    month = models.DateField()
+    present = models.IntegerField(default=0)
+    absent = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('student', 'month')
+
+    @classmethod
+    def add_many(cls, date, changes):
+        """
+        Adds present and absent days to several students at once for the month of date.
+        changes maps student ids to (present, absent); students sharing a change are updated by one statement.
+        Meant to run inside the transaction writing the attendance rows.
+        """
+        month = date.replace(day=1)
+        existing = set(cls.objects.filter(month=month, student_id__in=list(changes)).values_list('student_id',
+                                                                                               flat=True))
+        by_change = defaultdict(list)
+        new_rollups = []
+        for student_id, (present, absent) in changes.items():
+            if student_id in existing:
+                by_change[(present, absent)].append(student_id)
+            else:
+                new_rollups.append(cls(student_id=student_id, month=month, present=present, absent=absent))
+        for (present, absent), student_ids in by_change.items():
+            cls.objects.filter(month=month, student_id__in=student_ids).update(present=F('present') + present,
+                                                                               absent=F('absent') + absent)
+        cls.objects.bulk_create(new_rollups)
+
+    def __str__(self):
+        return str(self.student) + ":" + self.month.strftime('%Y-%m')
+
+
+class AttendanceBitmap(models.Model):
+    """
+    The attendance of a student in one term packed into bits, kept in step with Attendance
+    so that analytics over the whole school read one small row per student.
+    Day n of the term, counting from term_start, is bit n of recorded when attendance was taken
+    and bit n of present when the student was present. Both are little endian bytes, see get_bits.
+    """
+    student = models.ForeignKey(Student)
+    term_start = models.DateField()
+    recorded = models.BinaryField(default=b'')
+    present = models.BinaryField(default=b'')
+
+    # rows updated by one statement
+    BATCH_SIZE = 100
+
+    class Meta:
+        unique_together = ('student', 'term_start')
+
+    @staticmethod
+    def get_bits(value):
+        """
+        Returns the bytes of recorded or present as an integer, bit n being day n of the term
+        """
+        return int.from_bytes(bytes(value), 'little')
+
+    @staticmethod
+    def get_bytes(bits):
+        return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+    @classmethod
+    def set_many(cls, term_start, date, presence):
+        """
+        Records the day date of the term starting on term_start for several students at once.
+        presence maps student ids to whether they were present.
+        Meant to run inside the transaction writing the attendance rows.
+        """
+        day = 1 << (date - term_start).days
+        bitmaps = dict((bitmap.student_id, bitmap) for bitmap in cls.objects.select_for_update().filter(
+            term_start=term_start, student_id__in=list(presence)))
+        new_bitmaps = []
+        for student_id, is_present in presence.items():
+            bitmap = bitmaps.get(student_id)
+            if bitmap is None:
+                bitmap = cls(student_id=student_id, term_start=term_start)
+                new_bitmaps.append(bitmap)
+            present = cls.get_bits(bitmap.present)
+            bitmap.recorded = cls.get_bytes(cls.get_bits(bitmap.recorded) | day)
+            bitmap.present = cls.get_bytes(present | day if is_present else present & ~day)
+        changed = list(bitmaps.values())
+        for start in range(0, len(changed), cls.BATCH_SIZE):
+            batch = changed[start:start + cls.BATCH_SIZE]
+            cls.objects.filter(pk__in=[bitmap.pk for bitmap in batch]).update(**dict(
+                (name, models.Case(*[models.When(pk=bitmap.pk, then=models.Value(getattr(bitmap, name)))
+                                     for bitmap in batch], output_field=models.BinaryField()))
+                for name in ('recorded', 'present')))
+        cls.objects.bulk_create(new_bitmaps, batch_size=cls.BATCH_SIZE)
+
+    def __str__(self):
+        return str(self.student) + ":" + str(self.term_start)
+
+
+class SmsOutbox(models.Model):
+    """
+    An absence to be reported to the parent by SMS, sent by the sms_outbox_worker command
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    student = models.ForeignKey(Student)
+    date = models.DateField()
+    phone = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, default=None)
+    # token of the batch of the worker sending the absence, and when it took it
+    claim = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    claimed = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        unique_together = ('student', 'date')
+        index_together = ('status', 'id')
+
+    @classmethod
+    def queue(cls, student_list, date):
+        """
+        Adds the absence on date of every student in student_list, skipping those already in the outbox
+        """
+        student_list = list(student_list)
+        existing = set(cls.objects.filter(student__in=student_list, date=date).values_list('student_id', flat=True))
+        cls.objects.bulk_create([cls(student=student, date=date, phone=student.phone)
+                                 for student in student_list if student.pk not in existing])
+
+    @classmethod
+    def cancel(cls, student_ids, date):
+        """
+        Removes the absences on date of the students that were marked present after all, unless already sent
+        """
+        cls.objects.filter(student__in=list(student_ids), date=date, status=cls.PENDING).delete()
+
+    def __str__(self):
+        return str(self.student) + ":" + str(self.date) + ":" + self.status
+
 
 class Subject(models.Model):
     name = models.CharField(max_length=100)
     which_class = models.ForeignKey(Class)
 
 
+class Exam(models.Model):
+    """
+    An exam of a class, grouping the tests of its subjects held under one name
+    """
+    which_class = models.ForeignKey(Class)
+    name = models.CharField(max_length=100)
+    date = models.DateField()
+
+    class Meta:
+        unique_together = ('which_class', 'name')
+        index_together = ('which_class', 'date')
+
+    def __str__(self):
+        return self.name
+
+
 class Test(models.Model):
     subject = models.ForeignKey(Subject)
+    exam = models.ForeignKey(Exam)
     total_marks = models.IntegerField()
+    # the name of the exam, kept on the test for the reports listing tests
     name = models.CharField(max_length=100, unique=False)
     date = models.DateField()
 
+    class Meta:
+        index_together = ('subject', 'date')
+
 
 class Marks(models.Model):
     marks = models.DecimalField(decimal_places=2, max_digits=7)
     test = models.ForeignKey(Test)
     student = models.ForeignKey(Student)
+    # the 0 given to a student who joined the class after the test, until a teacher enters their marks
+    placeholder = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('test', 'student')
+
+
+class StudentDashboard(models.Model):
+    """
+    Snapshot of the attendance and marks student_index shows a student, serialized as JSON in data,
+    see attendance/dashboard.py. Writers invalidate it by clearing data and incrementing version,
+    and it is rebuilt on the next read.
+    """
+    student = models.OneToOneField(Student, primary_key=True)
+    version = models.IntegerField(default=0)
+    data = models.TextField(blank=True, default='')
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def invalidate(cls, student_ids):
+        """
+        Marks the snapshots of the students as stale
+        """
+        student_ids = list(student_ids)
+        if student_ids:
+            cls.objects.filter(student_id__in=student_ids).update(version=F('version') + 1, data='')
+
+    @classmethod
+    def invalidate_class(cls, *class_ids):
+        """
+        Marks the snapshots of every student of the classes as stale
+        """
+        cls.objects.filter(student__which_class_id__in=[class_id for class_id in class_ids
+                                                         if class_id is not None]).update(
+            version=F('version') + 1, data='')
+
+    def __str__(self):
+        return str(self.student) + ":" + str(self.version)
+
+
+class DataVersion(models.Model):
+    """
+    The version of the data called name, such as the reports of a class, see attendance/report_cache.py.
+    Kept in the database so that every server process sees a bump on its next read.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.name + ":" + str(self.version)
+
+
+class ReportJob(models.Model):
+    """
+    A report asked for by user, generated by the report_worker command into a file under REPORT_JOB_ROOT,
+    see attendance/report_jobs.py. params holds the class, dates and format of the report as JSON.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(User)
+    kind = models.CharField(max_length=30)
+    params = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True, default='')
+    # name of the generated file, in REPORT_JOB_ROOT, and the name it is downloaded as
+    artifact = models.CharField(max_length=100, blank=True, default='')
+    filename = models.CharField(max_length=200, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, default=None)
+    finished = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        index_together = (('status', 'id'), ('user', 'id'))
+
+    def __str__(self):
+        return str(self.user) + ":" + self.kind + ":" + self.status
 
 
 # Experimental feature to be added
@@ -0,0 +1,148 @@
+"""
+Cache for the data behind the class reports.
+
+Every class has a data version, kept in the DataVersion table. Report data is cached under a key containing
+the version, so bumping the version whenever attendance, marks, tests, subjects or students of the class
+change makes the previous entries unreachable and they simply expire. The versions live in the database
+rather than in the cache because a bump has to reach every server process at once: with the local-memory
+backend each process has a cache of its own, and a version kept there would only change in the process
+that bumped it. Reading a version costs one primary key lookup. Any Django cache backend can hold the
+reports themselves, a shared one only saves building the same report in every process.
+
+Versions are bumped once the transaction writing the data commits, so that a report built in the meantime
+from the previous data can not be cached under the new version. Rows saved or deleted one by one, as in
+the cascade deleting an exam or a student, are collected until then and their classes bumped once.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_save
+
+from attendance.models import Attendance, DataVersion, Exam, Marks, Test, Subject, Student, Teacher
+
+REPORT_CACHE_TIMEOUT = getattr(settings, 'REPORT_CACHE_TIMEOUT', 60 * 60)
+
+# versions bumped and ids looked up in one query, below the limit of SQLite
+BATCH_SIZE = 500
+
+
+def _new_version():
+    # A version that was never handed out before, so that entries cached before the
+    # database was recreated can not be served again
+    return int(time.time() * 1000000)
+
+
+def get_version(name):
+    """
+    Returns the current version of the data called name
+    """
+    return DataVersion.objects.get_or_create(name=name, defaults={'version': _new_version()})[0].version
+
+
+def _bump_now(names):
+    # data whose version was never read has nothing cached, so only the existing rows are updated
+    names = list(names)
+    for start in range(0, len(names), BATCH_SIZE):
+        DataVersion.objects.filter(name__in=names[start:start + BATCH_SIZE]).update(version=F('version') + 1)
+
+
+def bump_version(*names):
+    """
+    Changes the version of the data called names, making everything cached for the previous version stale,
+    once the current transaction commits
+    """
+    names = set(names)
+    transaction.on_commit(lambda: _bump_now(names))
+
+
+def get_class_version(class_id):
+    """
+    Returns the current data version of the class
+    """
+    return get_version('class:%s' % class_id)
+
+
+def bump_class_version(*class_ids):
+    """
+    Invalidates the cached reports of the given classes. Call this after changing report data
+    without sending model signals, such as with bulk_create or QuerySet.update.
+    """
+    bump_version(*['class:%s' % class_id for class_id in class_ids if class_id is not None])
+
+
+def get_report(name, class_id, key, build):
+    """
+    Returns the report data cached under name and key for the current version of the class,
+    calling build() to create it on a miss.
+    """
+    cache_key = 'attendance:report:%s:%s:%s:%s' % (name, class_id, key, get_class_version(class_id))
+    report = cache.get(cache_key)
+    if report is None:
+        report = build()
+        cache.set(cache_key, report, REPORT_CACHE_TIMEOUT)
+    return report
+
+
+########################################################
+#                   Invalidation                       #
+########################################################
+
+
+# ids of the classes, subjects and students whose rows were saved or deleted since the last flush
+_pending = threading.local()
+
+
+def _class_ids(model, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        for class_id in model.objects.filter(pk__in=ids[start:start + BATCH_SIZE]).values_list(
+                'which_class', flat=True).distinct():
+            yield class_id
+
+
+def _flush_pending():
+    """
+    Bumps the versions of the classes of the rows collected by invalidate_report, once each
+    """
+    pending = getattr(_pending, 'ids', None)
+    _pending.ids = None
+    if pending is None:
+        return
+    class_ids = pending['class'] | set(_class_ids(Subject, pending['subject'])) | set(
+        _class_ids(Student, pending['student']))
+    _bump_now(['class:%s' % class_id for class_id in class_ids if class_id is not None])
+
+
+def invalidate_report(sender, instance, **kwargs):
+    """
+    Collects the class of a saved or deleted row, to be bumped once the transaction commits.
+    A flush is registered for every row, since the one of a rolled back transaction is dropped,
+    but only the first to run does anything.
+    """
+    if getattr(_pending, 'ids', None) is None:
+        _pending.ids = {'class': set(), 'subject': set(), 'student': set()}
+    if isinstance(instance, (Exam, Student, Subject, Teacher)):
+        _pending.ids['class'].add(instance.which_class_id)
+    elif isinstance(instance, Test):
+        _pending.ids['subject'].add(instance.subject_id)
+    else:
+        _pending.ids['student'].add(instance.student_id)
+    transaction.on_commit(_flush_pending)
+
+
+def invalidate_previous_class(sender, instance, **kwargs):
+    """
+    A student moving to another class changes the report of the class they leave as well
+    """
+    if instance.pk is not None:
+        bump_class_version(*Student.objects.filter(pk=instance.pk).values_list('which_class', flat=True))
+
+
+for model in (Attendance, Exam, Marks, Test, Subject, Student, Teacher):
+    post_save.connect(invalidate_report, sender=model, dispatch_uid='report_cache_save_%s' % model.__name__)
+    post_delete.connect(invalidate_report, sender=model, dispatch_uid='report_cache_delete_%s' % model.__name__)
+pre_save.connect(invalidate_previous_class, sender=Student, dispatch_uid='report_cache_student_move')
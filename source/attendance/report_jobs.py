@@ -0,0 +1,235 @@
+"""
+Reports generated in the background by the report_worker command instead of inside a web request.
+
+The ReportJob table is the queue. The views add pending jobs; the worker claims them by switching them
+to running with an update only one worker can win, and hands them to a pool of local processes. Each
+process renders the report into a file under REPORT_JOB_ROOT and marks the job done or failed. Users poll
+the status of their jobs and download the file once it is done. Only the database and the local disk
+are used, so no message broker is needed. Files of jobs finished more than REPORT_JOB_KEEP_DAYS days ago
+are deleted along with their jobs.
+"""
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from itertools import groupby
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from attendance.analytics import get_class_analytics
+from attendance.export import FORMATS, class_report_rows, school_attendance_rows, stream_csv, stream_xlsx
+from attendance.helper import get_attendance_students, get_subject_marks_report
+from attendance.models import Class, Marks, ReportJob, Student, Subject, Teacher
+
+logger = logging.getLogger('attendance.report_jobs')
+
+REPORT_JOB_ROOT = getattr(settings, 'REPORT_JOB_ROOT', os.path.join(settings.BASE_DIR, 'report_jobs'))
+REPORT_JOB_KEEP_DAYS = getattr(settings, 'REPORT_JOB_KEEP_DAYS', 7)
+
+CONTENT_TYPES = dict(FORMATS, html='text/html; charset=utf-8')
+
+
+########################################################
+#                   Reports                            #
+########################################################
+
+
+def get_class_report(class_id, from_date=None, to_date=None):
+    """
+    Returns the data of the principal's report of the class, with the attendance between the dates
+    """
+    student_list = list(Student.objects.filter(which_class__id=class_id).order_by('roll_no'))
+    subject_list = list(Subject.objects.filter(which_class__id=class_id))
+    return {
+        'subject_list': subject_list,
+        'subject_report_list': get_subject_marks_report(student_list, subject_list),
+        'attendance_list': get_attendance_students(student_list, from_date, to_date),
+        'teacher': Teacher.objects.get(which_class__id=class_id),
+        'analytics': get_class_analytics(class_id, from_date, to_date),
+    }
+
+
+def get_report_cards(class_id, from_date=None, to_date=None):
+    """
+    Returns the report card of every student of the class ordered by roll number, as a dictionary
+    * student
+    * attendance : attendance of the student between the dates, see get_attendance_summary
+    * exam_list : list of (exam, marks) like get_exam_marks
+    The marks of the whole class are read in one query.
+    """
+    student_list = list(Student.objects.filter(which_class_id=class_id).order_by('roll_no', 'id'))
+    mark_list = Marks.objects.filter(student__which_class_id=class_id, test__exam__which_class_id=class_id).\
+        select_related('test__exam', 'test__subject').order_by(
+        'student_id', 'test__exam__date', 'test__exam_id', 'test__subject__name', 'test__subject_id')
+    exams = dict((student_id, [(exam, list(marks)) for exam, marks in groupby(student_marks,
+                                                                              key=lambda mark: mark.test.exam)])
+                 for student_id, student_marks in groupby(mark_list.iterator(), key=lambda mark: mark.student_id))
+    attendance = dict((summary['student'].id, summary)
+                      for summary in get_attendance_students(student_list, from_date, to_date))
+    return [{'student': student, 'attendance': attendance[student.id], 'exam_list': exams.get(student.id, [])}
+            for student in student_list]
+
+
+def _dates(params):
+    return parse_date(params.get('from') or ''), parse_date(params.get('to') or '')
+
+
+def _rows_file(rows, name, file_format):
+    if file_format == 'xlsx':
+        return '%s.xlsx' % name, stream_xlsx(rows, name)
+    return '%s.csv' % name, (line.encode('utf-8') for line in stream_csv(rows))
+
+
+def _html_file(template, context, name):
+    return '%s.html' % name, [render_to_string(template, context).encode('utf-8')]
+
+
+def build_class_report(params):
+    class_obj = Class.objects.get(pk=params['class_id'])
+    context = get_class_report(class_obj.id, *_dates(params))
+    context.update({'class': class_obj, 'range_label': params.get('range_label', '')})
+    return _html_file('attendance/principal_view_report.html', context, 'report_%s' % class_obj)
+
+
+def build_class_export(params):
+    class_obj = Class.objects.get(pk=params['class_id'])
+    return _rows_file(class_report_rows(class_obj.id), 'report_%s' % class_obj, params.get('format'))
+
+
+def build_school_attendance(params):
+    return _rows_file(school_attendance_rows(*_dates(params)), 'attendance', params.get('format'))
+
+
+def build_report_cards(params):
+    class_obj = Class.objects.get(pk=params['class_id'])
+    context = {
+        'class': class_obj,
+        'range_label': params.get('range_label', ''),
+        'card_list': get_report_cards(class_obj.id, *_dates(params)),
+    }
+    return _html_file('attendance/report_cards.html', context, 'report_cards_%s' % class_obj)
+
+
+# kind of job: (description, groups allowed to ask for it, whether it is about one class, builder).
+# A builder returns the name the file is downloaded as and an iterable of the bytes of the file.
+JOB_KINDS = OrderedDict((
+    ('class_report', ('Class report', ('Principal',), True, build_class_report)),
+    ('class_export', ('Class marks and attendance, CSV or Excel', ('Teacher', 'Principal'), True,
+                      build_class_export)),
+    ('report_cards', ('Report cards of the class', ('Teacher', 'Principal'), True, build_report_cards)),
+    ('school_attendance', ('Attendance of the whole school, CSV or Excel', ('Principal',), False,
+                           build_school_attendance)),
+))
+
+
+def get_job_kinds(roles):
+    """
+    Returns [(kind, description, whether it is about one class)] of the jobs users with roles can ask for
+    """
+    return [(kind, description, per_class) for kind, (description, groups, per_class, build) in JOB_KINDS.items()
+            if any(group in roles for group in groups)]
+
+
+########################################################
+#                   Queue                              #
+########################################################
+
+
+def submit_job(user, kind, params):
+    """
+    Queues a report of kind for user, params being a dictionary that can be serialized as JSON
+    """
+    return ReportJob.objects.create(user=user, kind=kind, params=json.dumps(params))
+
+
+def get_artifact_path(job):
+    return os.path.join(REPORT_JOB_ROOT, job.artifact)
+
+
+def reset_interrupted_jobs(timeout):
+    """
+    Puts back the jobs a worker was running when it stopped, so that they are run again.
+    Jobs started less than timeout seconds ago are left to the worker that may still be running them.
+    """
+    stale = Q(started__isnull=True) | Q(started__lt=timezone.now() - datetime.timedelta(seconds=timeout))
+    return ReportJob.objects.filter(stale, status=ReportJob.RUNNING).update(status=ReportJob.PENDING, started=None)
+
+
+def claim_jobs(limit):
+    """
+    Marks up to limit of the oldest pending jobs as running and returns their ids.
+    A job another worker claimed in the meantime is skipped.
+    """
+    if limit <= 0:
+        return []
+    job_ids = list(ReportJob.objects.filter(status=ReportJob.PENDING).order_by('id').values_list(
+        'id', flat=True)[:limit])
+    now = timezone.now()
+    return [job_id for job_id in job_ids
+            if ReportJob.objects.filter(pk=job_id, status=ReportJob.PENDING).update(status=ReportJob.RUNNING,
+                                                                                     started=now)]
+
+
+def finish_job(job_id, status, error='', artifact='', filename=''):
+    ReportJob.objects.filter(pk=job_id).update(status=status, error=error, artifact=artifact, filename=filename,
+                                               finished=timezone.now())
+
+
+def run_job(job_id):
+    """
+    Generates the file of a claimed job and marks it done, or failed with the error.
+    Runs in the processes of the worker pool. Returns the status of the job.
+    """
+    close_old_connections()
+    try:
+        job = ReportJob.objects.get(pk=job_id)
+        filename, content = JOB_KINDS[job.kind][3](json.loads(job.params))
+        filename = re.sub(r'[^\w.-]+', '_', filename)
+        artifact = '%d%s' % (job.id, os.path.splitext(filename)[1])
+        if not os.path.isdir(REPORT_JOB_ROOT):
+            os.makedirs(REPORT_JOB_ROOT)
+        # written under another name first, so that a download never sees half a file
+        path = os.path.join(REPORT_JOB_ROOT, artifact)
+        with open(path + '.part', 'wb') as artifact_file:
+            for chunk in content:
+                artifact_file.write(chunk)
+        os.rename(path + '.part', path)
+        finish_job(job_id, ReportJob.DONE, artifact=artifact, filename=filename)
+        return ReportJob.DONE
+    except Exception as error:
+        logger.exception('Report job %d failed', job_id)
+        finish_job(job_id, ReportJob.FAILED, error='%s: %s' % (type(error).__name__, error))
+        return ReportJob.FAILED
+    finally:
+        close_old_connections()
+
+
+def start_pool(processes):
+    """
+    Returns a pool of processes for run_job. They are started afresh rather than forked, so that none of them
+    shares the database connection of the worker, and set up Django before taking jobs.
+    """
+    connections.close_all()
+    return multiprocessing.get_context('spawn').Pool(processes, initializer=django.setup)
+
+
+def delete_expired_jobs(days=REPORT_JOB_KEEP_DAYS):
+    """
+    Deletes the jobs finished more than days ago and their files, returning how many there were
+    """
+    expired = ReportJob.objects.filter(finished__lt=timezone.now() - datetime.timedelta(days=days))
+    for artifact in expired.exclude(artifact='').values_list('artifact', flat=True):
+        try:
+            os.remove(os.path.join(REPORT_JOB_ROOT, artifact))
+        except OSError:
+            pass
+    return expired.delete()[0]
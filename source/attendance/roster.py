@@ -0,0 +1,168 @@
+"""
+Bulk import of the students of a class from a CSV roster.
+
+The roster has a header row naming the columns roll, full_name, username, password and phone, in any
+order, as on the add student form. Every row is validated before anything is written, against the rest
+of the file and the database, and the rows are then created with a handful of bulk queries. Hashing the
+passwords is what takes most of the time, so the import_roster command spreads it over a pool of processes.
+The web view hashes them in its own process: starting processes from a threaded server process holding
+database connections is not safe, and a single upload should not take every CPU of the server.
+"""
+import csv
+import io
+import multiprocessing
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+
+from attendance.models import Student, Marks, Test
+from attendance.report_cache import bump_class_version
+
+COLUMNS = ('roll', 'full_name', 'username', 'password', 'phone')
+
+# the limits of the add student form
+MAX_LENGTH = 50
+MIN_PHONE = 1000000000
+MAX_PHONE = 9999999999
+
+# rows hashed by one process at a time, and the fewest rows worth starting processes for
+HASH_CHUNK_SIZE = 20
+MIN_PARALLEL_ROWS = 50
+
+# values per query when looking up or inserting rows, below the limit of SQLite
+BATCH_SIZE = 500
+
+
+class RosterError(Exception):
+    """
+    Raised with the list of (line number, message) of every problem found in a roster
+    """
+
+    def __init__(self, errors):
+        super(RosterError, self).__init__('; '.join('line %d: %s' % error for error in errors))
+        self.errors = errors
+
+
+def _read_rows(roster_file):
+    if isinstance(roster_file, bytes):
+        roster_file = roster_file.decode('utf-8-sig')
+    if isinstance(roster_file, str):
+        roster_file = io.StringIO(roster_file)
+    reader = csv.reader(roster_file)
+    header = [column.strip().lower() for column in next(reader, [])]
+    missing = [column for column in COLUMNS if column not in header]
+    if missing:
+        raise RosterError([(1, 'missing column ' + ', '.join(missing))])
+    for line, values in enumerate(reader, 2):
+        if any(value.strip() for value in values):
+            yield line, dict((column, value.strip()) for column, value in zip(header, values))
+
+
+def _batches(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def parse_roster(roster_file, class_id):
+    """
+    Reads and validates a roster for the class from a file, text or bytes.
+    Returns a list of row dictionaries keyed by COLUMNS with roll and phone as integers,
+    or raises RosterError listing everything wrong with the roster.
+    """
+    rows = []
+    errors = []
+    lines_by_roll = {}
+    lines_by_username = {}
+    for line, row in _read_rows(roster_file):
+        row_errors = []
+        for column in COLUMNS:
+            if not row.get(column):
+                row_errors.append('%s is missing' % column)
+            elif len(row[column]) > MAX_LENGTH:
+                row_errors.append('%s is longer than %d characters' % (column, MAX_LENGTH))
+        try:
+            row['roll'] = int(row.get('roll'))
+            if row['roll'] in lines_by_roll:
+                row_errors.append('roll number %d repeats line %d' % (row['roll'], lines_by_roll[row['roll']]))
+            lines_by_roll.setdefault(row['roll'], line)
+        except (TypeError, ValueError):
+            if row.get('roll'):
+                row_errors.append('roll number %s is not a number' % row['roll'])
+        try:
+            row['phone'] = int(row.get('phone'))
+            if not MIN_PHONE <= row['phone'] <= MAX_PHONE:
+                row_errors.append('phone number %d does not have 10 digits' % row['phone'])
+        except (TypeError, ValueError):
+            if row.get('phone'):
+                row_errors.append('phone number %s is not a number' % row['phone'])
+        username = row.get('username')
+        if username:
+            if username in lines_by_username:
+                row_errors.append('username %s repeats line %d' % (username, lines_by_username[username]))
+            lines_by_username.setdefault(username, line)
+        errors.extend((line, error) for error in row_errors)
+        rows.append((line, row))
+
+    for batch in _batches(lines_by_roll):
+        for roll in Student.objects.filter(which_class_id=class_id, roll_no__in=batch).values_list('roll_no',
+                                                                                                   flat=True):
+            errors.append((lines_by_roll[roll], 'roll number %d is taken in the class' % roll))
+    for batch in _batches(lines_by_username):
+        for username in User.objects.filter(username__in=batch).values_list('username', flat=True):
+            errors.append((lines_by_username[username], 'username %s exists already' % username))
+    if not rows and not errors:
+        errors.append((1, 'the roster has no students'))
+    if errors:
+        raise RosterError(sorted(errors))
+    return [row for line, row in rows]
+
+
+def hash_passwords(passwords, processes=1):
+    """
+    Returns the hashes of passwords, computed by a pool of processes when given more than one and there are
+    enough passwords
+    """
+    if processes <= 1 or len(passwords) < MIN_PARALLEL_ROWS:
+        return [make_password(password) for password in passwords]
+    # started afresh rather than forked, so that they share no database connection with this process
+    pool = multiprocessing.get_context('spawn').Pool(processes, initializer=django.setup)
+    try:
+        return pool.map(make_password, passwords, HASH_CHUNK_SIZE)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def import_roster(rows, class_id, processes=1):
+    """
+    Creates the users and students of the rows returned by parse_roster in the class,
+    with marks of 0 in the tests the class already had like the add student form.
+    The passwords are hashed by processes processes, see hash_passwords. Returns the number of students created.
+    """
+    passwords = hash_passwords([row['password'] for row in rows], processes)
+    group = Group.objects.get(name='Student')
+    with transaction.atomic():
+        User.objects.bulk_create([User(username=row['username'], password=password)
+                                  for row, password in zip(rows, passwords)], batch_size=BATCH_SIZE)
+        user_ids = {}
+        for batch in _batches(row['username'] for row in rows):
+            user_ids.update(User.objects.filter(username__in=batch).values_list('username', 'id'))
+        User.groups.through.objects.bulk_create([User.groups.through(user_id=user_ids[row['username']],
+                                                                     group_id=group.id)
+                                                 for row in rows], batch_size=BATCH_SIZE)
+        Student.objects.bulk_create([Student(user_id=user_ids[row['username']], which_class_id=class_id,
+                                             roll_no=row['roll'], name=row['full_name'], phone=row['phone'])
+                                     for row in rows], batch_size=BATCH_SIZE)
+        test_ids = list(Test.objects.filter(subject__which_class_id=class_id).values_list('id', flat=True))
+        if test_ids:
+            student_ids = []
+            for batch in _batches(user_ids.values()):
+                student_ids.extend(Student.objects.filter(user_id__in=batch).values_list('id', flat=True))
+            Marks.objects.bulk_create([Marks(test_id=test_id, student_id=student_id, marks=0, placeholder=True)
+                                       for student_id in student_ids for test_id in test_ids],
+                                      batch_size=BATCH_SIZE)
+    bump_class_version(class_id)
+    return len(rows)
@@ -1,27 +1,212 @@
+"""
+Sends an SMS to the parents of every student absent on a day.
+
+Absences are queued in SmsOutbox when attendance is saved and sent by the sms_outbox_worker command,
+while send_sms sends the absences of a day directly. Absentees are read with one query and the messages
+are sent through a pooled HTTP session by a bounded number of threads, retrying failed requests with
+exponential backoff and never exceeding the rate limit of the gateway. The gateway is configured in settings,
+and can be pointed at the local stub started with `python manage.py sms_stub_gateway` to try it without
+sending real messages.
+"""
+import datetime
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
+from requests.adapters import HTTPAdapter
 
-from attendance.models import Attendance
+from attendance.helper import get_today
+from attendance.models import Attendance, SmsOutbox
 
-data = {
+BASE_URL = getattr(settings, 'SMS_GATEWAY_URL', "http://sms.lyvee.com/sendsms")
+
+# parameters sent with every message, 'to' and 'msg' are added per message
+GATEWAY_PARAMS = getattr(settings, 'SMS_GATEWAY_PARAMS', {
     'uname': 'rubais',
     'pwd': 'smsapi123',
     'senderid': 'ThreeG',
-    'to': '',
-    'msg': '',
     'route': 'T',
-}
+})
+
+# simultaneous requests to the gateway
+CONCURRENCY = getattr(settings, 'SMS_GATEWAY_CONCURRENCY', 4)
+
+# messages per second the gateway accepts
+RATE_LIMIT = getattr(settings, 'SMS_GATEWAY_RATE_LIMIT', 10)
+
+# attempts per message, and seconds to wait before the first retry, doubled on every further one
+RETRIES = getattr(settings, 'SMS_GATEWAY_RETRIES', 3)
+BACKOFF = getattr(settings, 'SMS_GATEWAY_BACKOFF', 0.5)
+
+TIMEOUT = getattr(settings, 'SMS_GATEWAY_TIMEOUT', 10)
+
+# seconds after which absences a worker took but did not report back are taken to be left by a stopped worker
+OUTBOX_CLAIM_TIMEOUT = getattr(settings, 'SMS_OUTBOX_CLAIM_TIMEOUT', 600)
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to wait() from any number of threads so that at most rate of them return per second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SmsDispatcher(object):
+    """
+    Sends messages through an SMS gateway taking its parameters as a GET query
+    """
+
+    def __init__(self, base_url=BASE_URL, params=None, concurrency=CONCURRENCY, rate_limit=RATE_LIMIT,
+                 retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        self.base_url = base_url
+        self.params = dict(GATEWAY_PARAMS if params is None else params)
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send(self, phone, message):
+        """
+        Sends one message, returns whether the gateway accepted it
+        """
+        params = dict(self.params, to=str(phone), msg=message)
+        for attempt in range(self.retries):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.rate_limiter.wait()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except requests.RequestException:
+                continue
+            if response.status_code < 400:
+                return True
+            if response.status_code != 429 and response.status_code < 500:
+                # the gateway rejected the message itself, sending it again will not help
+                return False
+        return False
+
+    def send_all(self, messages):
+        """
+        Sends a list of (phone, message) concurrently, returns whether each was accepted, in the same order
+        """
+        if not messages:
+            return []
+        pool = ThreadPool(min(self.concurrency, len(messages)))
+        try:
+            return pool.map(lambda item: self.send(*item), messages)
+        finally:
+            pool.close()
+            pool.join()
+
+    def close(self):
+        self.session.close()
+
+
+def get_absence_messages(date):
+    """
+    Returns (phone, message) for every student absent on date
+    """
+    absentees = Attendance.objects.filter(date=date, is_present=False).select_related('student__user')
+    return [(attendance.student.phone,
+             'Your ward ' + attendance.student.user.username + ' Was absent on ' + str(date))
+            for attendance in absentees]
+
+
+def send_sms(date=None, dispatcher=None):
+    """
+    Informs the parents of the students absent on date, today by default.
+    Returns the number of messages sent and the number that failed.
+    """
+    if date is None:
+        date = get_today()
+    messages = get_absence_messages(date)
+    if dispatcher is not None:
+        results = dispatcher.send_all(messages)
+    else:
+        dispatcher = SmsDispatcher()
+        try:
+            results = dispatcher.send_all(messages)
+        finally:
+            dispatcher.close()
+    sent = sum(1 for result in results if result)
+    return sent, len(results) - sent
+
+
+########################################################
+#                   Outbox                             #
+########################################################
+
+
+def get_outbox_message(absences):
+    """
+    Returns one message reporting a list of (student username, date) absences to the same parent
+    """
+    if len(absences) == 1:
+        return 'Your ward ' + absences[0][0] + ' Was absent on ' + str(absences[0][1])
+    return 'Absences of your wards: ' + ', '.join(username + ' on ' + str(date) for username, date in absences)
 
-BASE_URL = "http://sms.lyvee.com/sendsms"
 
-today_date = timezone.now()
+def reset_interrupted_outbox(timeout=OUTBOX_CLAIM_TIMEOUT):
+    """
+    Puts back the messages a worker was sending when it stopped, so that they are sent again.
+    Messages taken less than timeout seconds ago are left to the worker that may still be sending them.
+    """
+    stale = Q(claimed__isnull=True) | Q(claimed__lt=timezone.now() - datetime.timedelta(seconds=timeout))
+    return SmsOutbox.objects.filter(stale, status=SmsOutbox.SENDING).update(status=SmsOutbox.PENDING, claim='',
+                                                                          claimed=None)
 
 
-def send_sms():
-    for attendance in Attendance.objects.filter(date=today_date.date()):
-        if not attendance.is_present:
-            data['to'] = str(attendance.student.phone)
-            data['msg'] = 'Your ward ' + attendance.student.user.username + ' Was absent on ' + str(
-                timezone.now().date())
-            r = requests.get(BASE_URL, data)
-            print(r.url)
+def send_outbox_batch(dispatcher, batch_size=100):
+    """
+    Sends the oldest pending absences of the outbox, at least batch_size of them unless fewer are pending.
+    All pending absences for the parents in the batch are sent together, one message per phone number.
+    Returns the number of absences sent and failed, (0, 0) once the outbox is empty.
+    """
+    with transaction.atomic():
+        phones = set(SmsOutbox.objects.filter(status=SmsOutbox.PENDING).order_by('id').values_list(
+            'phone', flat=True)[:batch_size])
+        outbox_ids = list(SmsOutbox.objects.filter(status=SmsOutbox.PENDING, phone__in=phones).values_list(
+            'id', flat=True))
+        # absences another worker took in the meantime are not claimed again, and not sent by this one
+        claim = uuid.uuid4().hex
+        SmsOutbox.objects.filter(pk__in=outbox_ids, status=SmsOutbox.PENDING).update(
+            status=SmsOutbox.SENDING, claim=claim, claimed=timezone.now())
+    by_phone = OrderedDict()
+    for outbox in SmsOutbox.objects.filter(claim=claim, status=SmsOutbox.SENDING).select_related(
+            'student__user').order_by('date', 'id'):
+        by_phone.setdefault(outbox.phone, []).append(outbox)
+    results = dispatcher.send_all([(phone, get_outbox_message([(outbox.student.user.username, outbox.date)
+                                                               for outbox in absences]))
+                                   for phone, absences in by_phone.items()])
+    sent_ids = []
+    failed_ids = []
+    for absences, result in zip(by_phone.values(), results):
+        (sent_ids if result else failed_ids).extend(outbox.pk for outbox in absences)
+    SmsOutbox.objects.filter(pk__in=sent_ids).update(status=SmsOutbox.SENT, sent=timezone.now(),
+                                                     attempts=F('attempts') + 1)
+    SmsOutbox.objects.filter(pk__in=failed_ids).update(status=SmsOutbox.FAILED, attempts=F('attempts') + 1)
+    return len(sent_ids), len(failed_ids)
@@ -0,0 +1,250 @@
+"""
+Opt-in SQL profiler, enabled with SQL_PROFILER = True in settings.
+
+SqlProfilerMiddleware records every statement a request runs together with the line of project code and
+the template line that ran it. Statements are reduced to their shape, the SQL with every value replaced by
+a placeholder, and a shape running more than SQL_PROFILER_THRESHOLD times in one request is reported as a
+likely N+1 query: a query inside a loop, usually a foreign key read lazily for every row. Every request is
+logged to the 'attendance.sql_profiler' logger and the most recent profiles are kept in the cache for the
+staff page at /edu/debug/sql/.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+logger = logging.getLogger('attendance.sql_profiler')
+
+ENABLED = getattr(settings, 'SQL_PROFILER', False)
+
+# runs of the same query shape in one request reported as an N+1 query
+THRESHOLD = getattr(settings, 'SQL_PROFILER_THRESHOLD', 5)
+
+# profiles kept for the debug page
+KEEP = getattr(settings, 'SQL_PROFILER_KEEP', 50)
+
+CACHE_KEY = 'attendance:sql_profiler:recent'
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+THIS_FILE = os.path.splitext(os.path.abspath(__file__))[0]
+
+# methods of a database connection making its cursors, replaced while recording
+CURSOR_FACTORIES = ('make_cursor', 'make_debug_cursor')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def get_query_shape(sql):
+    """
+    Returns sql with its literals and parameters replaced by ? and lists of them by (...),
+    so that the same query run for different rows has the same shape
+    """
+    shape = _STRING.sub('?', sql.replace('%s', '?'))
+    shape = _NUMBER.sub('?', shape)
+    shape = _PLACEHOLDER_LIST.sub('(...)', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def _is_project_file(filename):
+    filename = os.path.abspath(filename)
+    return (filename.startswith(SOURCE_DIR) and os.path.splitext(filename)[0] != THIS_FILE
+            and 'site-packages' not in filename)
+
+
+def get_query_origin():
+    """
+    Returns the innermost line of project code and the innermost template line on the current stack,
+    as strings like 'attendance/views.py:120 in teacher_index', either of them None when there is none
+    """
+    code = None
+    template = None
+    frame = sys._getframe(1)
+    while frame is not None and (code is None or template is None):
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = '%s:%s' % (origin.template_name or origin.name, token.lineno)
+        if code is None and _is_project_file(frame.f_code.co_filename):
+            code = '%s:%d in %s' % (os.path.relpath(frame.f_code.co_filename, SOURCE_DIR), frame.f_lineno,
+                                    frame.f_code.co_name)
+        frame = frame.f_back
+    return code, template
+
+
+class ProfilingCursorWrapper(CursorWrapper):
+    """
+    Cursor passing every statement it runs, with its duration and origin, to a recorder
+    """
+
+    def __init__(self, cursor, db, recorder):
+        super(ProfilingCursorWrapper, self).__init__(cursor, db)
+        self.recorder = recorder
+
+    def _record(self, method, sql, params):
+        start = time.time()
+        try:
+            return method(sql, params)
+        finally:
+            self.recorder.add(sql, time.time() - start, *get_query_origin())
+
+    def execute(self, sql, params=None):
+        return self._record(super(ProfilingCursorWrapper, self).execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._record(super(ProfilingCursorWrapper, self).executemany, sql, param_list)
+
+
+class CursorHook(object):
+    """
+    Context manager wrapping every cursor made on the database connections of the current thread
+    while it is active with wrap(cursor, connection), such as a CursorWrapper class. Hooks can be nested.
+    """
+
+    def __init__(self, wrap):
+        self.wrap = wrap
+        self.connections = []
+
+    def _factory(self, connection, make_cursor):
+        return lambda cursor: self.wrap(make_cursor(cursor), connection)
+
+    def __enter__(self):
+        self.connections = [(connection, dict((name, connection.__dict__[name]) for name in CURSOR_FACTORIES
+                                              if name in connection.__dict__))
+                            for connection in connections.all()]
+        for connection, saved in self.connections:
+            # wraps the cursors Django makes, so that connection.queries is still logged under DEBUG
+            for name in CURSOR_FACTORIES:
+                setattr(connection, name, self._factory(connection, getattr(connection, name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        for connection, saved in self.connections:
+            for name in CURSOR_FACTORIES:
+                if name in saved:
+                    setattr(connection, name, saved[name])
+                else:
+                    delattr(connection, name)
+
+
+class QueryRecorder(CursorHook):
+    """
+    Collects the statements run on every database connection of the current thread while it is active
+    """
+
+    def __init__(self):
+        super(QueryRecorder, self).__init__(lambda cursor, connection: ProfilingCursorWrapper(cursor, connection,
+                                                                                             self))
+        self.queries = []
+
+    def add(self, sql, duration, code, template):
+        self.queries.append((sql, duration, code, template))
+
+    def get_shapes(self):
+        """
+        Returns a list of dictionaries describing every query shape, the most frequent first
+        * shape, example : the shape and the first statement having it
+        * count, seconds : runs of the shape and their total duration
+        * origins : list of ((code, template), runs) of the places running the shape
+        """
+        shapes = OrderedDict()
+        for sql, duration, code, template in self.queries:
+            shape = get_query_shape(sql)
+            if shape not in shapes:
+                shapes[shape] = {'shape': shape, 'example': sql, 'count': 0, 'seconds': 0.0,
+                                 'origins': OrderedDict()}
+            entry = shapes[shape]
+            entry['count'] += 1
+            entry['seconds'] += duration
+            entry['origins'][(code, template)] = entry['origins'].get((code, template), 0) + 1
+        result = sorted(shapes.values(), key=lambda entry: -entry['count'])
+        for entry in result:
+            entry['origins'] = list(entry['origins'].items())
+        return result
+
+
+def get_recent_profiles():
+    """
+    Returns the profiles of the most recent requests, newest first
+    """
+    return cache.get(CACHE_KEY, [])
+
+
+def sql_profiler_exempt(view_func):
+    """
+    Marks a view whose requests are not kept among the recent profiles, such as the page showing them
+    """
+    view_func.sql_profiler_exempt = True
+    return view_func
+
+
+def _store_profile(profile):
+    profiles = get_recent_profiles()
+    profiles.insert(0, profile)
+    cache.set(CACHE_KEY, profiles[:KEEP], None)
+
+
+def _log_profile(profile):
+    logger.info('%s %s %s: %d queries in %.1f ms, %d N+1', profile['method'], profile['path'], profile['view'],
+                profile['queries'], profile['seconds'] * 1000, len(profile['repeated']))
+    for entry in profile['repeated']:
+        origins = '; '.join('%s [%s] x%d' % (code, template or 'no template', runs)
+                            for (code, template), runs in entry['origins'])
+        logger.warning('N+1 in %s %s: %d x %s (from %s)', profile['method'], profile['path'], entry['count'],
+                       entry['shape'], origins)
+
+
+class SqlProfilerMiddleware(object):
+    """
+    Profiles the SQL of every request, see the module documentation. Removed from the middleware
+    unless SQL_PROFILER is set in settings.
+    """
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._sql_profiler_view = None
+        request._sql_profiler_exempt = False
+        start = time.time()
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+            # a template response is rendered after the middleware, render it while still recording
+            if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+                response.render()
+        if getattr(request, '_sql_profiler_exempt', False):
+            return response
+        shapes = recorder.get_shapes()
+        profile = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': request.method,
+            'path': request.path,
+            'view': request._sql_profiler_view,
+            'status': response.status_code,
+            'seconds': time.time() - start,
+            'queries': len(recorder.queries),
+            'sql_seconds': sum(entry['seconds'] for entry in shapes),
+            'shapes': shapes,
+            'repeated': [entry for entry in shapes if entry['count'] > THRESHOLD],
+        }
+        _log_profile(profile)
+        _store_profile(profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._sql_profiler_exempt = getattr(view_func, 'sql_profiler_exempt', False)
+        request._sql_profiler_view = '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', view_func))
@@ -1,3 +1,825 @@
-from django.test import TestCase
+import datetime
+from collections import defaultdict
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from attendance import metrics, sql_profiler
+from attendance.analytics import get_class_analytics, numpy
+from attendance.dashboard import build_dashboard, get_dashboard
+from attendance.helper import add_test, edit_test, get_attendance_students, get_report_range, get_term, get_today, \
+    save_attendance, update_marks
+from attendance.models import Attendance, AttendanceBitmap, AttendanceRollup, Class, Exam, Marks, Principal, \
+    SmsOutbox, Student, StudentDashboard, Subject, Teacher, Test
+from attendance.report_cache import get_class_version, get_report
+from attendance.report_jobs import get_report_cards
+from attendance.roster import RosterError, import_roster, parse_roster
+from attendance.sms_sender import reset_interrupted_outbox, send_outbox_batch
+
+
+class PrincipalOverviewTest(TestCase):
+    """
+    The school overview on the principal's page is read with the same queries whatever the size of the school
+    """
+
+    def setUp(self):
+        for name in ('Teacher', 'Student', 'Principal', 'Admin'):
+            Group.objects.create(name=name)
+        principal = Principal()
+        principal.set_user(User.objects.create_user('principal', password='principal'))
+        principal.save()
+        self.client.force_login(principal.user)
+
+    def add_class(self, grade):
+        class_obj = Class.objects.create(grade=grade, division='A')
+        teacher = Teacher(which_class=class_obj, name='Teacher %d' % grade)
+        teacher.set_user(User.objects.create_user('teacher_%d' % grade))
+        teacher.save()
+        student_list = []
+        for roll in range(1, 4):
+            student = Student(which_class=class_obj, roll_no=roll, name='Student %d' % roll, phone=9876543210)
+            student.set_user(User.objects.create_user('student_%d_%d' % (grade, roll)))
+            student.save()
+            student_list.append(student)
+        subject_list = [Subject.objects.create(which_class=class_obj, name='Subject %d' % number)
+                        for number in (1, 2)]
+        marks = dict(((subject.id, student.id), 10 * student.roll_no) for subject in subject_list
+                     for student in student_list)
+        add_test(class_obj.id, 'Exam', datetime.date(2016, 1, 1), 100, subject_list, student_list, marks)
+        save_attendance(student_list, get_today(), [student_list[0].id])
+        return class_obj
+
+    def get_overview(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('principal_index'))
+        self.assertEqual(response.status_code, 200)
+        return response.context['overview'], len(queries)
+
+    def test_overview(self):
+        self.add_class(1)
+        overview, queries = self.get_overview()
+        self.assertEqual(len(overview), 1)
+        self.assertEqual(overview[0]['teachers'], ['Teacher 1'])
+        self.assertEqual(overview[0]['students'], 3)
+        self.assertEqual((overview[0]['today']['present'], overview[0]['today']['total']), (1, 3))
+        self.assertEqual(overview[0]['attendance']['percentage_present'], '33.33')
+        self.assertEqual(overview[0]['subjects'], [('Subject 1', 20.0), ('Subject 2', 20.0)])
+        term = self.client.get(reverse('principal_index')).context['term']
+        self.assertEqual((term['days'], term['present'], term['total']), (1, 1, 3))
+
+    def test_query_count_does_not_grow_with_classes(self):
+        self.add_class(1)
+        # the first request resolves and stores the user context of the principal
+        self.get_overview()
+        overview, queries = self.get_overview()
+        for grade in range(2, 7):
+            self.add_class(grade)
+        overview, more_queries = self.get_overview()
+        self.assertEqual(len(overview), 6)
+        self.assertEqual(more_queries, queries)
+
+
+def create_groups():
+    for name in ('Teacher', 'Student', 'Principal', 'Admin'):
+        Group.objects.get_or_create(name=name)
+
+
+def create_student(class_obj, roll_no, username=None):
+    student = Student(which_class=class_obj, roll_no=roll_no, name='Student %d' % roll_no, phone=9876543210)
+    student.set_user(User.objects.create_user(username or 'student_%s_%d' % (class_obj.id, roll_no),
+                                              password='student'))
+    student.save()
+    return student
+
+
+def create_teacher(class_obj, username='teacher'):
+    teacher = Teacher(which_class=class_obj, name='Teacher')
+    teacher.set_user(User.objects.create_user(username, password='teacher'))
+    teacher.save()
+    return teacher
+
+
+class AttendanceOrderTest(TestCase):
+    """
+    Attendance reports keep the order of the students they are given, whatever the order of their ids
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.teacher = create_teacher(self.class_obj)
+        # roll numbers in the reverse order of the ids
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (3, 2, 1)][::-1]
+        for day, present in ((1, 3), (2, 2), (3, 1)):
+            save_attendance(self.student_list, datetime.date(2016, 6, day),
+                            [student.id for student in self.student_list[:present]])
+        self.subject = Subject.objects.create(which_class=self.class_obj, name='Subject')
+        add_test(self.class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, [self.subject], self.student_list,
+                 dict(((self.subject.id, student.id), student.roll_no) for student in self.student_list))
+
+    def test_student_list(self):
+        for dates in ((None, None), (datetime.date(2016, 6, 1), datetime.date(2016, 6, 3))):
+            attendance_list = get_attendance_students(self.student_list, *dates)
+            self.assertEqual([attendance['student'] for attendance in attendance_list], self.student_list)
+            self.assertEqual([attendance['present'] for attendance in attendance_list], [3, 2, 1])
+
+    def test_class_report(self):
+        self.client.force_login(self.teacher.user)
+        response = self.client.post(reverse('teacher_report_class'), {'subject': self.subject.id})
+        self.assertEqual(response.status_code, 200)
+        for attendance, marks in response.context['data_list']:
+            self.assertEqual(attendance['present'], 4 - attendance['student'].roll_no)
+            self.assertEqual([mark.marks for mark in marks], [attendance['student'].roll_no])
+
+    def test_report_cards(self):
+        card_list = get_report_cards(self.class_obj.id)
+        self.assertEqual([card['student'] for card in card_list], self.student_list)
+        for card in card_list:
+            self.assertEqual(card['attendance']['present'], 4 - card['student'].roll_no)
+
+
+class ReportRangeTest(TestCase):
+    """
+    Only the ranges offered on the report forms are accepted
+    """
+
+    def test_ranges(self):
+        today = datetime.date(2016, 6, 30)
+        self.assertEqual(get_report_range({'range': '30'}, today)[:2], (datetime.date(2016, 6, 1), today))
+        for choice in ('5', '1000000', 'week'):
+            with self.assertRaises(ValueError):
+                get_report_range({'range': choice}, today)
+
+    def test_api(self):
+        create_groups()
+        principal = Principal()
+        principal.set_user(User.objects.create_user('principal'))
+        principal.save()
+        self.client.force_login(principal.user)
+        response = self.client.get(reverse('api_attendance'), {'range': '1000000'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AttendanceSubmitTest(TestCase):
+    """
+    Submitting the attendance of a day again updates it instead of adding to it
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (1, 2, 3)]
+        self.client.force_login(create_teacher(self.class_obj).user)
+
+    def submit(self, present):
+        response = self.client.post(reverse('teacher_attendance_today'),
+                                    dict(('student_%d' % student.id, 'on') for student in present))
+        self.assertEqual(response.status_code, 302)
+
+    def assert_attendance(self, present):
+        today = get_today()
+        self.assertEqual(Attendance.objects.filter(date=today).count(), len(self.student_list))
+        self.assertEqual(set(Attendance.objects.filter(date=today, is_present=True).values_list(
+            'student_id', flat=True)), set(student.id for student in present))
+        for student in self.student_list:
+            rollup = AttendanceRollup.objects.get(student=student, month=today.replace(day=1))
+            self.assertEqual((rollup.present, rollup.absent), (1, 0) if student in present else (0, 1))
+            bitmap = AttendanceBitmap.objects.get(student=student, term_start=get_term(today)[0])
+            self.assertEqual(AttendanceBitmap.get_bits(bitmap.present) != 0, student in present)
+        self.assertEqual(set(SmsOutbox.objects.values_list('student_id', flat=True)),
+                         set(student.id for student in self.student_list if student not in present))
+
+    def test_same_attendance(self):
+        for _ in range(2):
+            self.submit(self.student_list[:2])
+        self.assert_attendance(self.student_list[:2])
+
+    def test_changed_attendance(self):
+        self.submit(self.student_list[:2])
+        self.submit(self.student_list[1:])
+        self.assert_attendance(self.student_list[1:])
+
+
+class MarksEditTest(TestCase):
+    """
+    Editing the marks of an exam writes all of them or, when any is invalid, none
+    """
+
+    def setUp(self):
+        create_groups()
+        class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(class_obj, roll_no) for roll_no in (1, 2, 3)]
+        subject_list = [Subject.objects.create(which_class=class_obj, name='Subject %d' % number) for number in (1, 2)]
+        add_test(class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, subject_list, self.student_list,
+                 dict(((subject.id, student.id), 10 * student.roll_no) for subject in subject_list
+                      for student in self.student_list))
+        self.exam = Exam.objects.get(which_class=class_obj)
+        self.client.force_login(create_teacher(class_obj).user)
+
+    def edit(self, total_mark, marks):
+        data = {'test': self.exam.id, 'total_mark': total_mark}
+        data.update((str(pk), value) for pk, value in marks.items())
+        return self.client.post(reverse('teacher_test_select'), data)
+
+    def get_marks(self):
+        return dict(Marks.objects.values_list('id', 'marks'))
+
+    def test_edit(self):
+        marks = dict((pk, value + 5) for pk, value in self.get_marks().items())
+        response = self.edit(50, marks)
+        self.assertEqual(response['Location'], reverse('teacher_test_select') + '?status=success')
+        self.assertEqual(self.get_marks(), marks)
+        self.assertEqual(set(Test.objects.values_list('total_marks', flat=True)), {50})
+
+    def test_invalid_edit(self):
+        old_marks = self.get_marks()
+        for total_mark, last in ((50, '51'), (100, 'abc'), (100, '-1')):
+            marks = dict((pk, 0) for pk in old_marks)
+            marks[max(marks)] = last
+            response = self.edit(total_mark, marks)
+            self.assertEqual(response['Location'], reverse('teacher_test_select') + '?status=formerror')
+            self.assertEqual(self.get_marks(), old_marks)
+            self.assertEqual(set(Test.objects.values_list('total_marks', flat=True)), {100})
+
+
+class ApiTest(TestCase):
+    """
+    The API pages through every row once and shows users only what the pages would
+    """
+
+    def setUp(self):
+        create_groups()
+        self.student_list = []
+        for grade in (1, 2):
+            class_obj = Class.objects.create(grade=grade, division='A')
+            self.student_list += [create_student(class_obj, roll_no) for roll_no in (1, 2, 3)]
+            subject = Subject.objects.create(which_class=class_obj, name='Subject')
+            add_test(class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, [subject], self.student_list[-3:],
+                     dict(((subject.id, student.id), student.roll_no) for student in self.student_list[-3:]))
+        principal = Principal()
+        principal.set_user(User.objects.create_user('principal'))
+        principal.save()
+        self.principal = principal.user
+
+    def get_all(self, url):
+        """
+        Returns the results of every page, following the next links
+        """
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            results += response.json()['results']
+            url = response.json()['next']
+        return results
+
+    def test_pagination(self):
+        self.client.force_login(self.principal)
+        for limit in (1, 2, 4, 100):
+            ids = [row['id'] for row in self.get_all(reverse('api_students') + '?limit=%d&fields=id' % limit)]
+            self.assertEqual(ids, sorted(student.id for student in self.student_list))
+        self.assertEqual(len(self.get_all(reverse('api_marks') + '?limit=4')), len(self.student_list))
+
+    def test_limit(self):
+        self.client.force_login(self.principal)
+        for limit in ('0', '-1', '1001', 'abc'):
+            response = self.client.get(reverse('api_students'), {'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+    def test_student_scope(self):
+        student = self.student_list[4]
+        self.client.force_login(student.user)
+        self.assertEqual([row['id'] for row in self.get_all(reverse('api_students'))], [student.id])
+        # the class parameter only narrows what a principal reads
+        self.assertEqual([row['id'] for row in self.get_all(reverse('api_students') + '?class=%d' %
+                                                            self.student_list[0].which_class_id)], [student.id])
+        self.assertEqual(set(row['student_id'] for row in self.get_all(reverse('api_marks'))), {student.id})
+
+
+class StudentEditTest(TestCase):
+    """
+    The student edit form saves what changed: roll numbers, classes and passwords
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.other_class = Class.objects.create(grade=2, division='A')
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (1, 2, 3)]
+        other_student = create_student(self.other_class, 1)
+        subject = Subject.objects.create(which_class=self.other_class, name='Subject')
+        add_test(self.other_class.id, 'Exam', datetime.date(2016, 6, 1), 100, [subject], [other_student],
+                 {(subject.id, other_student.id): 50})
+        self.client.force_login(create_teacher(self.class_obj).user)
+
+    def test_edit(self):
+        first, second, third = self.student_list
+        data = {}
+        for student, roll_no, class_obj, password in ((first, 2, self.class_obj, 'changed'),
+                                                      (second, 1, self.class_obj, ''),
+                                                      (third, 3, self.other_class, '')):
+            string = 'student_%d_' % student.id
+            data.update({string + 'roll': roll_no, string + 'phone': student.phone, string + 'class': class_obj.id,
+                         string + 'full_name': student.name, string + 'new_password': password})
+        response = self.client.post(reverse('teacher_student_edit'), data)
+        self.assertEqual(response['Location'], reverse('teacher_student_edit') + '?status=success')
+        self.assertEqual(dict(Student.objects.filter(pk__in=[first.pk, second.pk, third.pk]).values_list(
+            'pk', 'roll_no')), {first.pk: 2, second.pk: 1, third.pk: 3})
+        self.assertEqual(Student.objects.get(pk=third.pk).which_class, self.other_class)
+        self.assertEqual(list(Marks.objects.filter(student=third).values_list('test__subject__which_class', 'marks')),
+                         [(self.other_class.id, 0)])
+        self.assertTrue(User.objects.get(pk=first.user_id).check_password('changed'))
+        for student in (second, third):
+            self.assertTrue(User.objects.get(pk=student.user_id).check_password('student'))
+
+
+class AttendanceRollupTest(TestCase):
+    """
+    The monthly rollup holds the same counts as the daily attendance rows
+    """
+
+    def setUp(self):
+        create_groups()
+        class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(class_obj, roll_no) for roll_no in (1, 2, 3)]
+
+    def assert_rollup(self):
+        counts = defaultdict(lambda: [0, 0])
+        for student_id, date, is_present in Attendance.objects.values_list('student', 'date', 'is_present'):
+            counts[(student_id, date.replace(day=1))][0 if is_present else 1] += 1
+        self.assertEqual(dict(((rollup.student_id, rollup.month), [rollup.present, rollup.absent])
+                              for rollup in AttendanceRollup.objects.all()), dict(counts))
+
+    def test_save(self):
+        for day, present in ((datetime.date(2016, 6, 29), 3), (datetime.date(2016, 6, 30), 1),
+                             (datetime.date(2016, 7, 1), 2), (datetime.date(2016, 6, 30), 2)):
+            save_attendance(self.student_list, day, [student.id for student in self.student_list[:present]])
+            self.assert_rollup()
+
+    def test_rebuild(self):
+        save_attendance(self.student_list, datetime.date(2016, 6, 30), [self.student_list[0].id])
+        # rows written outside of save_attendance leave the rollup behind until it is rebuilt
+        Attendance.objects.create(student=self.student_list[0], date=datetime.date(2016, 7, 1))
+        Attendance.objects.filter(student=self.student_list[1]).update(is_present=True)
+        AttendanceRollup.objects.filter(student=self.student_list[2]).delete()
+        call_command('rebuild_attendance_rollup', stdout=StringIO())
+        self.assert_rollup()
+
+
+class ReportCacheTest(TransactionTestCase):
+    """
+    Cached report data is rebuilt once the transaction changing the data of the class commits
+    """
+
+    def setUp(self):
+        create_groups()
+        cache.clear()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (1, 2)]
+        subject = Subject.objects.create(which_class=self.class_obj, name='Subject')
+        add_test(self.class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, [subject], self.student_list,
+                 dict(((subject.id, student.id), 10) for student in self.student_list))
+        self.builds = 0
+
+    def get_report(self):
+        def build():
+            self.builds += 1
+            return self.builds
+        return get_report('test', self.class_obj.id, 'key', build)
+
+    def test_rebuild(self):
+        self.assertEqual(self.get_report(), 1)
+        self.assertEqual(self.get_report(), 1)
+        save_attendance(self.student_list, datetime.date(2016, 6, 30), [self.student_list[0].id])
+        self.assertEqual(self.get_report(), 2)
+        mark = Marks.objects.first()
+        mark.marks = 20
+        mark.save()
+        self.assertEqual(self.get_report(), 3)
+        # another server process, with a local-memory cache of its own, sees the bump of this one
+        with mock.patch('attendance.report_cache.cache', LocMemCache('other', {})):
+            self.assertEqual(self.get_report(), 4)
+            save_attendance(self.student_list, datetime.date(2016, 6, 30), [])
+        self.assertEqual(self.get_report(), 5)
+        version = get_class_version(self.class_obj.id)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                mark.marks = 30
+                mark.save()
+                raise ValueError
+        self.assertEqual(get_class_version(self.class_obj.id), version)
+        self.assertEqual(self.get_report(), 5)
+
+
+class UserContextTest(TransactionTestCase):
+    """
+    A user losing a group is refused on their next request, whichever server process removed it
+    """
+
+    def test_revoke(self):
+        create_groups()
+        teacher = create_teacher(Class.objects.create(grade=1, division='A'))
+        self.client.force_login(teacher.user)
+        self.assertTemplateNotUsed(self.client.get(reverse('teacher_attendance_today')),
+                                   'attendance/unauthorised.html')
+        with mock.patch('attendance.report_cache.cache', LocMemCache('other', {})):
+            teacher.user.groups.remove(Group.objects.get(name='Teacher'))
+        self.assertTemplateUsed(self.client.get(reverse('teacher_attendance_today')), 'attendance/unauthorised.html')
+
+
+class RosterImportTest(TestCase):
+    """
+    A roster is imported whole, or rejected with every error of its lines and nothing written
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.student = create_student(self.class_obj, 1, 'taken')
+        subject = Subject.objects.create(which_class=self.class_obj, name='Subject')
+        add_test(self.class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, [subject], [self.student],
+                 {(subject.id, self.student.id): 50})
+        self.client.force_login(create_teacher(self.class_obj).user)
+
+    def upload(self, lines):
+        roster = SimpleUploadedFile('roster.csv', '\n'.join(lines).encode('utf-8'), 'text/csv')
+        return self.client.post(reverse('teacher_student_import'), {'roster': roster})
+
+    def test_import(self):
+        response = self.upload(['phone,roll,full_name,username,password',
+                                '9876543210,2,Second Student,second,secret2',
+                                '',
+                                '9876543211,3,Third Student,third,secret3'])
+        self.assertEqual(response['Location'], reverse('teacher_student_import') + '?status=success')
+        student = Student.objects.get(user__username='third')
+        self.assertEqual((student.which_class, student.roll_no, student.name, student.phone),
+                         (self.class_obj, 3, 'Third Student', 9876543211))
+        self.assertTrue(student.user.check_password('secret3'))
+        self.assertEqual(list(student.user.groups.values_list('name', flat=True)), ['Student'])
+        self.assertEqual(list(Marks.objects.filter(student__user__username__in=['second', 'third']).values_list(
+            'marks', flat=True)), [0, 0])
+
+    def test_errors(self):
+        response = self.upload(['roll,full_name,username,password,phone',
+                                '2,Second Student,second,secret,9876543210',
+                                '2,Repeated Roll,other,secret,9876543210',
+                                '1,Taken Roll,another,secret,9876543210',
+                                '4,Taken Username,taken,secret,9876543210',
+                                '5,Repeated Username,second,secret,12345',
+                                'six,,sixth,secret,phone'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['roster_errors'], [
+            (3, 'roll number 2 repeats line 2'),
+            (4, 'roll number 1 is taken in the class'),
+            (5, 'username taken exists already'),
+            (6, 'phone number 12345 does not have 10 digits'),
+            (6, 'username second repeats line 2'),
+            (7, 'full_name is missing'),
+            (7, 'phone number phone is not a number'),
+            (7, 'roll number six is not a number'),
+        ])
+        self.assertEqual(list(Student.objects.values_list('id', flat=True)), [self.student.id])
+
+    def test_missing_column(self):
+        with self.assertRaises(RosterError) as raised:
+            parse_roster('roll,full_name,username,phone\n2,Second Student,second,9876543210\n', self.class_obj.id)
+        self.assertEqual(raised.exception.errors, [(1, 'missing column password')])
+
+
+@skipIf(numpy is None, 'NumPy is not installed')
+class AnalyticsTest(TestCase):
+    """
+    The class statistics on known marks, with the placeholders of a student who joined late left out
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (1, 2, 3)]
+        subject_list = [Subject.objects.create(which_class=self.class_obj, name=name) for name in ('Maths', 'Science')]
+        marks = {'Maths': (50, 60, 60), 'Science': (80, 70, 20)}
+        add_test(self.class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, subject_list, self.student_list,
+                 dict(((subject.id, student.id), marks[subject.name][index]) for subject in subject_list
+                      for index, student in enumerate(self.student_list)))
+        import_roster(parse_roster('roll,full_name,username,password,phone\n4,Student 4,late,secret,9876543210\n',
+                                   self.class_obj.id), self.class_obj.id)
+
+    def test_statistics(self):
+        analytics = get_class_analytics(self.class_obj.id)
+        self.assertEqual([(test['subject'], test['count'], test['mean'], test['median'], test['std'])
+                          for test in analytics['tests']],
+                         [('Maths', 3, 56.67, 60.0, 4.71), ('Science', 3, 56.67, 70.0, 26.25)])
+        self.assertEqual([(student['roll_no'], student['score'], student['percentile'], student['rank'],
+                           student['failing']) for student in analytics['students']],
+                         [(1, 65.0, 66.67, 1, []), (2, 65.0, 66.67, 1, []), (3, 40.0, 16.67, 3, ['Science']),
+                          (4, None, None, None, [])])
+        self.assertEqual(analytics['toppers'], [
+            {'subject': 'Maths', 'students': ['Student 2', 'Student 3'], 'percentage': 60.0},
+            {'subject': 'Science', 'students': ['Student 1'], 'percentage': 80.0},
+        ])
+        self.assertEqual([student['roll_no'] for student in analytics['at_risk']], [3])
+
+    def test_entered_marks(self):
+        # a 0 entered by the teacher counts, unlike the placeholder it replaces
+        mark = Marks.objects.get(student__roll_no=4, test__subject__name='Maths')
+        update_marks({mark.id: 0})
+        analytics = get_class_analytics(self.class_obj.id)
+        self.assertEqual(analytics['tests'][0]['count'], 4)
+        self.assertEqual(analytics['students'][3]['score'], 0.0)
+        self.assertEqual([student['roll_no'] for student in analytics['at_risk']], [3, 4])
+
+
+class FakeDispatcher(object):
+    """
+    Dispatcher accepting every message without sending it, calling during() while the messages are being sent
+    """
+
+    def __init__(self, during=None):
+        self.messages = []
+        self.during = during
+
+    def send_all(self, messages):
+        self.messages.extend(messages)
+        if self.during is not None:
+            self.during()
+        return [True] * len(messages)
+
+
+class SmsOutboxTest(TestCase):
+    """
+    Absences are sent by a single worker, and the ones corrected or left behind by a stopped worker are dealt with
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (1, 2, 3)]
+        for student in self.student_list:
+            student.phone = 9876543210 + student.roll_no
+            student.save()
+        self.date = datetime.date(2016, 6, 1)
+        save_attendance(self.student_list, self.date, [])
+
+    def test_double_claim(self):
+        other = FakeDispatcher()
+        results = []
+        # a second worker looking for absences while the first one is still sending them
+        dispatcher = FakeDispatcher(lambda: results.append(send_outbox_batch(other)))
+        self.assertEqual(send_outbox_batch(dispatcher), (3, 0))
+        self.assertEqual(results, [(0, 0)])
+        self.assertEqual(other.messages, [])
+        self.assertEqual(sorted(phone for phone, message in dispatcher.messages),
+                         [student.phone for student in self.student_list])
+        self.assertEqual(set(SmsOutbox.objects.values_list('status', 'attempts')), {(SmsOutbox.SENT, 1)})
+        self.assertEqual(send_outbox_batch(FakeDispatcher()), (0, 0))
+
+    def test_absences_of_a_parent_sent_together(self):
+        first, second = self.student_list[:2]
+        second.phone = first.phone
+        second.save()
+        SmsOutbox.objects.filter(student=second).update(phone=first.phone)
+        save_attendance(self.student_list, datetime.date(2016, 6, 2), [self.student_list[2].id])
+        dispatcher = FakeDispatcher()
+        # every pending absence of the parent of the oldest one is sent, in one message
+        self.assertEqual(send_outbox_batch(dispatcher, batch_size=1), (4, 0))
+        message = 'Absences of your wards: %s on 2016-06-01, %s on 2016-06-01, %s on 2016-06-02, %s on 2016-06-02' % (
+            first.user.username, second.user.username, first.user.username, second.user.username)
+        self.assertEqual(dispatcher.messages, [(first.phone, message)])
+
+    def test_cancel_when_marked_present(self):
+        SmsOutbox.objects.filter(student=self.student_list[2]).update(status=SmsOutbox.SENT)
+        save_attendance(self.student_list, self.date, [student.id for student in self.student_list])
+        # the absence already reported stays in the outbox, the others are never sent
+        self.assertEqual(list(SmsOutbox.objects.values_list('student', 'status')),
+                         [(self.student_list[2].id, SmsOutbox.SENT)])
+        self.assertEqual(send_outbox_batch(FakeDispatcher()), (0, 0))
+
+    def test_reset_interrupted(self):
+        SmsOutbox.objects.filter(student=self.student_list[0]).update(
+            status=SmsOutbox.SENDING, claim='stopped', claimed=timezone.now() - datetime.timedelta(hours=1))
+        SmsOutbox.objects.filter(student=self.student_list[1]).update(
+            status=SmsOutbox.SENDING, claim='running', claimed=timezone.now())
+        self.assertEqual(reset_interrupted_outbox(600), 1)
+        self.assertEqual(SmsOutbox.objects.get(student=self.student_list[0]).status, SmsOutbox.PENDING)
+        self.assertEqual(SmsOutbox.objects.get(student=self.student_list[1]).claim, 'running')
+        # the absence claimed by the running worker is not sent again
+        dispatcher = FakeDispatcher()
+        self.assertEqual(send_outbox_batch(dispatcher), (2, 0))
+        self.assertNotIn(self.student_list[1].phone, [phone for phone, message in dispatcher.messages])
+
+
+class SqlProfilerTest(TestCase):
+    """
+    A foreign key read lazily in a loop is reported as an N+1 query, and read with a join it is not
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        for roll_no in range(1, sql_profiler.THRESHOLD + 3):
+            create_student(self.class_obj, roll_no)
+
+    def get_profile(self, view):
+        with mock.patch('attendance.sql_profiler.ENABLED', True), \
+                mock.patch('attendance.sql_profiler.cache', LocMemCache('profiles', {})):
+            middleware = sql_profiler.SqlProfilerMiddleware(view)
+            middleware(RequestFactory().get('/edu/'))
+            return sql_profiler.get_recent_profiles()[0]
+
+    def test_loop_over_foreign_key(self):
+        def view(request):
+            return HttpResponse(', '.join(str(student.which_class) for student in Student.objects.all()))
+
+        profile = self.get_profile(view)
+        self.assertEqual(profile['queries'], sql_profiler.THRESHOLD + 3)
+        self.assertEqual(len(profile['repeated']), 1)
+        self.assertEqual(profile['repeated'][0]['count'], sql_profiler.THRESHOLD + 2)
+        self.assertIn('attendance_class', profile['repeated'][0]['shape'])
+        (code, template), runs = profile['repeated'][0]['origins'][0]
+        self.assertTrue(code.startswith('attendance/tests.py:'))
+
+    def test_select_related(self):
+        def view(request):
+            return HttpResponse(', '.join(str(student.which_class)
+                                          for student in Student.objects.select_related('which_class')))
+
+        profile = self.get_profile(view)
+        self.assertEqual(profile['queries'], 1)
+        self.assertEqual(profile['repeated'], [])
+
+
+class MetricsTest(TestCase):
+    """
+    The request metrics are served in the Prometheus text format, only to the allowed addresses
+    """
+
+    def setUp(self):
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+    def test_exposition_format(self):
+        with mock.patch('attendance.metrics.BUCKETS', (0.1, 1)):
+            metrics.record_request('teacher_index', 0.05, 200, 3, 0.01, 0.02)
+            metrics.record_request('teacher_index', 0.5, 302, 1, 0.005, 0.0)
+            metrics.record_request('say "hi"', 2, 200)
+            text = metrics.get_metrics_text()
+        self.assertEqual(text.splitlines(), [
+            '# HELP edusys_request_duration_seconds Time taken to answer requests, per view.',
+            '# TYPE edusys_request_duration_seconds histogram',
+            'edusys_request_duration_seconds_bucket{view="say \\"hi\\"",le="0.1"} 0',
+            'edusys_request_duration_seconds_bucket{view="say \\"hi\\"",le="1.0"} 0',
+            'edusys_request_duration_seconds_bucket{view="say \\"hi\\"",le="+Inf"} 1',
+            'edusys_request_duration_seconds_sum{view="say \\"hi\\""} 2.0',
+            'edusys_request_duration_seconds_count{view="say \\"hi\\""} 1',
+            'edusys_request_duration_seconds_bucket{view="teacher_index",le="0.1"} 1',
+            'edusys_request_duration_seconds_bucket{view="teacher_index",le="1.0"} 2',
+            'edusys_request_duration_seconds_bucket{view="teacher_index",le="+Inf"} 2',
+            'edusys_request_duration_seconds_sum{view="teacher_index"} 0.55',
+            'edusys_request_duration_seconds_count{view="teacher_index"} 2',
+            '# HELP edusys_requests_total Requests answered, per view and status code.',
+            '# TYPE edusys_requests_total counter',
+            'edusys_requests_total{view="say \\"hi\\"",status="200"} 1',
+            'edusys_requests_total{view="teacher_index",status="200"} 1',
+            'edusys_requests_total{view="teacher_index",status="302"} 1',
+            '# HELP edusys_request_queries_total SQL queries run by requests, per view.',
+            '# TYPE edusys_request_queries_total counter',
+            'edusys_request_queries_total{view="say \\"hi\\""} 0',
+            'edusys_request_queries_total{view="teacher_index"} 4',
+            '# HELP edusys_request_db_seconds_total Time spent running SQL queries, per view.',
+            '# TYPE edusys_request_db_seconds_total counter',
+            'edusys_request_db_seconds_total{view="say \\"hi\\""} 0.0',
+            'edusys_request_db_seconds_total{view="teacher_index"} 0.015',
+            '# HELP edusys_request_template_seconds_total Time spent rendering templates, queries they run '
+            'included, per view.',
+            '# TYPE edusys_request_template_seconds_total counter',
+            'edusys_request_template_seconds_total{view="say \\"hi\\""} 0.0',
+            'edusys_request_template_seconds_total{view="teacher_index"} 0.02',
+        ])
+
+    def test_allowed_addresses(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('edusys_requests_total', response.content.decode())
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1').status_code, 403)
+
+    def test_token(self):
+        with mock.patch('attendance.metrics.TOKEN', 'secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1',
+                                             HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1',
+                                             HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1',
+                                             HTTP_AUTHORIZATION='Bearer secret').status_code, 403)
+
+
+class DashboardTest(TestCase):
+    """
+    The dashboard snapshot of a student is rebuilt after their attendance or marks change, and only theirs
+    """
+
+    def setUp(self):
+        create_groups()
+        self.class_obj = Class.objects.create(grade=1, division='A')
+        self.student_list = [create_student(self.class_obj, roll_no) for roll_no in (1, 2)]
+        self.subject = Subject.objects.create(which_class=self.class_obj, name='Maths')
+        add_test(self.class_obj.id, 'Exam', datetime.date(2016, 6, 1), 100, [self.subject], self.student_list,
+                 dict(((self.subject.id, student.id), 50) for student in self.student_list))
+        save_attendance(self.student_list, datetime.date(2016, 6, 1), [student.id for student in self.student_list])
+        for student in self.student_list:
+            get_dashboard(student.id)
+
+    def edit_marks(self, student, marks):
+        mark = Marks.objects.get(student=student)
+        edit_test(Test.objects.all(), 100, {mark.id: mark.marks}, {mark.id: marks})
+
+    def get_snapshots(self):
+        return dict(StudentDashboard.objects.values_list('student', 'data'))
+
+    def test_snapshot_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            dashboard = get_dashboard(self.student_list[0].id)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(dashboard['tests'][0][1], ['50.00'])
+
+    def test_attendance(self):
+        first, second = self.student_list
+        save_attendance(self.student_list, datetime.date(2016, 6, 1), [second.id])
+        self.assertEqual(self.get_snapshots()[first.id], '')
+        self.assertNotEqual(self.get_snapshots()[second.id], '')
+        self.assertEqual(get_dashboard(first.id)['attendance']['present'], 0)
+        self.assertEqual(get_dashboard(second.id)['attendance']['present'], 1)
+
+    def test_marks(self):
+        first, second = self.student_list
+        self.edit_marks(first, 75)
+        self.assertEqual(self.get_snapshots()[first.id], '')
+        self.assertNotEqual(self.get_snapshots()[second.id], '')
+        self.assertEqual(get_dashboard(first.id)['tests'][0][1], ['75.00'])
+        self.assertEqual(get_dashboard(second.id)['tests'][0][1], ['50.00'])
+
+    def test_write_during_rebuild(self):
+        first = self.student_list[0]
+        StudentDashboard.invalidate([first.id])
+
+        def build_racing_with_write(student):
+            dashboard = build_dashboard(student)
+            self.edit_marks(first, 75)
+            return dashboard
+
+        with mock.patch('attendance.dashboard.build_dashboard', build_racing_with_write):
+            self.assertEqual(get_dashboard(first.id)['tests'][0][1], ['50.00'])
+        # the snapshot built from the marks before the write is not kept
+        self.assertEqual(self.get_snapshots()[first.id], '')
+        self.assertEqual(get_dashboard(first.id)['tests'][0][1], ['75.00'])
+
+
+class ExamMigrationTest(TransactionTestCase):
+    """
+    The exam migrations group the existing tests of a class by name into exams
+    """
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_tests_grouped_into_exams(self):
+        apps = self.migrate([('attendance', '0006_student_dashboard')])
+        Class = apps.get_model('attendance', 'Class')
+        Subject = apps.get_model('attendance', 'Subject')
+        Test = apps.get_model('attendance', 'Test')
+        first, second = [Class.objects.create(grade=grade, division='A') for grade in (1, 2)]
+        tests = {}
+        for class_obj, subject_name, name, day in ((first, 'Maths', 'Midterm', 3), (first, 'Science', 'Midterm', 2),
+                                                   (first, 'Maths', 'Final', 20), (second, 'Maths', 'Midterm', 5)):
+            subject = Subject.objects.get_or_create(which_class=class_obj, name=subject_name)[0]
+            tests[(class_obj.grade, subject_name, name)] = Test.objects.create(
+                subject=subject, name=name, total_marks=100, date=datetime.date(2016, 6, day)).pk
+
+        apps = self.migrate([('attendance', '0008_test_exam_required')])
+        Exam = apps.get_model('attendance', 'Exam')
+        Test = apps.get_model('attendance', 'Test')
+        self.assertEqual(sorted(Exam.objects.values_list('which_class__grade', 'name', 'date')), [
+            (1, 'Final', datetime.date(2016, 6, 20)),
+            (1, 'Midterm', datetime.date(2016, 6, 2)),
+            (2, 'Midterm', datetime.date(2016, 6, 5)),
+        ])
+        for (grade, subject_name, name), pk in tests.items():
+            exam = Test.objects.select_related('exam__which_class').get(pk=pk).exam
+            self.assertEqual((exam.which_class.grade, exam.name), (grade, name))
@@ -1,7 +1,7 @@
 import django.contrib.auth.views
 from django.conf.urls import url
 
-from attendance import views
+from attendance import api, views
 from attendance.views import validate_login, common_login, admin_teacher_add, admin_index
 
 urlpatterns = [
@@ -22,6 +22,7 @@ urlpatterns = [
 
     url(r'^teacher/$', views.teacher_index, name="teacher_index"),
     url(r'^teacher/student/add/$', views.teacher_add_student, name="teacher_student_add"),
+    url(r'^teacher/student/import/$', views.teacher_student_import, name="teacher_student_import"),
     url(r'^teacher/student/remove/$', views.teacher_remove_student, name="teacher_student_remove"),
     url(r'^teacher/student/edit/$', views.teacher_student_edit, name="teacher_student_edit"),
     url(r'teacher/subject/add/$', views.teacher_subject_add, name="teacher_subject_add"),
@@ -41,5 +42,25 @@ urlpatterns = [
     url(r'student/$',views.student_index,name="student_index"),
 
     # ---------------------Principal---------------------------------------
-    url(r'principal/$', views.principal_index, name="principal_index")
+    url(r'principal/$', views.principal_index, name="principal_index"),
+
+    # ---------------------Export---------------------------------------
+    url(r'^export/class/$', views.export_class_report, name="export_class_report"),
+    url(r'^export/subject/$', views.export_subject_marks, name="export_subject_marks"),
+    url(r'^export/attendance/$', views.export_school_attendance, name="export_school_attendance"),
+
+    # ---------------------Report Jobs---------------------------------------
+    url(r'^jobs/$', views.report_jobs, name="report_jobs"),
+    url(r'^jobs/(?P<job_id>\d+)/$', views.report_job_status, name="report_job_status"),
+    url(r'^jobs/(?P<job_id>\d+)/download/$', views.report_job_download, name="report_job_download"),
+
+    # ---------------------API---------------------------------------
+    url(r'^api/students/$', api.students, name="api_students"),
+    url(r'^api/attendance/$', api.attendance, name="api_attendance"),
+    url(r'^api/tests/$', api.tests, name="api_tests"),
+    url(r'^api/marks/$', api.marks, name="api_marks"),
+
+    # ---------------------Debug---------------------------------------
+    url(r'^debug/sql/$', views.debug_sql_profiler, name="debug_sql_profiler"),
+    url(r'^metrics/$', views.metrics, name="metrics"),
 ]
@@ -1,18 +1,32 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, \
+    JsonResponse
 
 # Create your views here.
 from django.urls import reverse
-from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.crypto import constant_time_compare
 from django.utils.datastructures import MultiValueDictKeyError
 
 from attendance.forms import LoginForm, ClassForm, TeacherAddForm, TeacherRemoveForm, StudentAddForm, \
     get_StudentRemoveForm
-from attendance.models import Class, Teacher, Student, Subject
+from attendance.models import Class, Exam, ReportJob, Teacher, Student, Subject
 from attendance.helper import *
+from attendance.middleware import get_user_context
+from attendance.report_cache import get_report
+from attendance.dashboard import get_dashboard
+from attendance.analytics import get_class_analytics
+from attendance.bitmaps import summarize_term
+from attendance.report_jobs import JOB_KINDS, CONTENT_TYPES, get_artifact_path, get_class_report, get_job_kinds, \
+    submit_job
+from attendance.roster import COLUMNS as ROSTER_COLUMNS, RosterError, import_roster, parse_roster
+from attendance.export import export_response, class_report_rows, subject_marks_rows, school_attendance_rows
+from attendance import metrics as request_metrics, sql_profiler
+from attendance.sql_profiler import get_recent_profiles, sql_profiler_exempt
 
 
 class UserIntegrityFailException(Exception):
@@ -23,24 +37,25 @@ class RollNoExistsError(Exception):
     pass
 
 
-def redirect_user_to_index(user):
+def redirect_user_to_index(request):
     """
-    Used to direct user to their corresponding index page
-    :param user: User
+    Used to direct the logged in user to their corresponding index page
+    :param request: HttpRequest
     :return: HttpResponseRedirect
     """
-    if is_student(user):
+    role = get_user_context(request)['role']
+    if role == 'Student':
         # do something
         return HttpResponseRedirect(reverse('student_index'))
 
-    elif is_teacher(user):
+    elif role == 'Teacher':
         # do something
         return HttpResponseRedirect(reverse('teacher_index'))
 
-    elif is_admin(user):
+    elif role == 'Admin':
         # do something
         return HttpResponseRedirect(reverse('admin_index'))
-    elif is_principal(user):
+    elif role == 'Principal':
         # do something
         return HttpResponseRedirect(reverse('principal_index'))
     else:
@@ -49,7 +64,7 @@ def redirect_user_to_index(user):
 
 def common_login(request):
     if request.user.is_authenticated():
-        return redirect_user_to_index(request.user)
+        return redirect_user_to_index(request)
     context = get_error_context(request)
     context['form'] = LoginForm()
     return render(request, 'attendance/login.html', context)
@@ -74,7 +89,7 @@ def validate_login(request):
     if 'remember-me' not in request.POST:
         request.session.set_expiry(0)
     # the following is to classify the user
-    return redirect_user_to_index(user)
+    return redirect_user_to_index(request)
     # No need for a default as user will be one of these, else the user creation system is flawed
 
 
@@ -239,10 +254,9 @@ def teacher_add_student(request):
                 phone_number = form.cleaned_data['phone']  # returns int, hence equality below
                 if phone_number < 999999999 or phone_number > 10000000000:
                     return HttpResponseRedirect(reverse('teacher_student_add') + "?status=pherror")
-                rol_list = [student.roll_no for student in
-                            Student.objects.filter(which_class__teacher__user=request.user)]
                 roll = form.cleaned_data['roll']
-                if roll in rol_list:
+                class_id = request.user_context['class_id']
+                if Student.objects.filter(which_class_id=class_id, roll_no=roll).exists():
                     raise RollNoExistsError
                 user = User(username=form.cleaned_data['username'])
                 user.set_password(form.cleaned_data['password'])
@@ -252,13 +266,14 @@ def teacher_add_student(request):
                 student.name = form.cleaned_data['full_name']
                 student.phone = phone_number
                 student.roll_no = form.cleaned_data['roll']
-                student.which_class = Class.objects.get(teacher__user=request.user)
+                student.which_class_id = class_id
                 student.save()
-                for test in Test.objects.filter(subject__which_class__teacher__user=request.user):
+                for test in Test.objects.filter(subject__which_class_id=class_id):
                     mark = Marks()
                     mark.test = test
                     mark.student = student
                     mark.marks = 0
+                    mark.placeholder = True
                     mark.save()
             except IntegrityError:
                 return HttpResponseRedirect(reverse('teacher_student_add') + "?status=userexist")
@@ -274,10 +289,41 @@ def teacher_add_student(request):
         return render(request, 'attendance/teacher_student_add.html', context)
 
 
+@teacher_login_required
+def teacher_student_import(request):
+    context = get_error_context(request)
+    if request.method == 'POST':
+        '''Task
+        * validate the whole roster, show every error
+        * add all the students at once
+        '''
+        class_id = request.user_context['class_id']
+        try:
+            rows = parse_roster(request.FILES['roster'].read(), class_id)
+        except MultiValueDictKeyError:
+            return HttpResponseRedirect(reverse('teacher_student_import') + "?status=formerror")
+        except (RosterError, UnicodeDecodeError) as error:
+            context['roster_errors'] = getattr(error, 'errors', [(1, 'the file is not a UTF-8 CSV file')])
+        else:
+            try:
+                # hashed in this process, only the import_roster command starts a pool for the passwords
+                import_roster(rows, class_id)
+            except IntegrityError:
+                # a username was taken after the roster was validated
+                return HttpResponseRedirect(reverse('teacher_student_import') + "?status=userexist")
+            return HttpResponseRedirect(reverse('teacher_student_import') + "?status=success")
+    context['columns'] = ROSTER_COLUMNS
+    '''
+    !--- Context details ---!
+    * columns : the columns a roster must have
+    * roster_errors : list of (line, message) of the rejected roster, if any
+    '''
+    return render(request, 'attendance/teacher_student_import.html', context)
+
+
 @teacher_login_required
 def teacher_remove_student(request):
-    teacher = Teacher.objects.get(user=request.user)
-    query_set = Student.objects.filter(which_class=teacher.which_class)
+    query_set = Student.objects.filter(which_class_id=request.user_context['class_id'])
 
     if request.method == 'POST':
         form = get_StudentRemoveForm(query_set, request.POST)
@@ -301,46 +347,44 @@ def teacher_remove_student(request):
 
 @teacher_login_required
 def teacher_student_edit(request):
-    student_list = Student.objects.filter(which_class__teacher__user=request.user).order_by('roll_no')
+    student_list = Student.objects.filter(which_class_id=request.user_context['class_id']).order_by('roll_no')
     if request.method == "POST":
         '''
-        Iterate student list and save details, after verifying roll_no
+        Verify the submitted roll numbers, phone numbers and classes of the students,
+        then save only the details that changed
         '''
+        student_list = list(student_list)
+        class_ids = set(Class.objects.values_list('id', flat=True))
         roll_list = set()
+        edits = {}
+        deleted_ids = []
         for student in student_list:
             string = 'student_' + str(student.id) + '_'
             if string + 'delete' in request.POST:
-                student.user.delete()
-                student.delete()
+                deleted_ids.append(student.id)
                 continue
-            roll = int(request.POST[string + 'roll'])
-            if roll not in roll_list:
-                roll_list.add(roll)
-            else:
-                return HttpResponseRedirect(reverse('teacher_student_edit') + "?=status=rollerror")
-        student_list = Student.objects.filter(which_class__teacher__user=request.user)
-        for student in student_list:
-            string = 'student_' + str(student.id) + '_'
-            student.roll_no = int(request.POST[string + 'roll'])
-            phone_number = int(request.POST[string + 'phone'])
+            try:
+                roll = int(request.POST[string + 'roll'])
+                phone_number = int(request.POST[string + 'phone'])
+                class_id = int(request.POST[string + 'class'])
+                name = request.POST[string + 'full_name']
+            except (MultiValueDictKeyError, ValueError):
+                return HttpResponseRedirect(reverse('teacher_student_edit') + "?status=formerror")
+            if roll in roll_list:
+                return HttpResponseRedirect(reverse('teacher_student_edit') + "?status=rollerror")
+            roll_list.add(roll)
             if phone_number < 999999999 or phone_number > 10000000000:
                 return HttpResponseRedirect(reverse('teacher_student_edit') + "?status=pherror")
-            student.phone = phone_number
-            student.name = request.POST[string + 'full_name']
-            which_class = Class.objects.get(pk=int(request.POST[string + 'class']))
-            if not student.which_class == which_class:
-                for test in Test.objects.filter(subject__which_class=which_class):
-                    if not Marks.objects.filter(student=student, test=test).exists():
-                        mark = Marks()
-                        mark.test = test
-                        mark.student = student
-                        mark.marks = 0
-                        mark.save()
-            student.which_class = which_class
-            student.save()
-            if request.POST[string + 'new_password'] != "":
-                student.user.set_password(request.POST[string + 'new_password'])
-                student.user.save()
+            if class_id not in class_ids:
+                return HttpResponseRedirect(reverse('teacher_student_edit') + "?status=selecterror")
+            edits[student.id] = {
+                'roll_no': roll,
+                'phone': phone_number,
+                'name': name,
+                'which_class': class_id,
+                'password': request.POST.get(string + 'new_password', ''),
+            }
+        update_students(student_list, edits, deleted_ids)
         return HttpResponseRedirect(reverse('teacher_student_edit') + "?status=success")
     else:
         '''
@@ -359,11 +403,12 @@ def teacher_student_edit(request):
         return render(request, 'attendance/teacher_student_edit.html', context)
 
 
+@teacher_login_required
 def teacher_subject_add(request):
     if request.method == "POST":
         subject = Subject()
         subject.name = request.POST['subject']
-        subject.which_class = Teacher.objects.get(user=request.user).which_class
+        subject.which_class_id = request.user_context['class_id']
         subject.save()
         return HttpResponseRedirect(reverse('teacher_subject_add') + "?status=success")
     else:
@@ -376,12 +421,13 @@ def teacher_subject_add(request):
         return render(request, 'attendance/teacher_subject_add.html', context)
 
 
+@teacher_login_required
 def teacher_subject_edit(request):
     """
     To edit and delete subjects in class
     """
     context = get_error_context(request)
-    subject_list = Subject.objects.filter(which_class__teacher__user=request.user)
+    subject_list = Subject.objects.filter(which_class_id=request.user_context['class_id'])
     if request.method == "POST":
         for subject in subject_list:
             string = str(subject.id) + "_"
@@ -407,7 +453,7 @@ def teacher_subject_edit(request):
 
 @teacher_login_required
 def teacher_test_add(request):
-    student_list = Student.objects.filter(which_class__teacher__user=request.user).order_by('roll_no')
+    student_list = Student.objects.filter(which_class_id=request.user_context['class_id']).order_by('roll_no')
     if request.method == "POST":
         ''' TASKs
             check if the object exists
@@ -416,37 +462,28 @@ def teacher_test_add(request):
              if yes => Display a filled version of previous form to be edited
 
         '''
-        # Do something
+        subject_list = list(Subject.objects.filter(which_class_id=request.user_context['class_id']))
         try:
-            date = request.POST['date']
-            name = request.POST['test_name']
+            date = parse_date(request.POST['date'])
+            name = request.POST['test_name'].strip()
             total_marks = int(request.POST['marks_tot'])
-            test_list = []
-            for subject in Subject.objects.filter(which_class__teacher__user=request.user):
-                test = Test()
-                test.date = date
-                test.name = name
-                test.total_marks = total_marks
-                test.subject = subject
-                test.save()
-                test_list.append(test)
-            for test in test_list:
+            if date is None or name == "" or total_marks <= 0:
+                raise ValueError
+            marks = {}
+            for subject in subject_list:
                 for student in student_list:
-                    string = str(test.subject.id) + '_' + str(student.roll_no)
-                    marks = request.POST[string]
-                    mark = Marks()
-                    mark.student = student
-                    mark.test = test
-                    mark.marks = int(marks)
-                    mark.save()
-            return HttpResponseRedirect(reverse('teacher_test_add') + '?status=success')
-
-        except KeyError:
-            raise Exception("keyerr")
+                    string = str(subject.id) + '_' + str(student.roll_no)
+                    marks[(subject.id, student.id)] = parse_marks(request.POST[string], total_marks)
+        except (KeyError, ValueError):
+            return HttpResponseRedirect(reverse('teacher_test_add') + '?status=formerror')
+        if Exam.objects.filter(which_class_id=request.user_context['class_id'], name=name).exists():
+            return HttpResponseRedirect(reverse('teacher_test_add') + '?status=testexist')
+        try:
+            add_test(request.user_context['class_id'], name, date, total_marks, subject_list, student_list, marks)
         except IntegrityError:
-            raise Exception("Int")
-        except TypeError:
-            raise Exception("Type")
+            # the same exam was added by a concurrent request
+            return HttpResponseRedirect(reverse('teacher_test_add') + '?status=testexist')
+        return HttpResponseRedirect(reverse('teacher_test_add') + '?status=success')
     else:
         '''Description of form required:
         * Test Name (test_name)
@@ -456,7 +493,7 @@ def teacher_test_add(request):
             > list of TextBox (<subject.id>_<student_roll>)
         '''
         teacher_list = Teacher.objects.all()
-        subject_list = Subject.objects.filter(which_class__teacher__user=request.user)
+        subject_list = Subject.objects.filter(which_class_id=request.user_context['class_id'])
         context = get_error_context(request)
         context['teacher_list'] = teacher_list
         context['subject_list'] = subject_list
@@ -468,19 +505,20 @@ def teacher_test_add(request):
 def teacher_test_edit(request):
     context = get_error_context(request)
     if request.method == "POST":
-        test_name = request.POST['test']
-        test_list = Test.objects.filter(name=test_name)
+        try:
+            exam = Exam.objects.get(pk=int(request.POST['test']), which_class_id=request.user_context['class_id'])
+        except (KeyError, ValueError, Exam.DoesNotExist):
+            return HttpResponseRedirect(reverse('teacher_test_select') + '?status=selecterror')
+        test_list = Test.objects.filter(exam=exam)
         if 'edit' in request.POST:
             """ When edit checkbox is selected"""
             '''FORM
             * textbox -> name : <mark.id>
             * total_marks -> name : total_mark
             '''
-            test_list = test_list.order_by('name')
-            mark_list = []
-            for student in Student.objects.filter(which_class__teacher__user=request.user).order_by('roll_no'):
-                marks = Marks.objects.filter(student=student, test__name=test_name).order_by('test__subject__name')
-                mark_list.append(marks)
+            test_list = list(test_list.select_related('subject').order_by('subject__name'))
+            student_list = Student.objects.filter(which_class_id=request.user_context['class_id']).order_by('roll_no')
+            mark_list = get_marks_matrix(student_list, test_list)
             context['test_list'] = test_list
             context['mark_list'] = mark_list
             '''
@@ -494,28 +532,28 @@ def teacher_test_edit(request):
             """
             When the delete checkbox is selected.
             """
-            Test.objects.filter(name=test_name).delete()
+            exam.delete()
         else:
             """ Editing the test, and marks associated with it"""
-            total_mark = int(request.POST['total_mark'])
-            for test in test_list:
-                test.total_marks = total_mark
-                test.save()
-                marks = Marks.objects.filter(test=test)
-                for mark in marks:
-                    mark.marks = request.POST[str(mark.id)]
-                    mark.save()
+            test_list = list(test_list)
+            old_marks = dict(Marks.objects.filter(test__in=test_list).values_list('id', 'marks'))
+            try:
+                total_mark = int(request.POST['total_mark'])
+                if total_mark <= 0:
+                    raise ValueError
+                new_marks = dict((pk, parse_marks(request.POST[str(pk)], total_mark)) for pk in old_marks)
+            except (KeyError, ValueError):
+                return HttpResponseRedirect(reverse('teacher_test_select') + '?status=formerror')
+            edit_test(test_list, total_mark, old_marks, new_marks)
         return HttpResponseRedirect(reverse('teacher_test_select') + '?status=success')
     else:
         '''
         Form:
-        * List of all exams:
-        * list of test by name
+        * List of all exams by date (test)
         * 2 checkbox by name edit and delete
         '''
-        test_names = [test.name for test in Test.objects.filter(subject__which_class__teacher__user=request.user)]
-        test_names = set(test_names)
-        context['test_names'] = test_names
+        context['exam_list'] = Exam.objects.filter(which_class_id=request.user_context['class_id']).order_by(
+            'date', 'id')
         return render(request, 'attendance/teacher_test_select.html', context)
 
 
@@ -529,33 +567,34 @@ def teacher_report_view_single(request):
         return web page with required content
         '''
         student = Student.objects.get(pk=int(request.POST['student']))
+        try:
+            from_date, to_date, range_label = get_report_range(request.POST)
+        except ValueError:
+            return HttpResponseRedirect(reverse('teacher_report_single') + "?status=dateerror")
 
-        attendance = get_attendance_complete(student)
-        # for sqlite
-        test_names = set([test.name for test in
-                          Test.objects.filter(subject__which_class__teacher__user=request.user)])
-        ''' With MySql or Postgres
-        test_names = [test.name for test in
-                      Test.objects.filter(subject__which_class__teacher__user=request.user).order_by('date').distinct(
-                          'name')]
-        '''
-        mark_list = []
-        for test_name in test_names:
-            marks = Marks.objects.filter(student=student, test__name=test_name).order_by('test__subject__name')
-            mark_list.append(marks)
+        if from_date is None and to_date is None:
+            attendance = get_attendance_complete(student)
+        else:
+            attendance = get_attendance_report_from_to(student, from_date, to_date)
+        mark_list = [marks for exam, marks in get_exam_marks(student, request.user_context['class_id'])]
         context['student'] = student
+        context['from_date'] = from_date
+        context['to_date'] = to_date
+        context['range_label'] = range_label
         context['attendance'] = attendance
         context['mark_list'] = mark_list
-        context['subject_list'] = Subject.objects.filter(which_class__teacher__user=request.user)
+        context['subject_list'] = Subject.objects.filter(which_class_id=request.user_context['class_id']).order_by(
+            'name', 'id')
         '''
         !--- Context details ---!
         * student
         * from_date
         * to_date
+        * range_label : description of the dates
         * attendance :
             > Dictionary with keys : present, absent, total, percentage_present
         * mark_list list of list
-            > the inner list contains the
+            > the inner list contains the marks of the student in the tests of an exam, by subject name
         '''
 
         return render(request, 'attendance/teacher_report_single_view.html', context)
@@ -565,7 +604,8 @@ def teacher_report_view_single(request):
         * From date
         * To date
         '''
-        context['student_list'] = Student.objects.filter(which_class__teacher__user=request.user)
+        context['student_list'] = Student.objects.filter(which_class_id=request.user_context['class_id'])
+        context['report_ranges'] = REPORT_RANGES
         return render(request, 'attendance/teacher_report_single.html', context)
 
 
@@ -578,54 +618,64 @@ def teacher_report_class(request):
         return table with the data
         '''
         subject = Subject.objects.get(pk=int(request.POST['subject']))
-        student_list = Student.objects.filter(which_class__teacher__user=request.user).order_by('roll_no')
-        test_list = Test.objects.filter(subject=subject).order_by('date')
-        mark_list = []
-        attendance_list = []
-        for student in student_list:
-            attendance_list.append(get_attendance_complete(student))
-            student_marks = []
-            for test in test_list:
-                mark = Marks.objects.get(test=test, student=student)
-                student_marks.append(mark)
-            mark_list.append(student_marks)
+        class_id = request.user_context['class_id']
+        try:
+            from_date, to_date, range_label = get_report_range(request.POST)
+        except ValueError:
+            return HttpResponseRedirect(reverse('teacher_report_class') + "?status=dateerror")
+
+        def build_report():
+            student_list = list(Student.objects.filter(which_class_id=class_id).order_by('roll_no'))
+            attendance_list = get_attendance_students(student_list, from_date, to_date)
+            test_list, mark_list = get_subject_marks_report(student_list, [subject])[0][1:]
+            mark_list = [marks for student, marks in mark_list]
+            analytics = get_class_analytics(class_id, from_date, to_date)
+            if analytics is not None:
+                analytics['tests'] = [test for test in analytics['tests'] if test['subject_id'] == subject.id]
+            return {
+                'test_list': test_list,
+                'mark_list': mark_list,
+                'attendance_list': attendance_list,
+                'data_list': list(zip(attendance_list, mark_list)),
+                'analytics': analytics,
+            }
+
         context['subject'] = subject
-        context['mark_list'] = mark_list
-        context['attendance_list'] = attendance_list
-        context['data_list'] = zip(attendance_list, mark_list)
+        context['range_label'] = range_label
+        context.update(get_report('teacher_class', class_id, '%s:%s:%s' % (subject.id, from_date, to_date),
+                                  build_report))
         '''
         !--- Context details ---!
         * subject : subject whose marks being viewed
+        * test_list: tests of the subject ordered by date
         * mark_list: list of list
             > one row contains marks of one student in all test of the subject
-        * attendance_list: list of attendance of students, dictionary
+        * attendance_list: list of attendance of students in the chosen range, dictionary
             > keys: present, absent, total, percentage_present
+        * range_label : description of the range
+        * analytics : statistics of the class, see get_school_analytics, with the tests of the subject only,
+            None without NumPy
         '''
         return render(request, 'attendance/teacher_report_class_view.html', context)
     else:
         '''Form
         * Subject List (subject)
         '''
-        context['subject_list'] = Subject.objects.filter(which_class__teacher__user=request.user)
+        context['subject_list'] = Subject.objects.filter(which_class_id=request.user_context['class_id'])
+        context['report_ranges'] = REPORT_RANGES
         return render(request, 'attendance/teacher_report_class.html', context)
 
 
 @teacher_login_required
 def teacher_attendance_today(request):
-    teacher = Teacher.objects.get(user=request.user)
-    student_list = Student.objects.filter(which_class=teacher.which_class)
+    student_list = Student.objects.filter(which_class_id=request.user_context['class_id'])
     if request.method == "POST":
         '''Task
         Create attendance objects for each student
         and fill with data from form
         '''
-        for student in student_list:
-            string = 'student_' + str(student.id)
-            is_present = string in request.POST
-            attendance = Attendance(student=student)
-            attendance.is_present = is_present
-            attendance.date = timezone.now().date()
-            attendance.save()
+        present_ids = [student.id for student in student_list if 'student_' + str(student.id) in request.POST]
+        save_attendance(student_list, get_today(), present_ids)
         # return redirect
         return HttpResponseRedirect(reverse('teacher_attendance_today') + "?status=success")
     else:
@@ -637,8 +687,8 @@ def teacher_attendance_today(request):
         for each student in class
         * Student name as label, checkbox to determine present or not
         '''
-        attendance = Attendance.objects.filter(student__which_class__teacher__user=request.user).filter(
-            date=timezone.now().date()).order_by('student__roll_no')
+        attendance = Attendance.objects.filter(student__which_class_id=request.user_context['class_id']).filter(
+            date=get_today()).order_by('student__roll_no')
         context = get_error_context(request)
         if attendance.count() != 0:
             present = 0
@@ -663,18 +713,15 @@ def teacher_attendance_today(request):
         # attendance, student_list
 
 
+@teacher_login_required
 def teacher_attendance_edit(request):
     context = get_error_context(request)
-    attendance_list = Attendance.objects.filter(student__which_class__teacher__user=request.user).filter(
-        date=timezone.now().date()).order_by('student__roll_no')
-    print(timezone.now())
+    attendance_list = Attendance.objects.filter(student__which_class_id=request.user_context['class_id']).filter(
+        date=get_today()).order_by('student__roll_no')
     if request.method == 'POST':
-        for attendance in attendance_list:
-            if str(attendance.student.id) in request.POST:
-                attendance.is_present = True
-            else:
-                attendance.is_present = False
-            attendance.save()
+        student_list = [attendance.student for attendance in attendance_list.select_related('student')]
+        present_ids = [student.id for student in student_list if str(student.id) in request.POST]
+        save_attendance(student_list, get_today(), present_ids)
         return HttpResponseRedirect(reverse('teacher_attendance_today') + "?status=success")
     else:
         '''Form details
@@ -702,33 +749,19 @@ Views :
 @student_login_required
 def student_index(request):
     context = get_error_context(request)
-    student = Student.objects.get(user=request.user)
-    attendance = get_attendance_complete(student)
-    # for sqlite
-    test_names = set([test.name for test in
-                      Test.objects.filter(subject__which_class__student=student)])
-    ''' With MySql or Postgres
-    test_names = [test.name for test in
-                  Test.objects.filter(subject__which_class__teacher__user=request.user).order_by('date').distinct(
-                      'name')]
-    '''
-    mark_list = []
-    for test_name in test_names:
-        marks = Marks.objects.filter(student=student, test__name=test_name).order_by('test__subject__name')
-        mark_list.append(marks)
-    context['student'] = student
-    context['attendance'] = attendance
-    context['mark_list'] = mark_list
-    context['subject_list'] = Subject.objects.filter(which_class=student.which_class)
+    dashboard = get_dashboard(request.user_context['student_id'])
+    context['student'] = dashboard['student']
+    context['attendance'] = dashboard['attendance']
+    context['mark_list'] = dashboard['tests']
+    context['subject_list'] = dashboard['subjects']
     '''
     !--- Context details ---!
-    * student
-    * from_date
-    * to_date
+    * student : name of the student
     * attendance :
         > Dictionary with keys : present, absent, total, percentage_present
-    * mark_list list of list
-        > the inner list contains the
+    * subject_list : names of the subjects
+    * mark_list list of (test name, marks)
+        > marks contains the marks of the student in every subject, None where the subject had no such test
     '''
     return render(request, 'attendance/student_index.html', context)
 
@@ -744,40 +777,230 @@ def principal_index(request):
         '''Task
         return table with the data
         '''
-        student_list = Student.objects.filter(which_class__id=int(request.POST['class'])).order_by('roll_no')
-        attendance_list = []
-        for student in student_list:
-            attendance_list.append(get_attendance_complete(student))
-        subject_report_list = []
-        for subject in Subject.objects.filter(which_class__id=int(request.POST['class'])):
-            mark_list = []
-            for student in student_list:
-                student_marks = []
-                for test in Test.objects.filter(subject=subject):
-                    mark = Marks.objects.get(test=test, student=student)
-                    student_marks.append(mark)
-                mark_list.append(student_marks)
-            subject_report_list.append(mark_list)
-        context['subject_list'] = Subject.objects.filter(which_class__id=int(request.POST['class']))
-        context['subject_report_list'] = zip(Subject.objects.filter(which_class__id=int(request.POST['class'])),
-                                             subject_report_list)
-        context['attendance_list'] = attendance_list
-        context['class'] = Class.objects.get(pk=int(request.POST['class']))
-        context['teacher'] = Teacher.objects.get(which_class=context['class'])
+        class_id = int(request.POST['class'])
+        try:
+            from_date, to_date, range_label = get_report_range(request.POST)
+        except ValueError:
+            return HttpResponseRedirect(reverse('principal_index') + "?status=dateerror")
+
+        context.update(get_report('principal', class_id, '%s:%s' % (from_date, to_date),
+                                  lambda: get_class_report(class_id, from_date, to_date)))
+        context['class'] = Class.objects.get(pk=class_id)
+        context['range_label'] = range_label
         '''
         !--- Context details ---!
-        * subject : subject whose marks being viewed
-        * mark_list: list of list
-            > one row contains marks of one student in all test of the subject
-        * attendance_list: list of attendance of students, dictionary
+        * subject_report_list: list of (subject, test_list, mark_list)
+            > mark_list contains (student, marks) pairs, marks being the student's marks in all test of the subject
+        * attendance_list: list of attendance of students in the chosen range, dictionary
             > keys: present, absent, total, percentage_present
+        * range_label : description of the range
+        * analytics : statistics of the class, see get_school_analytics, None without NumPy
         '''
         return render(request, 'attendance/principal_view_report.html', context)
     else:
         '''Form
         * Class List (class)
         * Subject List(subject)
+        !--- Context details ---!
+        * overview : a dictionary for every class, see get_school_overview
+        * term : attendance of the whole school this term, see summarize_term
         '''
         context['class_list'] = Class.objects.all()
-        print (context['class_list'])
+        context['report_ranges'] = REPORT_RANGES
+        context['overview'] = get_school_overview()
+        context['term'] = summarize_term()
         return render(request, 'attendance/principle_index.html', context)
+
+
+########################################################################################################################
+#                                              Export                                                                  #
+########################################################################################################################
+
+def _export_class_id(request):
+    """
+    Returns the class a principal asked for in the class GET parameter, or the class of a teacher
+    """
+    if 'Principal' not in request.user_context['roles']:
+        return request.user_context['class_id']
+    try:
+        return Class.objects.get(pk=int(request.GET['class'])).id
+    except (MultiValueDictKeyError, ValueError, Class.DoesNotExist):
+        raise Http404('No such class')
+
+
+@group_login_required('Teacher', 'Principal')
+def export_class_report(request):
+    """
+    Attendance and marks of every student of a class, as CSV or with format=xlsx as an Excel file
+    """
+    class_obj = Class.objects.get(pk=_export_class_id(request))
+    return export_response(class_report_rows(class_obj.id), 'report_%s' % class_obj, request.GET.get('format'))
+
+
+@group_login_required('Teacher', 'Principal')
+def export_subject_marks(request):
+    """
+    Marks of every student of the class in every test of the subject in the subject GET parameter
+    """
+    try:
+        subject = Subject.objects.select_related('which_class').get(pk=int(request.GET['subject']))
+    except (MultiValueDictKeyError, ValueError, Subject.DoesNotExist):
+        raise Http404('No such subject')
+    if 'Principal' not in request.user_context['roles'] and subject.which_class_id != request.user_context['class_id']:
+        raise Http404('No such subject')
+    return export_response(subject_marks_rows(subject), 'marks_%s_%s' % (subject.which_class, subject.name),
+                           request.GET.get('format'))
+
+
+@principal_login_required
+def export_school_attendance(request):
+    """
+    Attendance of every student of the school, between the optional from and to GET parameters
+    """
+    try:
+        from_date = parse_date(request.GET.get('from', ''))
+        to_date = parse_date(request.GET.get('to', ''))
+    except ValueError:
+        raise Http404('Invalid date')
+    return export_response(school_attendance_rows(from_date, to_date), 'attendance', request.GET.get('format'))
+
+
+########################################################################################################################
+#                                              Report Jobs                                                             #
+########################################################################################################################
+
+def _job_status(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'description': JOB_KINDS[job.kind][0] if job.kind in JOB_KINDS else job.kind,
+        'status': job.status,
+        'created': job.created,
+        'started': job.started,
+        'finished': job.finished,
+        'error': job.error,
+        'download': reverse('report_job_download', args=[job.id]) if job.status == ReportJob.DONE else None,
+    }
+
+
+def _get_job(request, job_id):
+    try:
+        return ReportJob.objects.get(pk=int(job_id), user=request.user)
+    except ReportJob.DoesNotExist:
+        raise Http404('No such report')
+
+
+@group_login_required('Teacher', 'Principal')
+def report_jobs(request):
+    context = get_error_context(request)
+    roles = request.user_context['roles']
+    kinds = dict((kind, per_class) for kind, description, per_class in get_job_kinds(roles))
+    if request.method == "POST":
+        '''Task
+        * Get the kind of report, its class and dates
+        queue the report and return to the list of reports
+        '''
+        kind = request.POST.get('kind')
+        if kind not in kinds:
+            return HttpResponseRedirect(reverse('report_jobs') + '?status=selecterror')
+        try:
+            from_date, to_date, range_label = get_report_range(request.POST)
+        except ValueError:
+            return HttpResponseRedirect(reverse('report_jobs') + '?status=dateerror')
+        params = {
+            'from': from_date and from_date.isoformat(),
+            'to': to_date and to_date.isoformat(),
+            'range_label': range_label,
+            'format': 'xlsx' if request.POST.get('format') == 'xlsx' else 'csv',
+        }
+        if kinds[kind]:
+            if 'Principal' in roles:
+                try:
+                    params['class_id'] = Class.objects.get(pk=int(request.POST['class'])).id
+                except (MultiValueDictKeyError, ValueError, Class.DoesNotExist):
+                    return HttpResponseRedirect(reverse('report_jobs') + '?status=selecterror')
+            else:
+                params['class_id'] = request.user_context['class_id']
+        submit_job(request.user, kind, params)
+        return HttpResponseRedirect(reverse('report_jobs') + '?status=jobqueued')
+    else:
+        '''Form
+        * Kind of report (kind)
+        * Class List (class), for the principal
+        * Range of dates and format
+        !--- Context details ---!
+        * job_list : the latest reports of the user, dictionaries of _job_status
+        * refresh : whether a report is still being prepared, to reload the page
+        '''
+        context['job_list'] = [_job_status(job) for job in
+                               ReportJob.objects.filter(user=request.user).order_by('-id')[:20]]
+        context['refresh'] = any(job['status'] in (ReportJob.PENDING, ReportJob.RUNNING)
+                                 for job in context['job_list'])
+        context['kind_list'] = get_job_kinds(roles)
+        if 'Principal' in roles:
+            context['class_list'] = Class.objects.all()
+            context['index_url'] = reverse('principal_index')
+        else:
+            context['index_url'] = reverse('teacher_index')
+        context['report_ranges'] = REPORT_RANGES
+        return render(request, 'attendance/report_jobs.html', context)
+
+
+@group_login_required('Teacher', 'Principal')
+def report_job_status(request, job_id):
+    """
+    Status of a report of the user as JSON, with the link to download it once it is done
+    """
+    return JsonResponse(_job_status(_get_job(request, job_id)))
+
+
+@group_login_required('Teacher', 'Principal')
+def report_job_download(request, job_id):
+    """
+    The file of a finished report of the user
+    """
+    job = _get_job(request, job_id)
+    if job.status != ReportJob.DONE:
+        raise Http404('The report is not ready')
+    try:
+        artifact = open(get_artifact_path(job), 'rb')
+    except IOError:
+        raise Http404('The report has expired')
+    response = FileResponse(artifact, content_type=CONTENT_TYPES.get(job.artifact.rsplit('.', 1)[-1],
+                                                                     'application/octet-stream'))
+    response['Content-Disposition'] = 'attachment; filename="%s"' % job.filename
+    return response
+
+
+########################################################################################################################
+#                                              Debug                                                                   #
+########################################################################################################################
+
+@sql_profiler_exempt
+@staff_member_required
+def debug_sql_profiler(request):
+    '''
+    !--- Context details ---!
+    * enabled : whether SQL_PROFILER is set
+    * threshold : runs of a query shape in one request reported as N+1
+    * profile_list : the most recent profiles, see SqlProfilerMiddleware
+    '''
+    context = {
+        'enabled': sql_profiler.ENABLED,
+        'threshold': sql_profiler.THRESHOLD,
+        'profile_list': get_recent_profiles(),
+    }
+    return render(request, 'attendance/debug_sql_profiler.html', context)
+
+
+def metrics(request):
+    """
+    Request metrics in the Prometheus text format, only for the addresses in METRICS_ALLOWED_IPS
+    and, when METRICS_TOKEN is set, requests bearing it
+    """
+    if request.META.get('REMOTE_ADDR') not in request_metrics.ALLOWED_IPS:
+        return HttpResponseForbidden()
+    if request_metrics.TOKEN and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                                           'Bearer ' + request_metrics.TOKEN):
+        return HttpResponseForbidden()
+    return HttpResponse(request_metrics.get_metrics_text(), content_type='text/plain; version=0.0.4; charset=utf-8')